@@ -1,48 +1,103 @@
-import tkinter as tk
-from tkinter import font
-from reinforcementLearningWithGui import load_q_table
-# Example Q-table
-q_table = load_q_table('QTable.json')
-
-# Initialize Tkinter window
-root = tk.Tk()
-root.title("Q-Table Display")
-
-# Customize fonts and colors
-header_font = font.Font(family="Helvetica", size=12, weight="bold")
-q_value_font = font.Font(family="Helvetica", size=10)
-bg_color = "#f0f0f0"
-header_color = "#c0c0c0"
-
-# Create a frame for the Q-table
-frame = tk.Frame(root, bg=bg_color)
-frame.pack(padx=10, pady=10, fill="both", expand=True)
-
-
-# Function to create Q-value labels for each state
-def create_q_table_display():
-    row = 0
-    for state, actions in q_table.items():
-        state_label = tk.Label(frame, text=f"State {state}", font=header_font, bg=header_color, borderwidth=1,
-                               relief="solid")
-        state_label.grid(row=row, column=0, padx=5, pady=5, sticky="nsew")
-
-        col = 1
-        for action, q_value in actions.items():
-            action_label = tk.Label(frame, text=f"{action}: {q_value:.2f}", font=q_value_font, bg="white",
-                                    borderwidth=1, relief="solid")
-            action_label.grid(row=row, column=col, padx=5, pady=5, sticky="nsew")
-            col += 1
-
-        row += 1
-
-
-# Create the Q-table display
-create_q_table_display()
-
-# Adjust column weights to expand the grid cells
-for col in range(5):
-    frame.grid_columnconfigure(col, weight=1)
-
-# Run the Tkinter main loop
-root.mainloop()
+import base64
+import sys
+
+from checkpoint import load_q_table
+from qTableReport import heatmap_png
+from reinforcementLearningWithGui import action_to_delta, goal, obstacles, start
+
+
+def show_q_table(filename='QTable.json'):
+    # Tk is only imported when the window is opened, so the module can be
+    # imported (and the table loaded) on machines without a display
+    import tkinter as tk
+    from tkinter import font, ttk
+
+    # Example Q-table
+    q_table = load_q_table(filename)
+    rows, cols = q_table.grid_size
+    page_size = 100
+
+    # Initialize Tkinter window
+    root = tk.Tk()
+    root.title("Q-Table Display")
+
+    # Customize fonts and colors
+    header_font = font.Font(family="Helvetica", size=12, weight="bold")
+    q_value_font = font.Font(family="Helvetica", size=10)
+    bg_color = "#f0f0f0"
+
+    # Create a frame for the Q-table
+    frame = tk.Frame(root, bg=bg_color)
+    frame.pack(padx=10, pady=10, fill="both", expand=True)
+
+    # Heatmap of max Q per cell as a single image, scaled up to about 400 pixels,
+    # with greedy-action arrows when the cells are big enough to hold them
+    cell = max(1, 400 // max(rows, cols))
+    heatmap = tk.PhotoImage(data=base64.b64encode(heatmap_png(q_table, start, [goal], obstacles))).zoom(cell)
+    canvas = tk.Canvas(frame, width=cols * cell, height=rows * cell, bg=bg_color, highlightthickness=0)
+    canvas.create_image(0, 0, image=heatmap, anchor="nw")
+    canvas.grid(row=0, column=0, rowspan=2, padx=5, pady=5, sticky="n")
+    if cell >= 16:
+        greedy = q_table.array.argmax(axis=2)
+        deltas = [action_to_delta[action] for action in q_table.actions]
+        for x in range(rows):
+            for y in range(cols):
+                dx, dy = deltas[greedy[x, y]]
+                cx, cy, r = (y + 0.5) * cell, (x + 0.5) * cell, cell * 0.35
+                canvas.create_line(cx - dy * r, cy - dx * r, cx + dy * r, cy + dx * r, fill="white", arrow="last")
+
+    # Numeric Q-values one page of states at a time, the tree view only holds
+    # page_size rows however big the table is
+    columns = ["state"] + [f"{action}" for action in q_table.actions]
+    tree = ttk.Treeview(frame, columns=columns, show="headings", height=min(page_size, 25))
+    style = ttk.Style()
+    style.configure("Treeview.Heading", font=header_font)
+    style.configure("Treeview", font=q_value_font)
+    for column in columns:
+        tree.heading(column, text="State" if column == "state" else f"{column.upper()}:Q-Value")
+        tree.column(column, width=110, anchor="center")
+    tree.grid(row=0, column=1, padx=5, pady=5, sticky="nsew")
+
+    controls = tk.Frame(frame, bg=bg_color)
+    controls.grid(row=1, column=1, sticky="ew")
+    pages = max(1, -(-rows * cols // page_size))
+    page = tk.IntVar(value=1)
+    page_label = tk.Label(controls, bg=bg_color)
+
+    def show_page(number):
+        number = min(max(1, number), pages)
+        page.set(number)
+        page_label.config(text=f"Page {number} of {pages}")
+        tree.delete(*tree.get_children())
+        first = (number - 1) * page_size
+        values = q_table.array.reshape(rows * cols, -1)[first:first + page_size].tolist()
+        for s, row in enumerate(values, first):
+            tree.insert("", "end", values=[str(divmod(s, cols))] + [f"{q_value:.2f}" for q_value in row])
+
+    def show_cell(event):
+        # Clicking the heatmap jumps to that state's page
+        x, y = event.y // cell, event.x // cell
+        if x < rows and y < cols:
+            s = x * cols + y
+            show_page(s // page_size + 1)
+            item = tree.get_children()[s % page_size]
+            tree.selection_set(item)
+            tree.see(item)
+
+    tk.Button(controls, text="Previous", command=lambda: show_page(page.get() - 1)).pack(side="left")
+    page_label.pack(side="left", padx=10)
+    tk.Button(controls, text="Next", command=lambda: show_page(page.get() + 1)).pack(side="left")
+    canvas.bind("<Button-1>", show_cell)
+    show_page(1)
+
+    # Adjust column weights to expand the grid cells
+    frame.grid_columnconfigure(1, weight=1)
+    frame.grid_rowconfigure(0, weight=1)
+
+    # Run the Tkinter main loop
+    root.mainloop()
+
+
+if __name__ == "__main__":
+    # python QTableGui.py [table file], a JSON table or a binary checkpoint
+    show_q_table(*sys.argv[1:2])
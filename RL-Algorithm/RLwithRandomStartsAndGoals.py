@@ -1,5 +1,17 @@
+import ast
 import random
 import json
+import sys
+
+import numpy as np
+
+import checkpoint
+import eligibilityTraces
+import goalConditioned
+import gridEnv
+import parallelTraining
+from actionSelection import ActionSelector
+from qTable import QTable
 
 # Environment settings
 grid_size = (5, 5)
@@ -20,11 +32,28 @@ epsilon = 0.2  # Exploration rate
 num_episodes = 5000
 max_steps_per_episode = 200  # To prevent infinite loops
 
-# Initialize Q-table
-q_table = {}
-for x in range(grid_size[0]):
-    for y in range(grid_size[1]):
-        q_table[(x, y)] = {action: 0.0 for action in actions}
+action_selector = ActionSelector(len(actions))
+
+
+def get_q_table():
+    # The Q-table is allocated on first use, not when the script is imported
+    global q_table
+    if 'q_table' not in globals():
+        q_table = QTable(grid_size, actions)
+    return q_table
+
+
+def __getattr__(name):
+    # module.q_table from other modules goes through get_q_table too
+    if name == 'q_table':
+        return get_q_table()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# Goal-conditioned Q-table (one slab per goal cell) and the routes derived
+# from it, see train_goal_conditioned_q_learning
+goal_q_table = None
+route_cache = None
 
 
 def is_valid_state(state):
@@ -45,28 +74,32 @@ def get_reward(state, goal):
 
 
 def choose_action(state):
-    if random.uniform(0, 1) < epsilon:
-        return random.choice(actions)  # Exploration
-    else:
-        max_q = max(q_table[state].values())
-        return random.choice([action for action in actions if q_table[state][action] == max_q])  # Exploitation
+    # Explores with probability epsilon, otherwise a maximal action with ties
+    # broken at random, all from numbers pre-drawn by action_selector
+    return actions[action_selector.select(get_q_table().lookup(state[0], state[1]), epsilon)]
 
 
 def save_q_table(filename, q_table):
     with open(filename, 'w') as f:
-        q_table_str_keys = {str(k): v for k, v in q_table.items()}
+        q_table_str_keys = {str(k): v for k, v in q_table.to_dict().items()}
         json.dump(q_table_str_keys, f)
 
 
 def load_q_table(filename):
+    if filename.endswith(checkpoint.extension):
+        return checkpoint.load_checkpoint(filename)[0]  # Memory-mapped binary checkpoint
+
     with open(filename, 'r') as f:
         q_table_str_keys = json.load(f)
-    q_table = {eval(k): v for k, v in q_table_str_keys.items()}
+    q_table = QTable.from_dict({ast.literal_eval(k): v for k, v in q_table_str_keys.items()})
     return q_table
 
 
-# Training loop
-def train_q_learning():
+# Training loop, stopped early by a convergence.ConvergenceMonitor if given
+def train_q_learning(monitor=None):
+    q_table = get_q_table()
+    if monitor is not None:
+        monitor.start(q_table)
     for episode in range(num_episodes):
         state = random.choice(start_positions)
         goal = random.choice(goals)
@@ -76,23 +109,66 @@ def train_q_learning():
             reward = get_reward(next_state, goal)
 
             # Bellman equation update
-            max_future_q = max(q_table[next_state].values())
-            q_table[state][action] += alpha * (reward + gamma * max_future_q - q_table[state][action])
+            max_future_q = q_table.max_q(next_state)
+            td_error = q_table.update(state, action, reward + gamma * max_future_q, alpha)
+            if monitor is not None:
+                monitor.update(state, abs(alpha * td_error), q_table)
 
             state = next_state
 
             if state == goal:
                 break  # Exit if goal is reached
 
+        if monitor is not None and monitor.end_episode(_ + 1, state == goal):
+            print(monitor.reason)
+            break
+
+
+# Batched training loop, runs n_envs episodes in lockstep on array states
+def train_q_learning_batch(n_envs=256, seed=None):
+    return gridEnv.train_module_batch(sys.modules[__name__], n_envs, seed, skip_bumps=False)
+
+
+# Training spread over a process pool, see parallelTraining.train_q_learning_parallel
+def train_q_learning_parallel(n_workers=None, merge='average', seed=None, deterministic=False):
+    return parallelTraining.train_module_parallel(sys.modules[__name__], n_workers, merge=merge, seed=seed,
+                                                  deterministic=deterministic, skip_bumps=False)
+
+
+# Q(lambda) alternative to the one-step update: eligibility traces carry the
+# goal reward back along the whole trajectory, see eligibilityTraces.py
+def train_q_lambda(lam=0.9, n_envs=256, seed=None):
+    return eligibilityTraces.train_module_q_lambda(sys.modules[__name__], lam, n_envs, seed, skip_bumps=False)
+
+
+# The shared q_table above can't tell goals apart. This trains Q-values per
+# (state, goal) for every cell as goal, starting episodes anywhere on the grid,
+# then caches the greedy next hop of every (state, goal) pair.
+def train_goal_conditioned_q_learning(n_envs=64, seed=None):
+    global goal_q_table, route_cache
+    env = gridEnv.GridEnv.from_module(sys.modules[__name__])
+    goal_q_table = goalConditioned.GoalConditionedQTable(grid_size, actions)
+    stats = goalConditioned.train_goal_conditioned(env, goal_q_table, goal_q_table.goals, num_episodes, alpha, gamma,
+                                                   epsilon, max_steps_per_episode, n_envs,
+                                                   np.random.default_rng(seed))
+    route_cache = goalConditioned.RouteCache(goal_q_table, env)
+    return stats
+
+
+# Best path from the route cache, None if the learned policy doesn't reach the goal
+def extract_route(start, goal):
+    return route_cache.path(start, goal)
+
 
 # Extract the best path
 def extract_path(start, goal):
+    q_table = get_q_table()
     path = [start]
     state = start
     for _ in range(max_steps_per_episode):  # Limit steps to avoid infinite loops
         if state == goal:
             break
-        action = max(q_table[state], key=q_table[state].get)
+        action = actions[q_table.greedy_action(state)]
         next_state = get_next_state(state, action)
         if next_state == state:  # Prevent infinite loop
             break
@@ -123,6 +199,10 @@ if __name__ == "__main__":
     best_path = extract_path(_start, _goal)
     print(f"  Best path from {_start} to {_goal}: {best_path}")
 
+    # The same query answered by the goal-conditioned table
+    train_goal_conditioned_q_learning()
+    print(f"  Goal-conditioned path from {_start} to {_goal}: {extract_route(_start, _goal)}")
+
     # Print the final Q-Table for verification
     print("\nFinal Q-Table:")
     for state, actions in q_table.items():
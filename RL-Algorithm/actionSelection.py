@@ -0,0 +1,89 @@
+import numpy as np
+
+# Epsilon-greedy selection and environment steps for the Python-level
+# training loops without per-step allocations: random numbers are drawn from
+# a numpy Generator a block at a time, ties are broken by counting instead of
+# collecting them in a list, and next states come out of precomputed tables.
+
+
+class ActionSelector:
+    # Epsilon-greedy action choice with ties among the maximal actions broken
+    # uniformly at random. epsilon is passed on every call, so scripts that
+    # change it between runs keep working.
+    def __init__(self, n_actions, rng=None, block_size=4096):
+        self.n_actions = n_actions
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.block_size = block_size
+        self._next = block_size
+        self._uniforms = np.empty(0)
+
+    def seed(self, seed):
+        self.rng = np.random.default_rng(seed)
+        self._next = self.block_size
+        self._uniforms = np.empty(0)
+
+    def _refill(self):
+        draws = self.rng.random((3, self.block_size))
+        self._explore = draws[0].tolist()
+        self._random_actions = (draws[1] * self.n_actions).astype(np.int64).tolist()
+        self._tie_breaks = draws[2].tolist()
+        self._next = 0
+
+    def select(self, values, epsilon):
+        # Action index for one state given its action values (a list or array)
+        if self._next == self.block_size:
+            self._refill()
+        i = self._next
+        self._next = i + 1
+        if self._explore[i] < epsilon:
+            return self._random_actions[i]
+        if not isinstance(values, list):
+            values = values.tolist()
+        best = max(values)
+        ties = values.count(best)
+        if ties == 1:
+            return values.index(best)
+        k = int(self._tie_breaks[i] * ties)
+        for action, value in enumerate(values):
+            if value == best:
+                if k == 0:
+                    return action
+                k -= 1
+
+    def _take(self, n):
+        # n uniforms from the block buffer, drawing a new block when it runs out
+        if len(self._uniforms) < n:
+            self._uniforms = np.concatenate([self._uniforms, self.rng.random(max(n, self.block_size))])
+        taken = self._uniforms[:n]
+        self._uniforms = self._uniforms[n:]
+        return taken
+
+    def select_batch(self, q_rows, epsilon):
+        # Action index for every row of an (n, n_actions) array of action values
+        n = len(q_rows)
+        draws = self._take(n * (self.n_actions + 2))
+        is_max = q_rows == q_rows.max(axis=1, keepdims=True)
+        greedy = np.where(is_max, draws[:n * self.n_actions].reshape(n, self.n_actions), -1.0).argmax(axis=1)
+        explore = draws[-2 * n:-n] < epsilon
+        random_actions = (draws[-n:] * self.n_actions).astype(np.int64)
+        return np.where(explore, random_actions, greedy)
+
+
+class TransitionTable:
+    # Everything a single-agent step needs, precomputed as Python lists for a
+    # GridEnv with fixed goals: for a flat state s = x * cols + y and action a,
+    # next_state[s][a], reward[s][a] and done[s][a]. states[s] is the (x, y)
+    # tuple of s, built once so the loops don't allocate tuples.
+    def __init__(self, env):
+        if env.goal_conditioned:
+            raise ValueError("TransitionTable needs an env with fixed goals")
+        cols = env.grid_size[1]
+        next_state = env.transition_table()
+        self.next_state = next_state.tolist()
+        self.reward = env.reward_map.ravel()[next_state].tolist()
+        self.done = env.terminal_map.ravel()[next_state].tolist()
+        self.states = [divmod(s, cols) for s in range(env.n_states)]
+        self.cols = cols
+
+    def index(self, state):
+        return state[0] * self.cols + state[1]
@@ -1,8 +1,18 @@
-from flask import Flask, jsonify, render_template, request
+import ast
 import json
-import random
+import os
+import tempfile
 
-app = Flask(__name__)
+import numpy as np
+
+from gridEnv import GridEnv
+from instrumentation import TrainingLog
+from pathQueries import PathQuery
+from policyExport import export_policy, value_formats
+from qTable import QTable
+from qTableStream import stream_deltas
+from sessionRegistry import SessionBusy, SessionRegistry
+from trainingJobs import JobManager
 
 # Environment settings
 grid_size = (5, 5)
@@ -24,49 +34,56 @@ epsilon = 0.2  # Exploration rate
 num_episodes = 10000
 max_steps_per_episode = 200  # To prevent infinite loops
 
-# Initialize Q-table
-q_table = {}
-for x in range(grid_size[0]):
-    for y in range(grid_size[1]):
-        q_table[(x, y)] = {action: 0.0 for action in actions}
+# Every browser session gets its own environment config and Q-table, these
+# globals are the defaults new sessions start from
+default_config = {
+    'grid_size': grid_size, 'start': start, 'goal': goal, 'obstacles': obstacles, 'alpha': alpha,
+    'gamma': gamma, 'epsilon': epsilon, 'max_steps_per_episode': max_steps_per_episode,
+}
+max_session_cells = 250000  # Largest grid (rows * columns) a session may configure
+
+# The session registry and the background training jobs (see /jobs) are
+# created with the app, importing this module only defines the training code
+sessions = None
+session_cookie = 'session_id'
+jobs = None
 
+# Print episode summaries every 1000 episodes, False trains without instrumentation
+log_training = True
 
-def is_valid_state(state):
+
+def is_valid_state(session, state):
     x, y = state
-    if (0 <= x < grid_size[0] and 0 <= y < grid_size[1]):
+    if (0 <= x < session.grid_size[0] and 0 <= y < session.grid_size[1]):
         return True
     return False
 
 
-def get_next_state(state, action):
+def get_next_state(session, state, action):
     delta = action_to_delta[action]
     next_state = (state[0] + delta[0], state[1] + delta[1])
-    if is_valid_state(next_state):
-        # move_agent_step_by_step(action)
+    if is_valid_state(session, next_state):
         return next_state
     return state  # If next state is invalid, stay in the current state
 
 
-def get_reward(state):
-    if state == goal:
+def get_reward(session, state):
+    if state == session.goal:
         return 100  # Reward for reaching the goal
-    if state in obstacles:
+    if state in session.obstacle_set:
         return -100  # Penalty for hitting an obstacle
     return 0  # Small penalty for each step to encourage the shortest path
 
 
-def choose_action(state):
-    if random.uniform(0, 1) < epsilon:
-        return random.choice(actions)  # Exploration
-    else:
-        max_q = max(q_table[state].values())
-        return random.choice([action for action in actions if q_table[state][action] == max_q])  # Exploitation
+def choose_action(session, state):
+    # Epsilon-greedy from the session's own pre-drawn random numbers
+    return actions[session.action_selector.select(session.q_table.lookup(state[0], state[1]), session.epsilon)]
 
 
-def save_q_table(filename):
+def save_q_table(filename, q_table):
     with open(filename, 'w') as f:
         # Convert dictionary keys to strings for JSON compatibility
-        q_table_str_keys = {str(k): v for k, v in q_table.items()}
+        q_table_str_keys = {str(k): v for k, v in q_table.to_dict().items()}
         json.dump(q_table_str_keys, f)
 
 
@@ -78,22 +95,19 @@ def load_q_table(filename, forHtml=False):
         return q_table_str_keys
 
     # Convert string keys back to tuples
-    q_table = {eval(k): v for k, v in q_table_str_keys.items()}
+    q_table = QTable.from_dict({ast.literal_eval(k): v for k, v in q_table_str_keys.items()})
     return q_table
 
 
-# Training loop
-
-
 # Extract the best path
-def extract_path(start, goal):
+def extract_path(session, start, goal):
     path = [start]
     state = start
-    for _ in range(max_steps_per_episode):  # Limit steps to avoid infinite loops
+    for _ in range(session.max_steps_per_episode):  # Limit steps to avoid infinite loops
         if state == goal:
             break
-        action = max(q_table[state], key=q_table[state].get)
-        next_state = get_next_state(state, action)
+        action = actions[session.q_table.greedy_action(state)]
+        next_state = get_next_state(session, state, action)
         if next_state == state:  # Prevent infinite loop
             break
         path.append(next_state)
@@ -101,58 +115,233 @@ def extract_path(start, goal):
     return path
 
 
-@app.route('/')
-def index():
-    return render_template('index.html')
+def path_query(session):
+    # Batched greedy paths over the session's table, built on first use. Its
+    # greedy next-state array is cached until the table changes.
+    if session.path_query is None:
+        terminal_map = np.zeros(session.grid_size, dtype=bool)
+        terminal_map[session.goal] = True
+        env = GridEnv(session.grid_size, actions, action_to_delta, terminal_map=terminal_map)
+        session.path_query = PathQuery(env, session.q_table)
+    return session.path_query
 
 
-@app.route('/train', methods=['POST'])
-def train_q_learning():
-    # q_table = load_q_table("q_table.json")
-    data = request.get_json()
-    episodes_to_run = data.get('episodes', 1)
+def run_episodes(session, episodes_to_run, job=None):
+    # Runs the episodes on the session's table. The session lock is taken per
+    # episode so jobs and requests reading the table interleave safely.
+    q_table = session.q_table
+    training_log = TrainingLog(episode_every=1000, name=f"training {session.id[:8]}") if log_training else None
     for episode in range(episodes_to_run):
-        state = start
-        for _ in range(max_steps_per_episode):  # Limit steps per episode
-            action = choose_action(state)
-            next_state = get_next_state(state, action)
-
-            if state == next_state:
-                continue  # Skip if no valid next state
-
-            reward = get_reward(next_state)
-
-            # Bellman equation update
-            max_future_q = max(q_table[next_state].values())
-            q_table[state][action] += alpha * (reward + gamma * max_future_q - q_table[state][action])
-
-            print(f"\n{episode=}, {state=}, {next_state=}, {reward=}")
-            if episode == 0:
-                print(f"\nepisode 0 step {_} Q-Table:")
-                for state, actions in q_table.items():
-                    print(f"State {state}: {actions}")
-
-            state = next_state
-
-            if state == goal:
-                break  # Exit if goal is reached
-
-    save_q_table("q_table.json")
-    return jsonify(load_q_table("q_table.json", True))
-
-
-@app.route('/reset', methods=['POST'])
-def reset_q_table():
-    global q_table
-    q_table = {}
-    for x in range(grid_size[0]):
-        for y in range(grid_size[1]):
-            q_table[(x, y)] = {action: 0.0 for action in actions}
-
-    save_q_table("q_table.json")
-    q_table = load_q_table("q_table.json")
-    return load_q_table("q_table.json", True)
+        if job is not None and job.cancelled:
+            break
+        with session.lock:
+            state = session.start
+            if training_log is not None:
+                training_log.start_episode(episode)
+            for step in range(session.max_steps_per_episode):  # Limit steps per episode
+                action = choose_action(session, state)
+                next_state = get_next_state(session, state, action)
+
+                if state == next_state:
+                    continue  # Skip if no valid next state
+
+                reward = get_reward(session, next_state)
+
+                # Bellman equation update
+                max_future_q = q_table.max_q(next_state)
+                td_error = q_table.update(state, action, reward + session.gamma * max_future_q, session.alpha)
+
+                if training_log is not None:
+                    training_log.step(episode, step, state, next_state, reward, td_error, q_table)
+
+                state = next_state
+
+                if state == session.goal:
+                    break  # Exit if goal is reached
+
+            if training_log is not None:
+                training_log.end_episode(episode, step + 1, state == session.goal)
+        if job is not None:
+            job.episodes_done += 1
+
+    if training_log is not None:
+        training_log.close()
+
+
+def q_table_json(session):
+    # Same shape as the q_table.json file: {"(x, y)": {action: value}}
+    with session.lock:
+        return {str(k): v for k, v in session.q_table.to_dict().items()}
+
+
+def create_app():
+    # Flask is imported here, not at module level, so training workers can
+    # import the helpers above without it. At most 256 tables stay in memory,
+    # idle ones are spilled to disk after 30 minutes.
+    global sessions, jobs
+    from flask import Flask, Response, g, jsonify, render_template, request
+
+    if sessions is None:
+        sessions = SessionRegistry(default_config, max_live=256, ttl=1800, max_cells=max_session_cells)
+        jobs = JobManager()
+    app = Flask(__name__)
+
+    def current_session():
+        # The caller's session from the cookie (or X-Session-Id header), a new one if unknown or missing
+        session_id = request.cookies.get(session_cookie) or request.headers.get('X-Session-Id')
+        session = sessions.get_or_create(session_id)
+        g.session_id = session.id
+        return session
+
+    @app.after_request
+    def set_session_cookie(response):
+        session_id = g.get('session_id')
+        if session_id is not None and request.cookies.get(session_cookie) != session_id:
+            response.set_cookie(session_cookie, session_id, httponly=True, samesite='Lax')
+        return response
+
+    @app.route('/')
+    def index():
+        current_session()
+        return render_template('index.html')
+
+    @app.route('/session', methods=['GET'])
+    def get_session():
+        session = current_session()
+        return jsonify({'id': session.id, 'config': session.config, 'sessions': sessions.stats()})
+
+    @app.route('/session', methods=['POST'])
+    def configure_session():
+        # Replace the caller's environment config, this starts from a fresh
+        # table. Refused while jobs or streams still use the current one.
+        session = current_session()
+        config = dict(session.config, **(request.get_json() or {}))
+        try:
+            session = sessions.replace(session.id, config)
+        except SessionBusy as e:
+            return jsonify({'error': f"{e}, cancel the jobs and close the streams first"}), 409
+        except (KeyError, TypeError, ValueError) as e:
+            return jsonify({'error': f"invalid config: {e}"}), 400
+        return jsonify({'id': session.id, 'config': session.config})
+
+    @app.route('/train', methods=['POST'])
+    def train_q_learning():
+        # Blocking variant, trains in the request. Use /jobs for long runs.
+        session = current_session()
+        data = request.get_json()
+        with sessions.pinned(session):
+            run_episodes(session, data.get('episodes', 1))
+        return jsonify(q_table_json(session))
+
+    @app.route('/q_table')
+    def get_q_table():
+        return jsonify(q_table_json(current_session()))
+
+    @app.route('/paths', methods=['POST'])
+    def query_paths():
+        # Greedy paths for many starts at once: {"starts": [[x, y], ...]} with
+        # optional "goals" (one per start, the session goal by default) and
+        # "max_steps". Returns the paths and how each ended, see pathQueries.py.
+        session = current_session()
+        data = request.get_json() or {}
+        try:
+            starts = np.asarray(data['starts'], dtype=np.int64).reshape(-1, 2)
+            goals = data.get('goals')
+            cells = [starts]
+            if goals is not None:
+                goals = np.asarray(goals, dtype=np.int64).reshape(-1, 2)
+                if len(goals) not in (1, len(starts)):
+                    raise ValueError(f"got {len(goals)} goals for {len(starts)} starts")
+                cells.append(goals)
+            for array in cells:
+                if ((array < 0) | (array >= session.grid_size)).any():
+                    raise ValueError("cells outside the grid")
+            max_steps = int(data.get('max_steps', session.max_steps_per_episode))
+        except (KeyError, TypeError, ValueError) as e:
+            return jsonify({'error': f"invalid query: {e}"}), 400
+        with session.lock:
+            paths, status = path_query(session).paths(starts, goals, max_steps)
+        return jsonify({'paths': paths, 'status': status})
+
+    @app.route('/policy')
+    def download_policy():
+        # The session's greedy policy as a policyExport artifact, for
+        # inference without the Q-table. ?values=float16 or int8 also ships
+        # the Q-values, the X-Policy-Agreement header says how often their
+        # ranking picks the table's greedy action.
+        session = current_session()
+        values = request.args.get('values') or None
+        if values not in value_formats:
+            return jsonify({'error': f"values must be one of {value_formats[1:]}"}), 400
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'policy.qpolicy')
+            with session.lock:
+                rates = export_policy(path_query(session).env, session.q_table, filename, values)
+            with open(filename, 'rb') as f:
+                data = f.read()
+        response = Response(data, mimetype='application/octet-stream')
+        response.headers['Content-Disposition'] = 'attachment; filename=policy.qpolicy'
+        response.headers['X-Policy-Agreement'] = json.dumps(rates)
+        return response
+
+    @app.route('/stream')
+    def stream_q_table():
+        # Server-sent events: a full snapshot, then only the changed cells at most fps times a second
+        session = current_session()
+        fps = request.args.get('fps', 5, type=float)
+
+        def generate():
+            with sessions.pinned(session):
+                yield from stream_deltas(session.q_table, fps, lock=session.lock)
+
+        return Response(generate(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+    @app.route('/jobs', methods=['POST'])
+    def create_job():
+        session = current_session()
+        data = request.get_json()
+        episodes = int(data.get('episodes', num_episodes))
+        # The pin keeps the table in memory until the job has finished
+        sessions.pin(session)
+        job = jobs.submit(episodes, lambda job: run_episodes(session, job.episodes, job), owner=session.id,
+                          on_finish=lambda job: sessions.unpin(session))
+        return jsonify(job.to_dict()), 202
+
+    @app.route('/jobs', methods=['GET'])
+    def list_jobs():
+        return jsonify([job.to_dict() for job in jobs.jobs(current_session().id)])
+
+    def session_job(job_id):
+        job = jobs.get(job_id)
+        if job is None or job.owner != current_session().id:
+            return None
+        return job
+
+    @app.route('/jobs/<job_id>', methods=['GET'])
+    def get_job(job_id):
+        job = session_job(job_id)
+        if job is None:
+            return jsonify({'error': f"no job {job_id}"}), 404
+        return jsonify(job.to_dict())
+
+    @app.route('/jobs/<job_id>', methods=['DELETE'])
+    def cancel_job(job_id):
+        job = session_job(job_id)
+        if job is None:
+            return jsonify({'error': f"no job {job_id}"}), 404
+        job.cancel()
+        return jsonify(job.to_dict())
+
+    @app.route('/reset', methods=['POST'])
+    def reset_q_table():
+        session = current_session()
+        with session.lock:
+            session.q_table.reset()
+        return jsonify(q_table_json(session))
+
+    return app
 
 
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    create_app().run(debug=True)
@@ -0,0 +1,231 @@
+import argparse
+import json
+import platform
+import resource
+import subprocess
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from eligibilityTraces import train_q_lambda_batch
+from gridEnv import BatchGridEnv, GridEnv, greedy_path, train_q_learning_batch, train_q_learning_single
+from qTable import QTable
+from trainingKernel import seed_state, train_q_learning_kernel
+
+# Training throughput, convergence and path-extraction latency across grid
+# sizes, obstacle densities and trainers. Every case runs in a fresh process
+# so its peak RSS is its own. Results are written as JSON and can be compared
+# against an earlier run:
+#
+#   python benchmark.py --sizes 5 50 200 --output new.json --compare old.json
+
+trainers = ['loop', 'batch', 'q_lambda', 'kernel']  # kernel is compiled when numba is installed
+
+
+def make_env(size, density, seed):
+    # Random square map with start (0, 0) and a +100 goal in the far corner,
+    # obstacles block like in reinforcementLearningWithGui.py, every step costs -1
+    rng = np.random.default_rng(seed)
+    blocked = rng.random((size, size)) < density
+    blocked[0, 0] = blocked[size - 1, size - 1] = False
+    reward_map = np.full((size, size), -1.0)
+    reward_map[size - 1, size - 1] = 100.0
+    terminal_map = np.zeros((size, size), dtype=bool)
+    terminal_map[size - 1, size - 1] = True
+    return GridEnv((size, size), reward_map=reward_map, terminal_map=terminal_map, blocked_map=blocked)
+
+
+def shortest_path_length(env, start):
+    # BFS distance from start to the nearest terminal cell, None if unreachable
+    transitions = env.transition_table()
+    cols = env.grid_size[1]
+    terminal = env.terminal_map.ravel()
+    distance = np.full(env.n_states, -1, dtype=np.int64)
+    s = start[0] * cols + start[1]
+    distance[s] = 0
+    queue = deque([s])
+    while queue:
+        s = queue.popleft()
+        if terminal[s]:
+            return int(distance[s])
+        for n in transitions[s].tolist():
+            if distance[n] < 0:
+                distance[n] = distance[s] + 1
+                queue.append(n)
+    return None
+
+
+def train_chunk(trainer, env, q_table, episodes, settings, rngs):
+    if trainer == 'loop':
+        return train_q_learning_single(env, q_table, (0, 0), episodes, settings['alpha'], settings['gamma'],
+                                       settings['epsilon'], settings['max_steps'], settings['skip_bumps'],
+                                       rng=rngs['loop'])
+    if trainer == 'kernel':
+        return train_q_learning_kernel(env, q_table, (0, 0), episodes, settings['alpha'], settings['gamma'],
+                                       settings['epsilon'], settings['max_steps'], settings['skip_bumps'],
+                                       rng_state=rngs['kernel'])
+    batch_env = BatchGridEnv(env, settings['n_envs'], [(0, 0)], rng=rngs['numpy'])
+    if trainer == 'q_lambda':
+        return train_q_lambda_batch(batch_env, q_table, episodes, settings['alpha'], settings['gamma'],
+                                    settings['epsilon'], settings['max_steps'], settings['lam'],
+                                    skip_bumps=settings['skip_bumps'])
+    return train_q_learning_batch(batch_env, q_table, episodes, settings['alpha'], settings['gamma'],
+                                  settings['epsilon'], settings['max_steps'], settings['skip_bumps'])
+
+
+def percentiles(samples):
+    if not samples:
+        return {}
+    values = np.percentile(np.array(samples) * 1e6, [50, 90, 99])
+    return {'p50_us': float(values[0]), 'p90_us': float(values[1]), 'p99_us': float(values[2])}
+
+
+def run_case(case):
+    # One (trainer, size, density, episodes) measurement, meant to run in its own process
+    settings = case['settings']
+    env = make_env(case['size'], case['density'], case['seed'])
+    q_table = QTable(env.grid_size, env.actions)
+    rngs = {'loop': np.random.default_rng(case['seed']), 'numpy': np.random.default_rng(case['seed']),
+            'kernel': seed_state(case['seed'])}
+    optimal = shortest_path_length(env, (0, 0))
+
+    # Train in chunks, the first chunk after which the greedy path is
+    # optimal gives the episodes to convergence
+    chunk = max(1, case['episodes'] // settings['checkpoints'])
+    episodes_done = 0
+    steps = 0
+    train_time = 0.0
+    converged_at = None
+    while episodes_done < case['episodes']:
+        episodes = min(chunk, case['episodes'] - episodes_done)
+        started = time.perf_counter()
+        stats = train_chunk(case['trainer'], env, q_table, episodes, settings, rngs)
+        train_time += time.perf_counter() - started
+        episodes_done += episodes
+        steps += stats['steps']
+        if converged_at is None and optimal is not None:
+            path = greedy_path(env, q_table, (0, 0), settings['max_steps'])
+            if env.terminal_map[path[-1]] and len(path) - 1 == optimal:
+                converged_at = episodes_done
+
+    # Greedy path extraction from random free cells
+    free = np.argwhere(~env.blocked_map)
+    starts = free[rngs['numpy'].integers(len(free), size=settings['path_queries'])]
+    latencies = []
+    for x, y in starts.tolist():
+        started = time.perf_counter()
+        greedy_path(env, q_table, (x, y), settings['max_steps'])
+        latencies.append(time.perf_counter() - started)
+
+    return dict(
+        {key: case[key] for key in ('trainer', 'size', 'density', 'episodes', 'seed')},
+        train_seconds=train_time,
+        steps=steps,
+        steps_per_sec=steps / train_time if train_time else 0.0,
+        episodes_per_sec=episodes_done / train_time if train_time else 0.0,
+        episodes_to_convergence=converged_at,
+        optimal_path_length=optimal,
+        peak_rss_mb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        extract_path=percentiles(latencies),
+    )
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def case_key(result):
+    return (result['trainer'], result['size'], result['density'], result['episodes'])
+
+
+def compare(results, baseline):
+    # Ratios against a baseline run, > 1 means faster (or lower latency) now
+    old = {case_key(result): result for result in baseline['results']}
+    lines = [f"{'trainer':8} {'size':>6} {'density':>7} {'episodes':>9} {'steps/s':>9} {'path p50':>9}"]
+    for result in results:
+        before = old.get(case_key(result))
+        if before is None:
+            continue
+        speedup = result['steps_per_sec'] / before['steps_per_sec'] if before['steps_per_sec'] else float('nan')
+        new_p50 = result['extract_path'].get('p50_us')
+        old_p50 = before['extract_path'].get('p50_us')
+        path_speedup = old_p50 / new_p50 if new_p50 and old_p50 else float('nan')
+        lines.append(f"{result['trainer']:8} {result['size']:>6} {result['density']:>7} {result['episodes']:>9} "
+                     f"{speedup:>8.2f}x {path_speedup:>8.2f}x")
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark Q-learning training and path extraction")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[5, 50, 200, 1000])
+    parser.add_argument('--densities', type=float, nargs='+', default=[0.0, 0.1, 0.2])
+    parser.add_argument('--episodes', type=int, nargs='+', default=[1000])
+    parser.add_argument('--trainers', nargs='+', choices=trainers, default=trainers)
+    parser.add_argument('--alpha', type=float, default=0.9)
+    parser.add_argument('--gamma', type=float, default=0.9)
+    parser.add_argument('--epsilon', type=float, default=0.5)
+    parser.add_argument('--lam', type=float, default=0.9, help="trace decay of the q_lambda trainer")
+    parser.add_argument('--max-steps', type=int, default=None,
+                        help="steps per episode, defaults to 4 * (rows + cols)")
+    parser.add_argument('--n-envs', type=int, default=256)
+    parser.add_argument('--skip-bumps', action='store_true',
+                        help="don't learn from moves into walls, like reinforcementLearning.py (bump actions "
+                             "then keep their initial value, which stalls exploration on bigger maps)")
+    parser.add_argument('--checkpoints', type=int, default=20, help="convergence checks per run")
+    parser.add_argument('--path-queries', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--compare', help="earlier results file to compare against")
+    args = parser.parse_args(argv)
+
+    cases = []
+    for trainer in args.trainers:
+        for size in args.sizes:
+            for density in args.densities:
+                for episodes in args.episodes:
+                    settings = {
+                        'alpha': args.alpha, 'gamma': args.gamma, 'epsilon': args.epsilon, 'lam': args.lam,
+                        'max_steps': args.max_steps or 8 * size, 'n_envs': args.n_envs,
+                        'skip_bumps': args.skip_bumps,
+                        'checkpoints': args.checkpoints, 'path_queries': args.path_queries,
+                    }
+                    cases.append({'trainer': trainer, 'size': size, 'density': density, 'episodes': episodes,
+                                  'seed': args.seed, 'settings': settings})
+
+    results = []
+    # One process per case, so ru_maxrss is the peak of that case alone
+    with ProcessPoolExecutor(1, max_tasks_per_child=1) as pool:
+        for result in pool.map(run_case, cases):
+            results.append(result)
+            print(f"{result['trainer']:6} {result['size']:>5}x{result['size']:<5} density {result['density']:.2f} "
+                  f"{result['episodes']:>6} episodes: {result['steps_per_sec']:>10.0f} steps/s, "
+                  f"{result['episodes_per_sec']:>8.1f} episodes/s, converged at {result['episodes_to_convergence']}, "
+                  f"peak RSS {result['peak_rss_mb']:.0f} MB, "
+                  f"extract_path p50 {result['extract_path'].get('p50_us', 0):.0f} us")
+
+    report = {
+        'commit': git_commit(),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            print(compare(results, json.load(f)))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,158 @@
+import ast
+import json
+import os
+import struct
+import sys
+
+import numpy as np
+
+from qTable import QTable, SparseQTable
+
+# Binary Q-table checkpoints
+#
+#   magic      4 bytes   b'QTBL'
+#   version    uint16    little endian
+#   header_len uint32    little endian
+#   header     JSON      grid size, action order, hyperparameters and the
+#                        dtype/shape/offset of every stored array
+#   padding    up to the next multiple of alignment
+#   arrays     raw C-order buffers, each starting at an aligned offset
+#
+# The raw buffers are opened with numpy.memmap, so loading a table costs a
+# header parse no matter how large it is.
+
+magic = b'QTBL'
+format_version = 1
+extension = '.qtable'
+alignment = 64
+
+_prefix = struct.Struct('<4sHI')
+
+
+def _align(offset):
+    return -(-offset // alignment) * alignment
+
+
+def write_container(filename, meta, arrays):
+    # Write named arrays plus a JSON-serializable meta dict in the checkpoint layout
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+    layout = {}
+    header = dict(meta, arrays=layout)
+    # Offsets depend on the header length, so settle them iteratively
+    data_start = 0
+    while True:
+        offset = data_start
+        for name, array in arrays.items():
+            layout[name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+            offset = _align(offset + array.nbytes)
+        header_bytes = json.dumps(header).encode('utf-8')
+        needed = _align(_prefix.size + len(header_bytes))
+        if needed <= data_start:
+            break
+        data_start = needed
+
+    tmp_filename = filename + '.tmp'
+    with open(tmp_filename, 'wb') as f:
+        f.write(_prefix.pack(magic, format_version, len(header_bytes)))
+        f.write(header_bytes)
+        for name, array in arrays.items():
+            f.write(b'\0' * (layout[name]['offset'] - f.tell()))
+            array.tofile(f)
+    os.replace(tmp_filename, filename)
+
+
+def read_header(filename):
+    with open(filename, 'rb') as f:
+        file_magic, version, header_len = _prefix.unpack(f.read(_prefix.size))
+        if file_magic != magic:
+            raise ValueError(f"{filename} is not a Q-table checkpoint")
+        if version > format_version:
+            raise ValueError(f"{filename} has checkpoint version {version}, this code reads up to {format_version}")
+        return json.loads(f.read(header_len).decode('utf-8'))
+
+
+def read_container(filename, mode='r'):
+    # mode is the numpy.memmap mode: 'r' read-only, 'c' copy-on-write,
+    # 'r+' write through to the file. None reads the arrays into memory.
+    header = read_header(filename)
+    arrays = {}
+    for name, spec in header['arrays'].items():
+        dtype = np.dtype(spec['dtype'])
+        shape = tuple(spec['shape'])
+        if mode is None:
+            with open(filename, 'rb') as f:
+                f.seek(spec['offset'])
+                arrays[name] = np.fromfile(f, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+        elif 0 in shape:
+            arrays[name] = np.zeros(shape, dtype=dtype)
+        else:
+            arrays[name] = np.memmap(filename, dtype=dtype, mode=mode, offset=spec['offset'], shape=shape)
+    return header, arrays
+
+
+def save_checkpoint(q_table, filename, **hyperparameters):
+    meta = {
+        'kind': 'q_table',
+        'grid_size': list(q_table.grid_size),
+        'actions': q_table.actions,
+        'hyperparameters': hyperparameters,
+    }
+    if isinstance(q_table, SparseQTable):
+        # Only the allocated tiles are written
+        meta.update(kind='sparse_q_table', tile_size=q_table.tile_size, default=q_table.default)
+        tile_keys, tiles = q_table.tiles()
+        write_container(filename, meta, {'tile_keys': tile_keys, 'tiles': tiles})
+    else:
+        write_container(filename, meta, {'q': q_table.array})
+
+
+def load_checkpoint(filename, mode='r'):
+    # Returns the QTable (backed by a memmap unless mode is None) and the
+    # header. Sparse tables are always read into memory, their pool grows.
+    if read_header(filename)['kind'] == 'sparse_q_table':
+        header, arrays = read_container(filename, None)
+        q_table = SparseQTable.from_tiles(header['grid_size'], header['actions'], arrays['tile_keys'],
+                                          arrays['tiles'], header['default'])
+        return q_table, header
+    header, arrays = read_container(filename, mode)
+    return QTable(header['grid_size'], header['actions'], array=arrays['q']), header
+
+
+def module_hyperparameters(module):
+    names = ['alpha', 'gamma', 'epsilon', 'num_episodes', 'max_steps_per_episode']
+    return {name: getattr(module, name) for name in names if hasattr(module, name)}
+
+
+def save_json_q_table(q_table, filename):
+    # The JSON layout of save_q_table, "(x, y)" keys mapping to {action: value}
+    with open(filename, 'w') as f:
+        json.dump({str(k): v for k, v in q_table.to_dict().items()}, f)
+
+
+def load_json_q_table(filename):
+    # Reads the JSON tables written by save_q_table, parsing the "(x, y)"
+    # keys as literals instead of eval'ing them
+    with open(filename, 'r') as f:
+        q_table_str_keys = json.load(f)
+    return QTable.from_dict({ast.literal_eval(k): v for k, v in q_table_str_keys.items()})
+
+
+def load_q_table(filename):
+    # Either kind of saved table, by extension: a memory-mapped binary
+    # checkpoint or the scripts' JSON
+    if filename.endswith(extension):
+        return load_checkpoint(filename)[0]
+    return load_json_q_table(filename)
+
+
+def convert_json(json_filename, filename=None, **hyperparameters):
+    if filename is None:
+        filename = os.path.splitext(json_filename)[0] + extension
+    save_checkpoint(load_json_q_table(json_filename), filename, **hyperparameters)
+    return filename
+
+
+if __name__ == "__main__":
+    # Convert JSON Q-tables: python checkpoint.py QTable.json q_table.json ...
+    for json_file in sys.argv[1:]:
+        print(f"{json_file} -> {convert_json(json_file)}")
@@ -0,0 +1,140 @@
+from collections import deque
+
+import numpy as np
+
+# Convergence monitoring for the training loops, so training stops once more
+# episodes wouldn't change anything instead of always running num_episodes.
+# Stop criteria, each enabled by its parameter:
+#   q_tolerance       no Q-value moved by q_tolerance or more during the last
+#                     q_window episodes
+#   stable_episodes   the greedy policy hasn't changed in any cell for
+#                     stable_episodes episodes
+#   plateau_window    success rate and mean episode length of the last
+#                     plateau_window episodes are within success_tolerance and
+#                     steps_tolerance (relative) of the window before, with
+#                     some successes in it
+# Training stops at the first criterion met after min_episodes, and reason
+# says which one and why.
+#
+# The loops report every Q write to update() and every finished episode to
+# end_episode(). A write only looks at the written cell: its change is
+# compared to the tolerance and its greedy action to a copy of the greedy
+# policy taken once at start(), so checks cost O(changed states) and never
+# scan the table. Loops take monitor=None by default, like log.
+
+
+class ConvergenceMonitor:
+    def __init__(self, q_tolerance=None, q_window=100, stable_episodes=None, plateau_window=None,
+                 success_tolerance=0.01, steps_tolerance=0.05, min_episodes=0):
+        self.q_tolerance = q_tolerance
+        self.q_window = q_window
+        self.stable_episodes = stable_episodes
+        self.plateau_window = plateau_window
+        self.success_tolerance = success_tolerance
+        self.steps_tolerance = steps_tolerance
+        self.min_episodes = min_episodes
+        self.criterion = None  # Name of the criterion that stopped training
+        self.reason = None
+        self.stopped_at = None
+
+        self.episodes = 0
+        self._greedy = None
+        self._max_change = 0.0
+        self._policy_changed = False
+        self._calm_episodes = 0  # Episodes in a row without a change of q_tolerance or more
+        self._stable_episodes = 0  # Episodes in a row without a greedy action change
+        # Running totals of successes and steps over the last two plateau
+        # windows, the last entry covers all episodes so far
+        size = 2 * plateau_window + 1 if plateau_window is not None else 1
+        self._success_totals = deque([0], maxlen=size)
+        self._step_totals = deque([0], maxlen=size)
+
+    @property
+    def stopped(self):
+        return self.reason is not None
+
+    def start(self, q_table):
+        # The one full pass: the greedy action of every cell to compare writes against
+        dtype = np.uint8 if len(q_table.actions) <= 256 else np.int64
+        self._greedy = q_table.greedy_actions().astype(dtype)
+
+    def update(self, state, change, q_table):
+        # One Q write in cell state, change is how far the value moved
+        if change > self._max_change:
+            self._max_change = change
+        if self._greedy is not None:
+            x, y = state
+            greedy = int(q_table.lookup(x, y).argmax())
+            if greedy != self._greedy[x, y]:
+                self._greedy[x, y] = greedy
+                self._policy_changed = True
+
+    def update_batch(self, xs, ys, changes, q_table):
+        # Writes of a batched step, one per (xs[i], ys[i])
+        if len(changes):
+            self._max_change = max(self._max_change, float(np.max(changes)))
+        if self._greedy is not None and len(xs):
+            greedy = q_table.lookup(xs, ys).argmax(axis=1)
+            changed = greedy != self._greedy[xs, ys]
+            if changed.any():
+                self._greedy[xs[changed], ys[changed]] = greedy[changed]
+                self._policy_changed = True
+
+    def end_episode(self, steps, success):
+        # Returns True when training should stop
+        return self.end_episodes([steps], [success])
+
+    def end_episodes(self, steps, successes):
+        # Several episodes ending after the same writes, for the batched
+        # loops. Returns True when training should stop.
+        n = len(steps)
+        if not n:
+            return self.stopped
+        self.episodes += n
+        if self.plateau_window is not None:
+            self._step_totals.extend((self._step_totals[-1] + np.cumsum(steps)).tolist())
+            self._success_totals.extend((self._success_totals[-1] + np.cumsum(successes)).tolist())
+
+        if self.q_tolerance is not None and self._max_change >= self.q_tolerance:
+            self._calm_episodes = 0
+        else:
+            self._calm_episodes += n
+        # Episodes whose writes changed the policy don't count as stable
+        self._stable_episodes = 0 if self._policy_changed else self._stable_episodes + n
+        self._max_change = 0.0
+        self._policy_changed = False
+
+        if not self.stopped and self.episodes >= self.min_episodes:
+            self._check()
+        return self.stopped
+
+    def _check(self):
+        if self.q_tolerance is not None and self._calm_episodes >= self.q_window:
+            self._stop('q_delta', f"no Q-value moved by {self.q_tolerance} or more in the last "
+                                  f"{self._calm_episodes} episodes")
+        elif self.stable_episodes is not None and self._stable_episodes >= self.stable_episodes:
+            self._stop('policy', f"greedy policy unchanged for {self._stable_episodes} episodes")
+        elif self.plateau_window is not None and self.episodes >= 2 * self.plateau_window:
+            (old_rate, old_steps), (rate, steps) = self._window(2), self._window(1)
+            if (rate > 0.0 and abs(rate - old_rate) <= self.success_tolerance
+                    and abs(steps - old_steps) <= self.steps_tolerance * old_steps):
+                self._stop('plateau', f"success rate {old_rate:.3f} -> {rate:.3f} and average steps "
+                                      f"{old_steps:.1f} -> {steps:.1f} over the last two windows of "
+                                      f"{self.plateau_window} episodes")
+
+    def _window(self, back):
+        # Success rate and mean steps of the window ending back - 1 windows ago
+        first = self.episodes - len(self._step_totals) + 1  # Episode count of the oldest total kept
+        end = self.episodes - (back - 1) * self.plateau_window - first
+        begin = end - self.plateau_window
+        return ((self._success_totals[end] - self._success_totals[begin]) / self.plateau_window,
+                (self._step_totals[end] - self._step_totals[begin]) / self.plateau_window)
+
+    def _stop(self, criterion, reason):
+        self.criterion = criterion
+        self.reason = f"converged after {self.episodes} episodes: {reason}"
+        self.stopped_at = self.episodes
+
+    def report(self):
+        # Added to the stats of the loops that were given a monitor
+        return {'converged': self.stopped, 'stop_criterion': self.criterion, 'stop_reason': self.reason}
@@ -0,0 +1,130 @@
+import math
+
+import numpy as np
+
+from actionSelection import ActionSelector
+from gridEnv import BatchGridEnv, setup_from_module
+
+
+def trace_length(gamma, lam, cutoff=1e-3):
+    # Visits kept per env: older ones have decayed below cutoff
+    decay = gamma * lam
+    if decay <= 0.0:
+        return 1
+    if decay >= 1.0:
+        raise ValueError("gamma * lam must be below 1")
+    return max(1, math.ceil(math.log(cutoff) / math.log(decay)))
+
+
+def train_q_lambda_batch(batch_env, q_table, num_episodes, alpha, gamma, epsilon, max_steps_per_episode,
+                         lam=0.9, trace_cutoff=1e-3, skip_bumps=True):
+    # Watkins's Q(lambda), same episodes and stats as train_q_learning_batch.
+    # Each TD error also updates the recently visited (state, action) pairs of
+    # that env, weighted by their eligibility (gamma * lam) ** age, so a goal
+    # reward travels back along the whole trajectory in one visit instead of
+    # one cell. Traces are cut after an exploratory action, as the greedy
+    # policy wouldn't have followed it.
+    #
+    # Traces only cover the active states: per env a ring of the last
+    # trace_length() visits with their eligibility, updated as one
+    # (n_envs, length) array operation per step.
+    selector = ActionSelector(len(q_table.actions), batch_env.rng)
+    n_envs = batch_env.n_envs
+    n_actions = len(q_table.actions)
+    length = trace_length(gamma, lam, trace_cutoff)
+    trace_xs = np.zeros((n_envs, length), dtype=np.int64)
+    trace_ys = np.zeros((n_envs, length), dtype=np.int64)
+    trace_actions = np.zeros((n_envs, length), dtype=np.int64)
+    traces = np.zeros((n_envs, length))
+    heads = np.zeros(n_envs, dtype=np.int64)
+
+    steps = np.zeros(n_envs, dtype=np.int64)
+    active = np.arange(n_envs) < num_episodes
+    started = int(active.sum())
+    finished = 0
+    success_count = 0
+    total_steps_to_goal = 0
+    total_steps = 0
+    batch_env.reset()
+
+    while finished < num_episodes:
+        index = np.flatnonzero(active)
+        xs = batch_env.xs[index]
+        ys = batch_env.ys[index]
+
+        q_rows = q_table.lookup(xs, ys)
+        action_indices = selector.select_batch(q_rows, epsilon)
+        current = q_rows[np.arange(len(index)), action_indices]
+        # A non-greedy action ends what the greedy policy would have done
+        traces[index[current < q_rows.max(axis=1)]] = 0.0
+
+        next_xs, next_ys, rewards, dones = batch_env.step(action_indices, index)
+
+        update = ~((next_xs == xs) & (next_ys == ys)) if skip_bumps else np.ones(len(index), dtype=bool)
+        max_future_q = q_table.lookup(next_xs, next_ys).max(axis=1)
+        td_errors = rewards + gamma * np.where(dones, 0.0, max_future_q) - current
+
+        # Push the visit onto its env's ring (replacing an older trace of the
+        # same pair), then spread the TD error over every live trace of the
+        # envs that learn this step
+        learning = index[update]
+        same = ((trace_xs[learning] == xs[update, None]) & (trace_ys[learning] == ys[update, None])
+                & (trace_actions[learning] == action_indices[update, None]))
+        traces[learning] = np.where(same, 0.0, traces[learning])
+        heads[learning] = (heads[learning] + 1) % length
+        slot = heads[learning]
+        trace_xs[learning, slot] = xs[update]
+        trace_ys[learning, slot] = ys[update]
+        trace_actions[learning, slot] = action_indices[update]
+        traces[learning, slot] = 1.0
+        rows, cols = np.nonzero(traces[learning] > 0.0)
+        env_rows = learning[rows]
+        pair_xs = trace_xs[env_rows, cols]
+        pair_ys = trace_ys[env_rows, cols]
+        pair_actions = trace_actions[env_rows, cols]
+        changes = alpha * td_errors[update][rows] * traces[env_rows, cols]
+        # Envs sharing a (state, action) this step get the mean of their
+        # changes, summing them would scale alpha by the number of envs
+        keys = (pair_xs * batch_env.env.grid_size[1] + pair_ys) * n_actions + pair_actions
+        keys, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        mean_changes = np.bincount(inverse, changes) / np.bincount(inverse)
+        pair_xs, pair_ys, pair_actions = pair_xs[first], pair_ys[first], pair_actions[first]
+        current_values = q_table.lookup(pair_xs, pair_ys)[np.arange(len(keys)), pair_actions]
+        q_table.assign(pair_xs, pair_ys, pair_actions, current_values + mean_changes)
+        traces[learning] *= gamma * lam
+        traces[traces < trace_cutoff] = 0.0
+
+        steps[index] += 1
+        total_steps += len(index)
+        ended = dones | (steps[index] >= max_steps_per_episode)
+        success_count += int(dones.sum())
+        total_steps_to_goal += int(steps[index][dones].sum())
+
+        ended_index = index[ended]
+        finished += len(ended_index)
+        steps[ended_index] = 0
+        traces[ended_index] = 0.0
+        n_restart = min(len(ended_index), num_episodes - started)
+        restart_mask = np.zeros(n_envs, dtype=bool)
+        restart_mask[ended_index[:n_restart]] = True
+        active[ended_index[n_restart:]] = False
+        started += n_restart
+        if n_restart:
+            batch_env.reset(restart_mask)
+
+    return {
+        'episodes': num_episodes,
+        'steps': total_steps,
+        'success_count': success_count,
+        'success_rate': success_count / num_episodes if num_episodes else 0.0,
+        'avg_steps_to_goal': total_steps_to_goal / success_count if success_count else 0.0,
+    }
+
+
+def train_module_q_lambda(module, lam=0.9, n_envs=256, seed=None, skip_bumps=True):
+    # Q(lambda) replacement for a script's train_q_learning, trains its q_table
+    # in place with the script's own environment and hyperparameters
+    env, start_positions, goals = setup_from_module(module)
+    batch_env = BatchGridEnv(env, n_envs, start_positions, goals, np.random.default_rng(seed))
+    return train_q_lambda_batch(batch_env, module.q_table, module.num_episodes, module.alpha, module.gamma,
+                                module.epsilon, module.max_steps_per_episode, lam, skip_bumps=skip_bumps)
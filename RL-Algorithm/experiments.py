@@ -0,0 +1,282 @@
+import argparse
+import csv
+import hashlib
+import importlib
+import itertools
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from benchmark import make_env
+from checkpoint import module_hyperparameters
+from convergence import ConvergenceMonitor
+from eligibilityTraces import train_q_lambda_batch
+from gridEnv import BatchGridEnv, GridEnv, greedy_path, setup_from_module, train_q_learning_batch, \
+    train_q_learning_single
+from planning import value_iteration
+from qTable import QTable
+
+# Hyperparameter sweeps over environment layouts, described by a JSON config
+# (see experiments.json):
+#
+#   python experiments.py experiments.json --workers 8 --output results.csv
+#
+# Every combination of layout, trainer, sweep values and seed is one run.
+# Runs fan out over a process pool, each seeded from its own seed, and every
+# finished run is cached under the hash of its config (layout contents
+# included), so rerunning a sweep only runs what changed or is new.
+# A "convergence" dict in the defaults (ConvergenceMonitor arguments, like
+# {"stable_episodes": 500}) stops the batch and loop trainers early.
+
+trainers = ['batch', 'q_lambda', 'loop', 'plan']
+default_hyperparameters = {
+    'alpha': 0.9,
+    'gamma': 0.9,
+    'epsilon': 0.5,
+    'num_episodes': 10000,
+    'max_steps_per_episode': 100,
+    'lam': 0.9,
+    'n_envs': 64,
+    'skip_bumps': False,
+}
+# The run keys each trainer reads, the others are left out of its runs
+trainer_parameters = {
+    'batch': ['alpha', 'gamma', 'epsilon', 'num_episodes', 'max_steps_per_episode', 'n_envs', 'skip_bumps',
+              'convergence', 'seed'],
+    'q_lambda': ['alpha', 'gamma', 'epsilon', 'num_episodes', 'max_steps_per_episode', 'lam', 'n_envs', 'skip_bumps',
+                 'seed'],
+    'loop': ['alpha', 'gamma', 'epsilon', 'num_episodes', 'max_steps_per_episode', 'skip_bumps', 'convergence', 'seed'],
+    'plan': ['gamma', 'max_steps_per_episode'],
+}
+result_columns = ['train_success_rate', 'greedy_success', 'optimal_paths', 'mean_path_length', 'episodes_run',
+                  'stop_reason', 'seconds', 'cached']
+
+
+def load_layout(spec):
+    # (env, start_positions, goals, hyperparameter defaults) for one layout entry:
+    #   {"module": "reinforcementLearning"}  a training script's own env and globals
+    #   {"random": {"size": 40, "density": 0.1, "seed": 1}}  a random map like benchmark.py's
+    #   {"grid_size": [5, 5], "start": [0, 0], "goals": [[4, 4]], "obstacles": [...],
+    #    "goal_reward": 100, "step_reward": -1}
+    if 'module' in spec:
+        module = importlib.import_module(spec['module'])
+        env, start_positions, goals = setup_from_module(module)
+        goals = [tuple(goal) for goal in goals] if goals is not None else None
+        return env, [tuple(start) for start in start_positions], goals, module_hyperparameters(module)
+    if 'random' in spec:
+        options = spec['random']
+        env = make_env(options['size'], options.get('density', 0.0), options.get('seed', 0))
+        return env, [(0, 0)], None, {}
+    grid_size = tuple(spec['grid_size'])
+    reward_map = np.full(grid_size, float(spec.get('step_reward', -1)))
+    terminal_map = np.zeros(grid_size, dtype=bool)
+    blocked_map = np.zeros(grid_size, dtype=bool)
+    for x, y in spec['goals']:
+        reward_map[x, y] = spec.get('goal_reward', 100)
+        terminal_map[x, y] = True
+    for x, y in spec.get('obstacles', []):
+        blocked_map[x, y] = True
+    env = GridEnv(grid_size, reward_map=reward_map, terminal_map=terminal_map, blocked_map=blocked_map)
+    return env, [tuple(spec['start'])], None, {}
+
+
+def env_digest(env, start_positions, goals):
+    # Changes whenever the layout does, so edited layouts are rerun
+    digest = hashlib.sha256()
+    for array in (env.reward_map, env.terminal_map, env.blocked_map, env.deltas):
+        digest.update(np.ascontiguousarray(array).tobytes())
+    digest.update(repr((env.grid_size, env.actions, env.goal_reward, start_positions, goals)).encode())
+    return digest.hexdigest()
+
+
+def expand(config):
+    # Every run of a config as (run, env, start_positions, goals), run being the
+    # JSON-able description its hash is computed from. Hyperparameters a
+    # trainer doesn't read are dropped from its runs, so sweeping them (or the
+    # seed of the planner) doesn't repeat the same run.
+    sweep = config.get('sweep', {})
+    names = list(sweep)
+    tunable = {*default_hyperparameters, 'convergence', 'seed'}
+    runs = []
+    seen = set()
+    for layout_name, spec in config['layouts'].items():
+        env, start_positions, goals, layout_defaults = load_layout(spec)
+        digest = env_digest(env, start_positions, goals)
+        base = {**default_hyperparameters, **layout_defaults, **config.get('defaults', {})}
+        for trainer in config.get('trainers', ['batch']):
+            if trainer not in trainers:
+                raise ValueError(f"unknown trainer {trainer!r}, expected one of {trainers}")
+            if env.goal_conditioned and trainer in ('loop', 'plan'):
+                continue  # Both need fixed goals, goal-sampling layouts only run the batched trainers
+            for values in itertools.product(*(sweep[name] for name in names)):
+                for seed in config.get('seeds', [0]):
+                    run = dict(base, **dict(zip(names, values)), layout=layout_name, trainer=trainer, seed=seed,
+                               env=digest)
+                    run = {key: value for key, value in run.items()
+                           if key not in tunable or key in trainer_parameters[trainer]}
+                    key = run_hash(run)
+                    if key not in seen:
+                        seen.add(key)
+                        runs.append((run, env, start_positions, goals))
+    return runs
+
+
+def run_hash(run):
+    return hashlib.sha256(json.dumps(run, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def run_experiment(run, env, start_positions, goals):
+    # Trains a fresh table for one run, everything random comes from run['seed']
+    rng = np.random.default_rng(run.get('seed'))
+    q_table = QTable(env.grid_size, env.actions)
+    started = time.perf_counter()
+    trainer = run['trainer']
+    monitor = ConvergenceMonitor(**run['convergence']) if run.get('convergence') else None
+    if trainer == 'plan':
+        value_iteration(env, run['gamma'], q_table=q_table, goal=goals[0] if goals else None)
+        stats = {'success_rate': None}
+    elif trainer == 'loop':
+        stats = train_q_learning_single(env, q_table, start_positions[0], run['num_episodes'], run['alpha'],
+                                        run['gamma'], run['epsilon'], run['max_steps_per_episode'],
+                                        run['skip_bumps'], rng, monitor)
+    else:
+        batch_env = BatchGridEnv(env, run['n_envs'], start_positions, goals, rng)
+        if trainer == 'q_lambda':
+            stats = train_q_lambda_batch(batch_env, q_table, run['num_episodes'], run['alpha'], run['gamma'],
+                                         run['epsilon'], run['max_steps_per_episode'], run['lam'],
+                                         skip_bumps=run['skip_bumps'])
+        else:
+            stats = train_q_learning_batch(batch_env, q_table, run['num_episodes'], run['alpha'], run['gamma'],
+                                           run['epsilon'], run['max_steps_per_episode'], run['skip_bumps'], monitor)
+    seconds = time.perf_counter() - started
+
+    result = {'train_success_rate': stats['success_rate'], 'seconds': seconds, 'greedy_success': None,
+              'optimal_paths': None, 'mean_path_length': None, 'episodes_run': stats.get('episodes'),
+              'stop_reason': stats.get('stop_reason')}
+    if not env.goal_conditioned:
+        # The learned greedy path from every start against the planned one:
+        # it succeeds when it ends in the same kind of terminal (not a trap)
+        # and is optimal when it is also as short
+        planned, _ = value_iteration(env, run['gamma'])
+        reached, optimal, lengths = 0, 0, []
+        max_steps = max(run['max_steps_per_episode'], env.n_states)
+        for start in start_positions:
+            path = greedy_path(env, q_table, start, max_steps)
+            best = greedy_path(env, planned, start, max_steps)
+            if env.terminal_map[path[-1]] and env.reward_map[path[-1]] >= env.reward_map[best[-1]]:
+                reached += 1
+                lengths.append(len(path) - 1)
+                optimal += len(path) <= len(best)
+        result.update(greedy_success=reached / len(start_positions), optimal_paths=optimal / len(start_positions),
+                      mean_path_length=sum(lengths) / len(lengths) if lengths else None)
+    return result
+
+
+def run_sweep(config, workers=None, cache_dir='experiment_cache', log=print):
+    # Runs every uncached run of config, returns one row per run
+    os.makedirs(cache_dir, exist_ok=True)
+    rows = []
+    pending = []
+    for run, env, start_positions, goals in expand(config):
+        key = run_hash(run)
+        path = os.path.join(cache_dir, key + '.json')
+        if os.path.exists(path):
+            with open(path) as f:
+                rows.append(dict(run, **json.load(f)['result'], hash=key, cached=True))
+        else:
+            pending.append((key, path, run, env, start_positions, goals))
+    log(f"{len(rows) + len(pending)} runs, {len(rows)} cached, {len(pending)} to run")
+
+    with ProcessPoolExecutor(workers) as pool:
+        futures = {pool.submit(run_experiment, run, env, start_positions, goals): (key, path, run)
+                   for key, path, run, env, start_positions, goals in pending}
+        for done, future in enumerate(as_completed(futures), 1):
+            key, path, run = futures[future]
+            try:
+                result = future.result()
+            except Exception as error:  # A broken run is reported, not cached
+                log(f"[{done}/{len(pending)}] {key} failed: {error!r}")
+                continue
+            # Written as each run finishes, so an interrupted sweep resumes where it stopped
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump({'run': run, 'result': result}, f)
+            os.replace(tmp_path, path)
+            rows.append(dict(run, **result, hash=key, cached=False))
+            log(f"[{done}/{len(pending)}] {run['layout']} {run['trainer']} seed {run.get('seed', '-')}: "
+                f"greedy success {result['greedy_success']}, {result['seconds']:.2f} s")
+    rows.sort(key=lambda row: [str(row.get(column)) for column in parameter_columns(rows)])
+    return rows
+
+
+def parameter_columns(rows):
+    # What tells the runs apart: layout and trainer, every hyperparameter (the
+    # defaults, then anything else a run has, like swept keys) and the seed
+    names = ['layout', 'trainer', *default_hyperparameters]
+    skipped = {'hash', 'env', 'seed', *result_columns}
+    for row in rows:
+        names += [key for key in row if key not in names and key not in skipped]
+    return names + ['seed']
+
+
+def write_table(rows, filename):
+    with open(filename, 'w', newline='') as f:
+        writer = csv.DictWriter(f, ['hash', *parameter_columns(rows), *result_columns], extrasaction='ignore')
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({key: round(value, 4) if isinstance(value, float) else value
+                             for key, value in row.items()})
+
+
+def summary(rows):
+    # Mean over seeds of every configuration, best greedy success first.
+    # Hyperparameters without a column of their own are listed at the end of
+    # the line when they differ between runs.
+    shown = ['layout', 'trainer', 'alpha', 'gamma', 'epsilon', 'num_episodes', 'max_steps_per_episode']
+    grouped = parameter_columns(rows)[:-1]
+    varying = [column for column in grouped if column not in shown
+               and len({json.dumps(row[column], sort_keys=True) for row in rows if column in row}) > 1]
+    groups = {}
+    for row in rows:
+        key = tuple(json.dumps(row.get(column), sort_keys=True) for column in grouped)
+        groups.setdefault(key, []).append(row)
+
+    def mean(group, column):
+        values = [row[column] for row in group if row[column] is not None]
+        return sum(values) / len(values) if values else float('nan')
+
+    lines = [f"{'layout':14} {'trainer':8} {'alpha':>5} {'gamma':>5} {'eps':>5} {'episodes':>8} {'steps':>5} "
+             f"{'seeds':>5} {'greedy':>6} {'optimal':>7} {'train':>6} {'seconds':>8}"]
+    ranked = sorted(groups.values(), key=lambda group: (-np.nan_to_num(mean(group, 'greedy_success')),
+                                                        mean(group, 'seconds')))
+    for group in ranked:
+        layout, trainer, alpha, gamma, epsilon, episodes, steps = (str(group[0].get(column, '-')) for column in shown)
+        other = ' '.join(f"{column}={json.dumps(group[0][column])}" for column in varying if column in group[0])
+        lines.append(f"{layout:14} {trainer:8} {alpha:>5} {gamma:>5} {epsilon:>5} {episodes:>8} {steps:>5} "
+                     f"{len(group):>5} {mean(group, 'greedy_success'):>6.2f} {mean(group, 'optimal_paths'):>7.2f} "
+                     f"{mean(group, 'train_success_rate'):>6.2f} {mean(group, 'seconds'):>8.2f} {other}".rstrip())
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a hyperparameter sweep from a JSON config")
+    parser.add_argument('config')
+    parser.add_argument('--workers', type=int, default=None, help="process pool size, defaults to the CPU count")
+    parser.add_argument('--cache-dir', default='experiment_cache')
+    parser.add_argument('--output', default='results.csv')
+    args = parser.parse_args(argv)
+
+    with open(args.config) as f:
+        config = json.load(f)
+    rows = run_sweep(config, args.workers, args.cache_dir)
+    write_table(rows, args.output)
+    print(summary(rows))
+    print(f"results written to {args.output}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,147 @@
+import numpy as np
+
+from actionSelection import ActionSelector
+from gridEnv import BatchGridEnv
+from qTable import QTable
+
+
+class GoalConditionedQTable:
+    # Q-values indexed by (goal, state, action), one (rows, cols, n_actions)
+    # slab per goal in a single array of shape (n_goals, rows, cols, n_actions).
+    # Goals default to every cell of the grid.
+    def __init__(self, grid_size, actions, goals=None, dtype=np.float64):
+        self.grid_size = (int(grid_size[0]), int(grid_size[1]))
+        self.actions = list(actions)
+        if goals is None:
+            goals = [(x, y) for x in range(self.grid_size[0]) for y in range(self.grid_size[1])]
+        self.goals = [tuple(goal) for goal in goals]
+        self.goal_index = {goal: i for i, goal in enumerate(self.goals)}
+        # Goal index of every cell, -1 for cells that aren't goals
+        self.goal_lookup = np.full(self.grid_size, -1, dtype=np.int64)
+        for i, (x, y) in enumerate(self.goals):
+            self.goal_lookup[x, y] = i
+        self.array = np.zeros((len(self.goals),) + self.grid_size + (len(self.actions),), dtype=dtype)
+        self.version = 0
+
+    def table(self, goal):
+        # Plain QTable view for one goal, usable with extract_path and friends
+        table = QTable(self.grid_size, self.actions, array=self.array[self.goal_index[tuple(goal)]])
+        table.version = self.version
+        return table
+
+
+def train_goal_conditioned(env, gc_table, start_positions, num_episodes, alpha, gamma, epsilon,
+                           max_steps_per_episode, n_envs=64, rng=None):
+    # Epsilon-greedy rollouts towards goals sampled from gc_table.goals. Rewards
+    # only depend on the cell entered and the goal, so every transition is
+    # replayed for all goals at once: Q(g, s, a) moves towards
+    #   goal_reward                        if s' == g
+    #   r(s') + gamma * max Q(g, s', .)    otherwise
+    # which trains every goal from every episode. Q(g, g, .) stays 0.
+    if not env.goal_conditioned:
+        raise ValueError("train_goal_conditioned needs a goal conditioned env")
+    rng = rng if rng is not None else np.random.default_rng()
+    batch_env = BatchGridEnv(env, n_envs, start_positions, gc_table.goals, rng)
+    selector = ActionSelector(len(gc_table.actions), rng)
+    q = gc_table.array
+    goal_xs = np.array([goal[0] for goal in gc_table.goals])
+    goal_ys = np.array([goal[1] for goal in gc_table.goals])
+    all_goals = np.arange(len(gc_table.goals))
+
+    steps = np.zeros(n_envs, dtype=np.int64)
+    active = np.arange(n_envs) < num_episodes
+    started = int(active.sum())
+    finished = 0
+    success_count = 0
+
+    while finished < num_episodes:
+        index = np.flatnonzero(active)
+        xs = batch_env.xs[index]
+        ys = batch_env.ys[index]
+        goals = gc_table.goal_lookup[batch_env.goal_xs[index], batch_env.goal_ys[index]]
+
+        action_indices = selector.select_batch(q[goals, xs, ys], epsilon)
+
+        next_xs, next_ys, _, dones = batch_env.step(action_indices, index)
+
+        # (transition, goal) grid of targets
+        at_goal = (next_xs[:, None] == goal_xs) & (next_ys[:, None] == goal_ys)
+        ends = at_goal | env.terminal_map[next_xs, next_ys][:, None]
+        rewards = np.where(at_goal, env.goal_reward, env.reward_map[next_xs, next_ys][:, None])
+        max_future_q = q[:, next_xs, next_ys].max(axis=-1).T
+        targets = rewards + gamma * np.where(ends, 0.0, max_future_q)
+        current = q[:, xs, ys, action_indices].T
+        new_values = current + alpha * (targets - current)
+        # Don't learn values for standing on the goal itself
+        source_is_goal = (xs[:, None] == goal_xs) & (ys[:, None] == goal_ys)
+        new_values = np.where(source_is_goal, current, new_values)
+        q[all_goals[None, :], xs[:, None], ys[:, None], action_indices[:, None]] = new_values
+
+        steps[index] += 1
+        ended = dones | (steps[index] >= max_steps_per_episode)
+        success_count += int(dones.sum())
+        ended_index = index[ended]
+        finished += len(ended_index)
+        steps[ended_index] = 0
+        n_restart = min(len(ended_index), num_episodes - started)
+        restart_mask = np.zeros(n_envs, dtype=bool)
+        restart_mask[ended_index[:n_restart]] = True
+        active[ended_index[n_restart:]] = False
+        started += n_restart
+        if n_restart:
+            batch_env.reset(restart_mask)
+
+    gc_table.version += 1
+    return {'episodes': num_episodes, 'success_count': success_count,
+            'success_rate': success_count / num_episodes if num_episodes else 0.0}
+
+
+class RouteCache:
+    # Greedy routes for every (start, goal) pair, precomputed from a goal
+    # conditioned table as a next-hop array of shape (n_goals, n_states).
+    # Routes that end in a loop or against a wall are marked unreachable,
+    # so a query is a walk of path-length lookups.
+    def __init__(self, gc_table, env):
+        rows, cols = gc_table.grid_size
+        self.grid_size = (rows, cols)
+        self.goal_index = gc_table.goal_index
+        n_goals = len(gc_table.goals)
+        n_states = rows * cols
+        transitions = env.transition_table()
+        greedy = gc_table.array.reshape(n_goals, n_states, -1).argmax(axis=-1)
+        states = np.arange(n_states)
+        next_hop = transitions[states, greedy]
+        goal_states = np.array([x * cols + y for x, y in gc_table.goals], dtype=np.int64)
+        is_goal = states[None, :] == goal_states[:, None]
+        next_hop[is_goal] = states[np.nonzero(is_goal)[1]]
+
+        # Hops to the goal, found by relaxing dist(s) = dist(next_hop(s)) + 1
+        unreachable = np.iinfo(np.int32).max
+        distance = np.where(is_goal, 0, unreachable).astype(np.int64)
+        goal_rows = np.arange(n_goals)[:, None]
+        for _ in range(n_states):
+            relaxed = np.where(is_goal, 0, np.minimum(distance[goal_rows, next_hop] + 1, unreachable))
+            if np.array_equal(relaxed, distance):
+                break
+            distance = relaxed
+        self.next_hop = next_hop.astype(np.int32)
+        self.distance = distance.astype(np.int32)
+        self.unreachable = unreachable
+
+    def next_state(self, state, goal):
+        g = self.goal_index[tuple(goal)]
+        cols = self.grid_size[1]
+        return divmod(int(self.next_hop[g, state[0] * cols + state[1]]), cols)
+
+    def path(self, start, goal):
+        # Greedy path from start to goal, None when the greedy policy never gets there
+        g = self.goal_index[tuple(goal)]
+        cols = self.grid_size[1]
+        s = start[0] * cols + start[1]
+        if self.distance[g, s] == self.unreachable:
+            return None
+        path = [tuple(start)]
+        for _ in range(self.distance[g, s]):
+            s = int(self.next_hop[g, s])
+            path.append(divmod(s, cols))
+        return path
@@ -0,0 +1,298 @@
+import inspect
+
+import numpy as np
+
+from actionSelection import ActionSelector, TransitionTable
+from qTable import default_actions
+
+default_action_to_delta = {
+    'up': (-1, 0),
+    'down': (1, 0),
+    'left': (0, -1),
+    'right': (0, 1)
+}
+
+
+class GridEnv:
+    # Static description of a gridworld as arrays: the reward for entering a
+    # cell, the cells that end an episode and the cells that can't be entered.
+    # With goal_reward set the env is goal conditioned: every episode gets its
+    # own goal cell which pays goal_reward and ends the episode.
+    def __init__(self, grid_size, actions=default_actions, action_to_delta=default_action_to_delta,
+                 reward_map=None, terminal_map=None, blocked_map=None, goal_reward=None):
+        self.grid_size = (int(grid_size[0]), int(grid_size[1]))
+        self.actions = list(actions)
+        self.deltas = np.array([action_to_delta[action] for action in self.actions], dtype=np.int64)
+        if reward_map is None:
+            reward_map = np.zeros(self.grid_size)
+        if terminal_map is None:
+            terminal_map = np.zeros(self.grid_size, dtype=bool)
+        if blocked_map is None:
+            blocked_map = np.zeros(self.grid_size, dtype=bool)
+        self.reward_map = np.asarray(reward_map, dtype=np.float64)
+        self.terminal_map = np.asarray(terminal_map, dtype=bool)
+        self.blocked_map = np.asarray(blocked_map, dtype=bool)
+        self.goal_reward = goal_reward
+
+    @classmethod
+    def from_module(cls, module):
+        # Build the arrays by evaluating the script's own get_reward and
+        # is_valid_state on every cell, so the env matches the script exactly
+        rows, cols = module.grid_size
+        cells = [(x, y) for x in range(rows) for y in range(cols)]
+        blocked_map = np.array([not module.is_valid_state(cell) for cell in cells]).reshape(rows, cols)
+
+        goal_reward = None
+        terminal_map = np.zeros((rows, cols), dtype=bool)
+        if len(inspect.signature(module.get_reward).parameters) == 2:
+            # get_reward(state, goal): the goal is sampled per episode
+            reward_map = np.array([module.get_reward(cell, None) for cell in cells], dtype=np.float64)
+            goal = module.goals[0]
+            goal_reward = module.get_reward(goal, goal)
+        else:
+            reward_map = np.array([module.get_reward(cell) for cell in cells], dtype=np.float64)
+            for x, y in getattr(module, 'goals', None) or [module.goal]:
+                terminal_map[x, y] = True
+
+        return cls(module.grid_size, module.actions, module.action_to_delta,
+                   reward_map.reshape(rows, cols), terminal_map, blocked_map, goal_reward)
+
+    @property
+    def goal_conditioned(self):
+        return self.goal_reward is not None
+
+    @property
+    def n_states(self):
+        return self.grid_size[0] * self.grid_size[1]
+
+    def transition_table(self):
+        # Next cell as a flat index x * cols + y for every (cell, action), shape
+        # (n_states, n_actions). Moves off the grid or into blocked cells stay put.
+        rows, cols = self.grid_size
+        xs, ys = np.divmod(np.arange(rows * cols), cols)
+        next_xs = np.clip(xs[:, None] + self.deltas[:, 0], 0, rows - 1)
+        next_ys = np.clip(ys[:, None] + self.deltas[:, 1], 0, cols - 1)
+        blocked = self.blocked_map[next_xs, next_ys]
+        next_xs = np.where(blocked, xs[:, None], next_xs)
+        next_ys = np.where(blocked, ys[:, None], next_ys)
+        return next_xs * cols + next_ys
+
+
+class BatchGridEnv:
+    # n_envs agents moving through the same GridEnv in lockstep, their
+    # positions (and per-env goals) are kept as int arrays
+    def __init__(self, env, n_envs, start_positions, goals=None, rng=None):
+        if env.goal_conditioned and not goals:
+            raise ValueError("a goal conditioned env needs a list of goals to sample from")
+        self.env = env
+        self.n_envs = n_envs
+        self.start_positions = np.array(start_positions, dtype=np.int64).reshape(-1, 2)
+        self.goals = None if goals is None else np.array(goals, dtype=np.int64).reshape(-1, 2)
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.xs = np.zeros(n_envs, dtype=np.int64)
+        self.ys = np.zeros(n_envs, dtype=np.int64)
+        self.goal_xs = np.full(n_envs, -1, dtype=np.int64)
+        self.goal_ys = np.full(n_envs, -1, dtype=np.int64)
+        self.reset()
+
+    def reset(self, mask=None):
+        # Draw new starts (and goals) for the selected envs, all of them by default
+        index = np.arange(self.n_envs) if mask is None else np.flatnonzero(mask)
+        starts = self.start_positions[self.rng.integers(len(self.start_positions), size=len(index))]
+        self.xs[index] = starts[:, 0]
+        self.ys[index] = starts[:, 1]
+        if self.env.goal_conditioned:
+            goals = self.goals[self.rng.integers(len(self.goals), size=len(index))]
+            self.goal_xs[index] = goals[:, 0]
+            self.goal_ys[index] = goals[:, 1]
+
+    def step(self, action_indices, index=None):
+        # Move the selected envs (all by default) one step. Returns the next
+        # positions with the reward and done flag of every moved env.
+        if index is None:
+            index = slice(None)
+        env = self.env
+        xs = self.xs[index]
+        ys = self.ys[index]
+        deltas = env.deltas[action_indices]
+        next_xs = np.clip(xs + deltas[:, 0], 0, env.grid_size[0] - 1)
+        next_ys = np.clip(ys + deltas[:, 1], 0, env.grid_size[1] - 1)
+        blocked = env.blocked_map[next_xs, next_ys]
+        next_xs = np.where(blocked, xs, next_xs)
+        next_ys = np.where(blocked, ys, next_ys)
+
+        rewards = env.reward_map[next_xs, next_ys]
+        dones = env.terminal_map[next_xs, next_ys]
+        if env.goal_conditioned:
+            at_goal = (next_xs == self.goal_xs[index]) & (next_ys == self.goal_ys[index])
+            rewards = np.where(at_goal, env.goal_reward, rewards)
+            dones = dones | at_goal
+
+        self.xs[index] = next_xs
+        self.ys[index] = next_ys
+        return next_xs, next_ys, rewards, dones
+
+
+def train_q_learning_batch(batch_env, q_table, num_episodes, alpha, gamma, epsilon, max_steps_per_episode,
+                           skip_bumps=True, monitor=None):
+    # Epsilon-greedy Q-learning with every env of batch_env running its own
+    # episode. When two envs update the same (state, action) in one step the
+    # last one wins. skip_bumps leaves Q untouched for moves into a wall, like
+    # the `if state == next_state: continue` in the single-agent loops. With a
+    # convergence.ConvergenceMonitor training stops once it has converged.
+    selector = ActionSelector(len(q_table.actions), batch_env.rng)
+    n_envs = batch_env.n_envs
+    steps = np.zeros(n_envs, dtype=np.int64)
+    active = np.arange(n_envs) < num_episodes
+    started = int(active.sum())
+    finished = 0
+    success_count = 0
+    total_steps_to_goal = 0
+    total_steps = 0
+    batch_env.reset()
+    if monitor is not None:
+        monitor.start(q_table)
+
+    while finished < num_episodes:
+        index = np.flatnonzero(active)
+        xs = batch_env.xs[index]
+        ys = batch_env.ys[index]
+
+        # Epsilon-greedy with random tie-breaking among the maximal actions
+        q_rows = q_table.lookup(xs, ys)
+        action_indices = selector.select_batch(q_rows, epsilon)
+
+        next_xs, next_ys, rewards, dones = batch_env.step(action_indices, index)
+
+        update = ~((next_xs == xs) & (next_ys == ys)) if skip_bumps else np.ones(len(index), dtype=bool)
+        max_future_q = q_table.lookup(next_xs, next_ys).max(axis=1)
+        targets = rewards + gamma * np.where(dones, 0.0, max_future_q)
+        current = q_rows[np.arange(len(index)), action_indices]
+        new_values = current + alpha * (targets - current)
+        q_table.assign(xs[update], ys[update], action_indices[update], new_values[update])
+        if monitor is not None:
+            monitor.update_batch(xs[update], ys[update], np.abs(new_values - current)[update], q_table)
+
+        steps[index] += 1
+        total_steps += len(index)
+        ended = dones | (steps[index] >= max_steps_per_episode)
+        success_count += int(dones.sum())
+        total_steps_to_goal += int(steps[index][dones].sum())
+
+        ended_index = index[ended]
+        finished += len(ended_index)
+        if monitor is not None and monitor.end_episodes(steps[ended_index], dones[ended]):
+            break
+        steps[ended_index] = 0
+        # Restart finished envs while there are episodes left, retire the rest
+        n_restart = min(len(ended_index), num_episodes - started)
+        restart_mask = np.zeros(n_envs, dtype=bool)
+        restart_mask[ended_index[:n_restart]] = True
+        active[ended_index[n_restart:]] = False
+        started += n_restart
+        if n_restart:
+            batch_env.reset(restart_mask)
+
+    stats = {
+        'episodes': finished,
+        'steps': total_steps,
+        'success_count': success_count,
+        'success_rate': success_count / finished if finished else 0.0,
+        'avg_steps_to_goal': total_steps_to_goal / success_count if success_count else 0.0,
+    }
+    if monitor is not None:
+        stats.update(monitor.report())
+    return stats
+
+
+def train_q_learning_single(env, q_table, start, num_episodes, alpha, gamma, epsilon, max_steps_per_episode,
+                            skip_bumps=True, rng=None, monitor=None):
+    # Reference single-agent loop over a GridEnv, one Python step at a time
+    # like the scripts' train_q_learning. rng is a numpy Generator, actions and
+    # steps come from actionSelection's block-drawn selector and tables.
+    # monitor stops training early, see train_q_learning_batch.
+    if env.goal_conditioned:
+        raise ValueError("train_q_learning_single needs an env with fixed goals")
+    selector = ActionSelector(len(env.actions), rng)
+    table = TransitionTable(env)
+    next_states, rewards, dones, states = table.next_state, table.reward, table.done, table.states
+    success_count = 0
+    total_steps_to_goal = 0
+    total_steps = 0
+    episodes = 0
+    if monitor is not None:
+        monitor.start(q_table)
+
+    for episode in range(num_episodes):
+        s = table.index(start)
+        done = False
+        for step in range(max_steps_per_episode):
+            state = states[s]
+            action = selector.select(q_table.lookup(state[0], state[1]), epsilon)
+            next_s = next_states[s][action]
+            if skip_bumps and next_s == s:
+                continue
+
+            done = dones[s][action]
+            max_future_q = 0.0 if done else q_table.max_q(states[next_s])
+            td_error = q_table.update(state, action, rewards[s][action] + gamma * max_future_q, alpha)
+            if monitor is not None:
+                monitor.update(state, abs(alpha * td_error), q_table)
+            s = next_s
+            if done:
+                success_count += 1
+                total_steps_to_goal += step + 1
+                break
+        total_steps += step + 1
+        episodes += 1
+        if monitor is not None and monitor.end_episode(step + 1, done):
+            break
+
+    stats = {
+        'episodes': episodes,
+        'steps': total_steps,
+        'success_count': success_count,
+        'success_rate': success_count / episodes if episodes else 0.0,
+        'avg_steps_to_goal': total_steps_to_goal / success_count if success_count else 0.0,
+    }
+    if monitor is not None:
+        stats.update(monitor.report())
+    return stats
+
+
+def greedy_path(env, q_table, start, max_steps):
+    # Same walk as the scripts' extract_path: follow the first maximal action
+    # until a terminal cell, a move that goes nowhere or max_steps
+    rows, cols = env.grid_size
+    path = [tuple(start)]
+    x, y = start
+    for _ in range(max_steps):
+        if env.terminal_map[x, y]:
+            break
+        dx, dy = env.deltas[q_table.greedy_action((x, y))]
+        next_x, next_y = x + dx, y + dy
+        if not (0 <= next_x < rows and 0 <= next_y < cols) or env.blocked_map[next_x, next_y]:
+            break
+        x, y = int(next_x), int(next_y)
+        path.append((x, y))
+    return path
+
+
+def setup_from_module(module):
+    # The env of a training script plus the starts and goals its episodes sample from
+    env = GridEnv.from_module(module)
+    if hasattr(module, 'start_positions'):
+        start_positions = module.start_positions
+    else:
+        start_positions = [module.start]
+    goals = module.goals if env.goal_conditioned else None
+    return env, start_positions, goals
+
+
+def train_module_batch(module, n_envs=256, seed=None, skip_bumps=True, monitor=None):
+    # Batched replacement for a script's train_q_learning: reads the script's
+    # environment and hyperparameter globals and trains its q_table in place
+    env, start_positions, goals = setup_from_module(module)
+    batch_env = BatchGridEnv(env, n_envs, start_positions, goals, np.random.default_rng(seed))
+    return train_q_learning_batch(batch_env, module.q_table, module.num_episodes, module.alpha, module.gamma,
+                                  module.epsilon, module.max_steps_per_episode, skip_bumps, monitor)
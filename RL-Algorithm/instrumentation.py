@@ -0,0 +1,103 @@
+import logging
+import sys
+import time
+from logging.handlers import MemoryHandler
+
+DEBUG = logging.DEBUG
+INFO = logging.INFO
+WARNING = logging.WARNING
+
+
+class TrainingLog:
+    # Instrumentation for the training loops. Messages go through a leveled
+    # logger whose output is buffered and written in blocks, step messages
+    # are only emitted every step_every steps and episode summaries every
+    # episode_every episodes. Per-episode counters (steps, return, TD-error
+    # magnitude, wall time) are kept when metrics is True.
+    #
+    # Loops take log=None by default and guard every call with
+    # `if log is not None`, so switching instrumentation off costs nothing.
+    def __init__(self, level=INFO, step_every=0, episode_every=1000, metrics=True, dump_q_table=False,
+                 stream=None, buffer_size=1024, name='training'):
+        # A standalone logger per run, so concurrent runs don't share handlers
+        self.logger = logging.Logger(name, level)
+        self._target = logging.StreamHandler(stream if stream is not None else sys.stdout)
+        self._target.setFormatter(logging.Formatter('%(message)s'))
+        self._handler = MemoryHandler(buffer_size, flushLevel=logging.ERROR, target=self._target)
+        self.logger.addHandler(self._handler)
+
+        # Sampling is resolved up front so disabled levels never format a message
+        self.step_every = step_every if self.logger.isEnabledFor(DEBUG) else 0
+        self.episode_every = episode_every if self.logger.isEnabledFor(INFO) else 0
+        self.dump_q_table = dump_q_table
+        self.metrics = metrics
+
+        self.episode_steps = []
+        self.episode_returns = []
+        self.episode_max_td_errors = []
+        self.episode_mean_td_errors = []
+        self.episode_times = []
+        self.episode_successes = []
+
+        self._total_steps = 0
+        self._return = 0.0
+        self._td_sum = 0.0
+        self._td_max = 0.0
+        self._updates = 0
+        self._episode_start = 0.0
+
+    def start_episode(self, episode):
+        self._return = 0.0
+        self._td_sum = 0.0
+        self._td_max = 0.0
+        self._updates = 0
+        self._episode_start = time.perf_counter()
+
+    def step(self, episode, step, state, next_state, reward, td_error, q_table=None):
+        if self.metrics:
+            self._return += reward
+            td_abs = abs(td_error)
+            self._td_sum += td_abs
+            if td_abs > self._td_max:
+                self._td_max = td_abs
+            self._updates += 1
+
+        self._total_steps += 1
+        if self.step_every and self._total_steps % self.step_every == 0:
+            self.logger.debug(f"{episode=}, {step=}, {state=}, {next_state=}, {reward=}, {td_error=:.4f}")
+            if self.dump_q_table and q_table is not None:
+                for table_state, row in q_table.items():
+                    self.logger.debug(f"State {table_state}: {row}")
+
+    def end_episode(self, episode, steps, success):
+        if self.metrics:
+            self.episode_steps.append(steps)
+            self.episode_returns.append(self._return)
+            self.episode_max_td_errors.append(self._td_max)
+            self.episode_mean_td_errors.append(self._td_sum / self._updates if self._updates else 0.0)
+            self.episode_times.append(time.perf_counter() - self._episode_start)
+            self.episode_successes.append(success)
+
+        if self.episode_every and (episode + 1) % self.episode_every == 0:
+            self.logger.info(self.summary_line(episode))
+
+    def summary_line(self, episode):
+        if not self.metrics or not self.episode_steps:
+            return f"episode {episode}"
+        window = min(self.episode_every or len(self.episode_steps), len(self.episode_steps))
+        steps = self.episode_steps[-window:]
+        successes = self.episode_successes[-window:]
+        elapsed = sum(self.episode_times[-window:])
+        return (f"episode {episode}: success rate {sum(successes) / window:.2f}, "
+                f"avg steps {sum(steps) / window:.1f}, avg return {sum(self.episode_returns[-window:]) / window:.1f}, "
+                f"max |td| {max(self.episode_max_td_errors[-window:]):.4f}, "
+                f"{window / elapsed if elapsed else 0.0:.0f} episodes/s")
+
+    def info(self, message):
+        self.logger.info(message)
+
+    def flush(self):
+        self._handler.flush()
+
+    def close(self):
+        self._handler.close()
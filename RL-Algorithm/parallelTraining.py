@@ -0,0 +1,131 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from gridEnv import BatchGridEnv, setup_from_module, train_q_learning_batch
+from qTable import QTable
+
+merge_modes = ('average', 'hogwild')
+deterministic_shards = 8  # Shards per round with deterministic=True, whatever the pool size
+
+# Per-process state set up once by the pool initializer
+_worker = {}
+
+
+def _init_worker(env, start_positions, goals, shape, dtype, shared_name, results_name, settings):
+    shared = shared_memory.SharedMemory(name=shared_name)
+    _worker['shared'] = shared
+    _worker['table'] = np.ndarray(shape, dtype=dtype, buffer=shared.buf)
+    if results_name is not None:
+        results = shared_memory.SharedMemory(name=results_name)
+        _worker['results_shm'] = results
+        _worker['results'] = np.ndarray((settings['n_shards'],) + shape, dtype=dtype, buffer=results.buf)
+    _worker['env'] = env
+    _worker['start_positions'] = start_positions
+    _worker['goals'] = goals
+    _worker['settings'] = settings
+
+
+def _run_worker(slot, episodes, seed):
+    settings = _worker['settings']
+    env = _worker['env']
+    shared = _worker['table']
+    if settings['merge'] == 'hogwild':
+        # Lock-free: train straight on the shared table, last writer wins
+        q_table = QTable(env.grid_size, env.actions, array=shared)
+    else:
+        # Train on a private copy of the last merged table, the parent averages the copies
+        q_table = QTable(env.grid_size, env.actions, array=_worker['results'][slot])
+        q_table.copy_from(shared)
+
+    batch_env = BatchGridEnv(env, settings['n_envs'], _worker['start_positions'], _worker['goals'],
+                             np.random.default_rng(seed))
+    return train_q_learning_batch(batch_env, q_table, episodes, settings['alpha'], settings['gamma'],
+                                  settings['epsilon'], settings['max_steps_per_episode'], settings['skip_bumps'])
+
+
+def _split(total, parts):
+    return [total // parts + (1 if i < total % parts else 0) for i in range(parts)]
+
+
+def train_q_learning_parallel(env, q_table, start_positions, num_episodes, alpha, gamma, epsilon,
+                              max_steps_per_episode, goals=None, n_workers=None, sync_every=1000, merge='average',
+                              seed=None, deterministic=False, n_envs=64, skip_bumps=True, n_shards=None):
+    # Splits num_episodes over a process pool. Each round is split into
+    # n_shards shards of sync_every episodes, each trained from its own seed
+    # by one of the n_workers processes, then the shards are synced through
+    # the shared-memory table:
+    #   average  - shards train private copies of the merged table, the
+    #              parent averages them at the end of the round
+    #   hogwild  - shards update the shared table directly without locks
+    # n_shards defaults to n_workers. deterministic forces the average merge,
+    # a fixed seed and deterministic_shards shards unless n_shards is given,
+    # so the same arguments always give the same table on any machine.
+    if merge not in merge_modes:
+        raise ValueError(f"merge must be one of {merge_modes}, got {merge!r}")
+    n_workers = n_workers or os.cpu_count()
+    if deterministic:
+        merge = 'average'
+        seed = 0 if seed is None else seed
+        n_shards = n_shards or deterministic_shards
+    n_shards = n_shards or n_workers
+
+    shape = q_table.array.shape
+    dtype = q_table.array.dtype
+    shared = shared_memory.SharedMemory(create=True, size=q_table.array.nbytes)
+    results = None
+    if merge == 'average':
+        results = shared_memory.SharedMemory(create=True, size=q_table.array.nbytes * n_shards)
+    try:
+        table = np.ndarray(shape, dtype=dtype, buffer=shared.buf)
+        table[...] = q_table.array
+        settings = {
+            'n_shards': n_shards, 'merge': merge, 'n_envs': n_envs, 'alpha': alpha, 'gamma': gamma,
+            'epsilon': epsilon, 'max_steps_per_episode': max_steps_per_episode, 'skip_bumps': skip_bumps,
+        }
+        init_args = (env, start_positions, goals, shape, dtype, shared.name,
+                     results.name if results is not None else None, settings)
+
+        episodes_per_round = sync_every * n_shards
+        rounds = _split(num_episodes, -(-num_episodes // episodes_per_round)) if num_episodes else []
+        seeds = np.random.SeedSequence(seed).spawn(len(rounds) * n_shards)
+        stats = {'episodes': 0, 'steps': 0, 'success_count': 0}
+        total_steps_to_goal = 0.0
+
+        with ProcessPoolExecutor(n_workers, initializer=_init_worker, initargs=init_args) as pool:
+            for round_number, round_episodes in enumerate(rounds):
+                chunks = [chunk for chunk in _split(round_episodes, n_shards) if chunk]
+                futures = [pool.submit(_run_worker, slot, chunk, seeds[round_number * n_shards + slot])
+                           for slot, chunk in enumerate(chunks)]
+                for future in futures:
+                    result = future.result()
+                    for key in stats:
+                        stats[key] += result[key]
+                    total_steps_to_goal += result['avg_steps_to_goal'] * result['success_count']
+                if merge == 'average':
+                    shard_tables = np.ndarray((n_shards,) + shape, dtype=dtype, buffer=results.buf)
+                    table[...] = shard_tables[:len(chunks)].mean(axis=0)
+
+        q_table.copy_from(table)
+        del table
+    finally:
+        shared.close()
+        shared.unlink()
+        if results is not None:
+            results.close()
+            results.unlink()
+
+    stats['success_rate'] = stats['success_count'] / stats['episodes'] if stats['episodes'] else 0.0
+    stats['avg_steps_to_goal'] = total_steps_to_goal / stats['success_count'] if stats['success_count'] else 0.0
+    return stats
+
+
+def train_module_parallel(module, n_workers=None, sync_every=1000, merge='average', seed=None, deterministic=False,
+                          n_envs=64, skip_bumps=True, n_shards=None):
+    # Parallel replacement for a script's train_q_learning, see train_module_batch
+    env, start_positions, goals = setup_from_module(module)
+    return train_q_learning_parallel(env, module.q_table, start_positions, module.num_episodes, module.alpha,
+                                     module.gamma, module.epsilon, module.max_steps_per_episode, goals, n_workers,
+                                     sync_every, merge, seed, deterministic, n_envs, skip_bumps, n_shards)
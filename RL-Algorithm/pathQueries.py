@@ -0,0 +1,130 @@
+import numpy as np
+
+# Greedy paths for many starts at once. The greedy move of every cell is
+# turned into one next-state array, computed once per table version, and all
+# walkers advance through it together. Each walk ends like extract_path's:
+#   'goal'       reached its goal (or any terminal cell when no goals are given)
+#   'stuck'      the greedy move goes nowhere (a wall or the grid edge)
+#   'loop'       the walk came back to a cell it had visited, it would cycle
+#                forever, the path stops before the repeated cell
+#   'max_steps'  still walking after max_steps moves
+# Loops are found without per-walker visited sets: a second pointer walks the
+# same policy at double speed (Floyd's cycle detection) and meets the walker
+# only if its walk cycles.
+
+statuses = ['max_steps', 'goal', 'stuck', 'loop']
+
+
+class PathQuery:
+    def __init__(self, env, q_table):
+        self.env = env
+        self.q_table = q_table
+        self._transitions = env.transition_table()
+        self._next_states = None
+        self._version = None
+
+    def next_states(self):
+        # Flat greedy next state of every cell, first maximal action like
+        # greedy_action, cached until the table changes
+        if self._next_states is None or self._version != self.q_table.version:
+            greedy = self.q_table.greedy_actions().ravel()
+            self._version = self.q_table.version
+            self._next_states = self._transitions[np.arange(len(greedy)), greedy]
+        return self._next_states
+
+    def walk(self, starts, goals=None, max_steps=100):
+        # starts and goals are (n, 2) cells, goals one per start. Returns the
+        # paths as flat states in an (n, up to max_steps + 1) array, the number of
+        # cells of each path and the index of each walk's status in statuses.
+        cols = self.env.grid_size[1]
+        starts = np.asarray(starts, dtype=np.int64).reshape(-1, 2)
+        n = len(starts)
+        next_states = self.next_states()
+        terminal = self.env.terminal_map.ravel()
+        goal_states = None
+        if goals is not None:
+            goals = np.asarray(goals, dtype=np.int64).reshape(-1, 2)
+            goal_states = np.broadcast_to(goals[:, 0] * cols + goals[:, 1], (n,))
+
+        def at_goal(states, walkers):
+            return terminal[states] if goal_states is None else states == goal_states[walkers]
+
+        current = starts[:, 0] * cols + starts[:, 1]
+        # Columns are added as the longest walk grows, most end long before max_steps
+        paths = np.zeros((n, min(max_steps + 1, 64)), dtype=np.int64)
+        paths[:, 0] = current
+        lengths = np.ones(n, dtype=np.int64)
+        status = np.zeros(n, dtype=np.int8)
+        everyone = np.arange(n)
+        status[at_goal(current, everyone)] = 1
+        active = status == 0
+        # The fast pointer, and whether it has passed something the walker
+        # stops at (then the walker will stop there too, it isn't cycling)
+        hare = current.copy()
+        hare_stops = ~active
+
+        for step in range(1, max_steps + 1):
+            walkers = np.flatnonzero(active)
+            if not walkers.size:
+                break
+            states = current[walkers]
+            moved = next_states[states]
+            stuck = moved == states
+            status[walkers[stuck]] = 2
+            active[walkers[stuck]] = False
+
+            walkers, moved = walkers[~stuck], moved[~stuck]
+            if step == paths.shape[1]:
+                paths = np.concatenate([paths, np.zeros_like(paths)], axis=1)[:, :max_steps + 1]
+            current[walkers] = moved
+            paths[walkers, step] = moved
+            lengths[walkers] += 1
+            reached = at_goal(moved, walkers)
+            status[walkers[reached]] = 1
+            active[walkers[reached]] = False
+
+            walkers = walkers[~reached]
+            for _ in range(2):
+                fast = next_states[hare[walkers]]
+                hare_stops[walkers] |= (fast == hare[walkers]) | at_goal(fast, walkers)
+                hare[walkers] = fast
+            looping = walkers[(hare[walkers] == current[walkers]) & ~hare_stops[walkers]]
+            status[looping] = 3
+            active[looping] = False
+
+        # The pointers meet less than one cycle before the walker repeats a
+        # cell, or just as it does when its start is on the cycle. Finish each
+        # loop up to its first repeated cell.
+        for walker in np.flatnonzero(status == 3).tolist():
+            length = int(lengths[walker])
+            seen = set(paths[walker, :length - 1].tolist())
+            state = int(paths[walker, length - 1])
+            if state in seen:
+                lengths[walker] = length - 1
+                continue
+            seen.add(state)
+            while True:
+                state = int(next_states[state])
+                if state in seen:
+                    break
+                if length == max_steps + 1:
+                    status[walker] = 0
+                    break
+                if length == paths.shape[1]:
+                    paths = np.concatenate([paths, np.zeros_like(paths)], axis=1)[:, :max_steps + 1]
+                seen.add(state)
+                paths[walker, length] = state
+                length += 1
+            lengths[walker] = length
+        return paths, lengths, status
+
+    def paths(self, starts, goals=None, max_steps=100):
+        # Same walk, as lists of (x, y) tuples and status names
+        paths, lengths, status = self.walk(starts, goals, max_steps)
+        # One conversion of all visited cells, then split per walker
+        visited = paths[np.arange(paths.shape[1]) < lengths[:, None]]
+        xs, ys = np.divmod(visited, self.env.grid_size[1])
+        xs, ys = xs.tolist(), ys.tolist()
+        ends = np.cumsum(lengths).tolist()
+        cells = [list(zip(xs[end - length:end], ys[end - length:end])) for end, length in zip(ends, lengths.tolist())]
+        return cells, [statuses[s] for s in status.tolist()]
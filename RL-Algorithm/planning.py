@@ -0,0 +1,153 @@
+import heapq
+
+import numpy as np
+
+from gridEnv import GridEnv
+from qTable import QTable
+
+
+class GridModel:
+    # Transition and reward model of a deterministic GridEnv. Every (state,
+    # action) has exactly one successor, so the sparse transition matrix is
+    # stored as an index array plus its transpose in CSR form for predecessor
+    # lookups. States are flat indices x * cols + y.
+    def __init__(self, env, goal=None):
+        if env.goal_conditioned and goal is None:
+            raise ValueError("a goal conditioned env needs a goal to plan for")
+        self.env = env
+        self.n_states = env.n_states
+        self.n_actions = len(env.actions)
+        self.next_state = env.transition_table()
+
+        reward_map = env.reward_map.ravel().copy()
+        terminal = env.terminal_map.ravel().copy()
+        if goal is not None:
+            goal_index = goal[0] * env.grid_size[1] + goal[1]
+            reward_map[goal_index] = env.goal_reward
+            terminal[goal_index] = True
+        self.terminal = terminal
+        # Terminal rows stay 0, folded into reward and continuation so a
+        # backup is a single gather and multiply-add
+        self.reward = np.where(terminal[:, None], 0.0, reward_map[self.next_state])
+        self.done = terminal[self.next_state]
+        self.continues = np.where(self.done | terminal[:, None], 0.0, 1.0)
+
+        # Predecessors of s are pred_states[pred_indptr[s]:pred_indptr[s + 1]]
+        order = np.argsort(self.next_state, axis=None, kind='stable')
+        self.pred_states = order // self.n_actions
+        self.pred_indptr = np.searchsorted(self.next_state.ravel()[order], np.arange(self.n_states + 1))
+
+    def predecessors(self, state):
+        return np.unique(self.pred_states[self.pred_indptr[state]:self.pred_indptr[state + 1]])
+
+    def backup(self, values, gamma, states=None):
+        # One Bellman optimality backup, Q(s, a) = r + gamma * V(s'), terminal rows stay 0
+        if states is None:
+            return self.reward + gamma * self.continues * values[self.next_state]
+        return self.reward[states] + gamma * self.continues[states] * values[self.next_state[states]]
+
+
+def value_iteration(env, gamma, theta=1e-6, max_iterations=10000, q_table=None, goal=None):
+    # Solves for Q* with synchronous vectorized value iteration, stopping once
+    # no state value moves by more than theta. Writes into q_table (a new
+    # QTable when None) and returns it with the iterations used and last delta.
+    model = GridModel(env, goal)
+    if q_table is None:
+        q_table = QTable(env.grid_size, env.actions)
+    values = q_table.array.reshape(model.n_states, model.n_actions).max(axis=1)
+    q = None
+    delta = np.inf
+    iterations = 0
+    while iterations < max_iterations and delta > theta:
+        q = model.backup(values, gamma)
+        new_values = q.max(axis=1)
+        delta = float(np.abs(new_values - values).max()) if model.n_states else 0.0
+        values = new_values
+        iterations += 1
+    if q is not None:
+        q_table.copy_from(q.reshape(q_table.array.shape))
+    return q_table, {'iterations': iterations, 'delta': delta, 'converged': delta <= theta}
+
+
+class PrioritizedSweeping:
+    # Keeps a planned Q-table consistent with its env through incremental
+    # backups. Changed states are queued by the size of their Bellman error,
+    # and every backup that moves V(s) by more than theta queues the
+    # predecessors of s, so only the part of the map affected by a change is
+    # touched.
+    def __init__(self, env, q_table, gamma, theta=1e-6, goal=None):
+        self.q_table = q_table
+        self.gamma = gamma
+        self.theta = theta
+        self.goal = goal
+        self.set_env(env)
+
+    def set_env(self, env):
+        self.env = env
+        self.model = GridModel(env, self.goal)
+
+    def _priorities(self, q, values, states):
+        # Largest Bellman error over the actions of each state, so Q-values of
+        # non-greedy actions are kept exact as well
+        return np.abs(self.model.backup(values, self.gamma, states) - q[states]).max(axis=1)
+
+    def sweep(self, states=None, max_backups=None):
+        # Back up the given flat states (every state when None), then back up
+        # the predecessors of every state whose value moved, highest Bellman
+        # error first. Returns the number of state backups done.
+        model = self.model
+        q = self.q_table.array.reshape(model.n_states, model.n_actions)
+        values = q.max(axis=1)
+        states = np.arange(model.n_states) if states is None else np.unique(np.asarray(states, dtype=np.int64))
+        q[states] = model.backup(values, self.gamma, states)
+        new_values = q[states].max(axis=1)
+        moved = states[np.abs(new_values - values[states]) > self.theta]
+        values[states] = new_values
+        backups = len(states)
+
+        queue = []
+        queued = set()
+
+        def push_predecessors(moved_states):
+            for s in moved_states:
+                predecessors = model.predecessors(s)
+                for p, priority in zip(predecessors.tolist(), self._priorities(q, values, predecessors)):
+                    if priority > self.theta and p not in queued:
+                        heapq.heappush(queue, (-priority, p))
+                        queued.add(p)
+
+        push_predecessors(moved)
+        while queue and (max_backups is None or backups < max_backups):
+            _, s = heapq.heappop(queue)
+            queued.discard(s)
+            q[s] = model.backup(values, self.gamma, np.array([s]))[0]
+            new_value = q[s].max()
+            change = abs(new_value - values[s])
+            values[s] = new_value
+            backups += 1
+            if change > self.theta:
+                push_predecessors([s])
+        self.q_table.version += 1
+        return backups
+
+    def update_env(self, env, changed_cells, max_backups=None):
+        # Switch to an edited env (obstacles added or removed, rewards or
+        # goals moved) and re-plan starting from the changed cells and the
+        # states that could step into them before or after the edit
+        old_model = self.model
+        self.set_env(env)
+        cols = env.grid_size[1]
+        states = set()
+        for x, y in changed_cells:
+            s = x * cols + y
+            states.add(s)
+            states.update(old_model.predecessors(s).tolist())
+            states.update(self.model.predecessors(s).tolist())
+        return self.sweep(sorted(states), max_backups)
+
+
+def plan_module(module, theta=1e-6):
+    # Model-based replacement for a script's train_q_learning: value iteration
+    # on the script's own environment, written into its q_table
+    env = GridEnv.from_module(module)
+    return value_iteration(env, module.gamma, theta, q_table=module.q_table)[1]
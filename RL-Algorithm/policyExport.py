@@ -0,0 +1,256 @@
+import argparse
+import importlib
+import sys
+
+import numpy as np
+
+import checkpoint
+from gridEnv import GridEnv
+
+# Read-only policy artifacts for inference. Only the greedy action of every
+# cell is needed to walk a path, so a trained table is frozen into the
+# greedy action packed into as few bits as the actions need (2 bits for the
+# four moves, 4 cells per byte) plus the env's terminal and blocked cells
+# as bitmaps. Optionally the Q-values are kept for ranking the actions:
+#   'float16'  half precision values
+#   'int8'     values / scale rounded to int8, one float32 scale per cell
+# The artifact is a checkpoint container (see checkpoint.py) opened with
+# numpy.memmap, so a policy for a huge map is walked without loading it.
+
+extension = '.qpolicy'
+value_formats = [None, 'float16', 'int8']
+block_rows = 96  # Multiple of 8, every block of cells packs into whole bytes
+
+
+def action_bits(n_actions):
+    for bits in (1, 2, 4, 8):
+        if n_actions <= 1 << bits:
+            return bits
+    raise ValueError(f"{n_actions} actions don't fit a one byte policy")
+
+
+def pack(values, bits):
+    # Values below 2 ** bits, 8 // bits to a byte, the first in the low bits
+    per_byte = 8 // bits
+    padded = np.zeros(-(-len(values) // per_byte) * per_byte, dtype=np.uint8)
+    padded[:len(values)] = values
+    shifts = np.arange(per_byte, dtype=np.uint8) * bits
+    return np.bitwise_or.reduce(padded.reshape(-1, per_byte) << shifts, axis=1).astype(np.uint8)
+
+
+def unpack(packed, bits, count):
+    per_byte = 8 // bits
+    shifts = np.arange(per_byte, dtype=np.uint8) * bits
+    return ((np.asarray(packed)[:, None] >> shifts) & ((1 << bits) - 1)).reshape(-1)[:count]
+
+
+def quantize(values, value_format):
+    # Stored arrays of a block of Q-values: {'q': ...} plus 'scales' for int8
+    if value_format == 'float16':
+        q = values.astype('<f2')
+        if not np.isfinite(q[np.isfinite(values)]).all():
+            raise ValueError("Q-values beyond the float16 range, export them as int8")
+        return {'q': q}
+    if value_format == 'int8':
+        scales = (np.abs(values).max(axis=-1) / 127.0).astype('<f4')
+        scales[scales == 0.0] = 1.0
+        return {'q': np.rint(values / scales[..., None]).astype(np.int8), 'scales': scales}
+    raise ValueError(f"unknown value format {value_format!r}, expected one of {value_formats[1:]}")
+
+
+def dequantize(q, scales=None):
+    if scales is None:
+        return q.astype(np.float32)
+    return q.astype(np.float32) * scales[..., None]
+
+
+def export_policy(env, q_table, filename, values=None, **hyperparameters):
+    # Freezes q_table into filename, walked on env's layout. values is one of
+    # value_formats. Returns the agreement with the full precision table, see
+    # agreement().
+    if tuple(env.grid_size) != q_table.grid_size or list(env.actions) != q_table.actions:
+        raise ValueError("the env and the Q-table have different grids or actions")
+    rows, cols = q_table.grid_size
+    bits = action_bits(len(q_table.actions))
+    greedy = []
+    stored = {}
+    matches = {'actions': 0, 'values': 0}
+    free_cells = 0
+    for x0 in range(0, rows, block_rows):
+        block = np.asarray(q_table.array[x0:x0 + block_rows], dtype=np.float64)
+        actions = block.argmax(axis=2)
+        greedy.append(pack(actions.ravel(), bits))
+        free = ~env.blocked_map[x0:x0 + block_rows]
+        free_cells += int(free.sum())
+        matches['actions'] += int(free.sum())
+        if values is not None:
+            arrays = quantize(block, values)
+            for name, array in arrays.items():
+                stored.setdefault(name, []).append(array)
+            ranked = dequantize(arrays['q'], arrays.get('scales')).argmax(axis=2)
+            matches['values'] += int(((ranked == actions) & free).sum())
+
+    meta = {
+        'kind': 'policy',
+        'grid_size': [rows, cols],
+        'actions': q_table.actions,
+        'deltas': env.deltas.tolist(),
+        'action_bits': bits,
+        'values': values,
+        'hyperparameters': hyperparameters,
+    }
+    arrays = {
+        'greedy': np.concatenate(greedy),
+        'terminal': pack(env.terminal_map.ravel(), 1),
+        'blocked': pack(env.blocked_map.ravel(), 1),
+    }
+    arrays.update({name: np.concatenate(blocks) for name, blocks in stored.items()})
+    checkpoint.write_container(filename, meta, arrays)
+    return _rates(matches, free_cells, values)
+
+
+def _rates(matches, free_cells, values):
+    rates = {'cells': free_cells, 'actions': matches['actions'] / free_cells if free_cells else 1.0}
+    if values is not None:
+        rates['values'] = matches['values'] / free_cells if free_cells else 1.0
+    return rates
+
+
+class Policy:
+    # A loaded artifact. greedy_action, greedy_actions and version match
+    # QTable's, so gridEnv.greedy_path and pathQueries.PathQuery take a
+    # Policy in place of the table.
+    def __init__(self, header, arrays):
+        self.header = header
+        self.grid_size = tuple(header['grid_size'])
+        self.actions = header['actions']
+        self.deltas = np.array(header['deltas'], dtype=np.int64)
+        self.bits = header['action_bits']
+        self.values = header['values']
+        self.arrays = arrays
+        self.version = 0  # Never written, caches built on it stay valid
+        self._per_byte = 8 // self.bits
+        self._mask = (1 << self.bits) - 1
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in self.arrays.values())
+
+    def _cell(self, state):
+        x, y = state
+        if not (0 <= x < self.grid_size[0] and 0 <= y < self.grid_size[1]):
+            raise KeyError(state)
+        return x * self.grid_size[1] + y
+
+    def _flag(self, name, i):
+        return bool(self.arrays[name][i >> 3] >> (i & 7) & 1)
+
+    def greedy_action(self, state):
+        i = self._cell(state)
+        return int(self.arrays['greedy'][i // self._per_byte]) >> (i % self._per_byte * self.bits) & self._mask
+
+    def greedy_actions(self, x0=0, x1=None):
+        # (x1 - x0, cols) greedy actions of a range of rows, all rows by default
+        rows, cols = self.grid_size
+        x1 = rows if x1 is None else min(x1, rows)
+        first, last = x0 * cols, x1 * cols
+        start = first // self._per_byte
+        packed = self.arrays['greedy'][start:-(-last // self._per_byte)]
+        cells = unpack(packed, self.bits, last - start * self._per_byte)[first - start * self._per_byte:]
+        return cells.reshape(x1 - x0, cols)
+
+    def q_values(self, state):
+        # The stored Q-values of a cell as float32, dequantized
+        if self.values is None:
+            raise ValueError("this policy was exported without Q-values")
+        x, y = state
+        self._cell(state)
+        scales = self.arrays['scales'][x, y] if 'scales' in self.arrays else None
+        return dequantize(self.arrays['q'][x, y], scales)
+
+    def ranked_actions(self, state):
+        # Action indices best first by the stored values, the greedy action alone without them
+        if self.values is None:
+            return [self.greedy_action(state)]
+        return np.argsort(-self.q_values(state), kind='stable').tolist()
+
+    def is_terminal(self, state):
+        return self._flag('terminal', self._cell(state))
+
+    def is_blocked(self, state):
+        return self._flag('blocked', self._cell(state))
+
+    def path(self, start, goal=None, max_steps=100):
+        # Same walk as gridEnv.greedy_path, on the artifact alone: follow the
+        # greedy action until goal (any terminal cell without one), a move
+        # that goes nowhere or max_steps
+        rows, cols = self.grid_size
+        deltas = self.deltas.tolist()
+        goal = tuple(goal) if goal is not None else None
+        x, y = start
+        path = [(x, y)]
+        for _ in range(max_steps):
+            if (x, y) == goal or (goal is None and self.is_terminal((x, y))):
+                break
+            dx, dy = deltas[self.greedy_action((x, y))]
+            next_x, next_y = x + dx, y + dy
+            if not (0 <= next_x < rows and 0 <= next_y < cols) or self.is_blocked((next_x, next_y)):
+                break
+            x, y = next_x, next_y
+            path.append((x, y))
+        return path
+
+
+def load_policy(filename, mode='r'):
+    # mode as for checkpoint.read_container, memory-mapped read-only by default
+    header, arrays = checkpoint.read_container(filename, mode)
+    if header.get('kind') != 'policy':
+        raise ValueError(f"{filename} holds no policy")
+    return Policy(header, arrays)
+
+
+def agreement(policy, q_table):
+    # Fraction of the free cells whose greedy action from the policy
+    # ('actions') and from its stored values ('values', if any) is the one
+    # of the full precision table
+    rows, cols = q_table.grid_size
+    if policy.grid_size != q_table.grid_size:
+        raise ValueError("the policy and the Q-table have different grids")
+    blocked = unpack(policy.arrays['blocked'], 1, rows * cols).reshape(rows, cols).astype(bool)
+    matches = {'actions': 0, 'values': 0}
+    free_cells = 0
+    for x0 in range(0, rows, block_rows):
+        actions = np.asarray(q_table.array[x0:x0 + block_rows]).argmax(axis=2)
+        free = ~blocked[x0:x0 + block_rows]
+        free_cells += int(free.sum())
+        matches['actions'] += int(((policy.greedy_actions(x0, x0 + block_rows) == actions) & free).sum())
+        if policy.values is not None:
+            scales = policy.arrays['scales'][x0:x0 + block_rows] if 'scales' in policy.arrays else None
+            ranked = dequantize(policy.arrays['q'][x0:x0 + block_rows], scales).argmax(axis=2)
+            matches['values'] += int(((ranked == actions) & free).sum())
+    return _rates(matches, free_cells, policy.values)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export a trained Q-table as a compact policy")
+    parser.add_argument('q_table', help="JSON or binary checkpoint")
+    parser.add_argument('output', nargs='?', default=None, help=f"defaults to the table's name with {extension}")
+    parser.add_argument('--values', choices=value_formats[1:], default=None,
+                        help="also store the Q-values, for ranking actions")
+    parser.add_argument('--module', default='reinforcementLearning',
+                        help="training script whose goals and walls the policy walks on")
+    args = parser.parse_args(argv)
+
+    q_table = checkpoint.load_q_table(args.q_table)
+    module = importlib.import_module(args.module)
+    output = args.output or args.q_table.rsplit('.', 1)[0] + extension
+    rates = export_policy(GridEnv.from_module(module), q_table, output, args.values,
+                          **checkpoint.module_hyperparameters(module))
+    policy = load_policy(output)
+    print(f"{output}: {policy.nbytes} bytes of arrays, the table has {q_table.array.nbytes}")
+    print(f"agreement with the full table over {rates['cells']} cells: " +
+          ', '.join(f"{name} {rate:.4f}" for name, rate in rates.items() if name != 'cells'))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
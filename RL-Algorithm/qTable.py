@@ -0,0 +1,432 @@
+import random
+
+import numpy as np
+
+default_actions = ['up', 'down', 'left', 'right']
+
+
+class QRow:
+    # Dict-like view on the action values of one state, so code written
+    # against q_table[state][action] keeps working on the array table
+    __slots__ = ('_table', '_x', '_y')
+
+    def __init__(self, table, x, y):
+        self._table = table
+        self._x = x
+        self._y = y
+
+    def __getitem__(self, action):
+        return float(self._table.array[self._x, self._y, self._table.action_index[action]])
+
+    def __setitem__(self, action, value):
+        self._table.array[self._x, self._y, self._table.action_index[action]] = value
+        self._table.version += 1
+
+    def __iter__(self):
+        return iter(self._table.actions)
+
+    def __len__(self):
+        return len(self._table.actions)
+
+    def __contains__(self, action):
+        return action in self._table.action_index
+
+    def __eq__(self, other):
+        if isinstance(other, (QRow, dict)):
+            return self.to_dict() == dict(other.items())
+        return NotImplemented
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+    def keys(self):
+        return list(self._table.actions)
+
+    def values(self):
+        return self._table.array[self._x, self._y].tolist()
+
+    def items(self):
+        return list(zip(self._table.actions, self.values()))
+
+    def get(self, action, default=None):
+        if action in self._table.action_index:
+            return self[action]
+        return default
+
+    def to_dict(self):
+        return dict(self.items())
+
+
+class QTable:
+    # Q-values for a rectangular grid stored in one contiguous array of shape
+    # (rows, cols, n_actions). States are (x, y) tuples and actions are looked
+    # up by name or by integer index.
+    def __init__(self, grid_size, actions=default_actions, dtype=np.float64, array=None):
+        self.grid_size = (int(grid_size[0]), int(grid_size[1]))
+        self.actions = list(actions)
+        self.action_index = {action: i for i, action in enumerate(self.actions)}
+        shape = self.grid_size + (len(self.actions),)
+        if array is None:
+            array = np.zeros(shape, dtype=dtype)
+        elif array.shape != shape:
+            raise ValueError(f"Q-table array has shape {array.shape}, expected {shape}")
+        self.array = array
+        # Bumped on every write, lets caches derived from the table detect staleness
+        self.version = 0
+
+    @classmethod
+    def from_dict(cls, q_dict, grid_size=None, actions=None, dtype=np.float64):
+        if grid_size is None:
+            grid_size = (max(x for x, _ in q_dict) + 1, max(y for _, y in q_dict) + 1)
+        if actions is None:
+            actions = list(next(iter(q_dict.values())).keys())
+        table = cls(grid_size, actions, dtype=dtype)
+        for (x, y), row in q_dict.items():
+            table.array[x, y] = [row[action] for action in table.actions]
+        return table
+
+    def to_dict(self):
+        return {state: row.to_dict() for state, row in self.items()}
+
+    def copy(self):
+        return QTable(self.grid_size, self.actions, array=self.array.copy())
+
+    def copy_from(self, array):
+        self.array[...] = array
+        self.version += 1
+
+    def reset(self):
+        self.array.fill(0.0)
+        self.version += 1
+
+    # Dict-compatible view, keyed by (x, y) in row-major order like the
+    # dict-of-dicts tables the training scripts used to build
+    def __getitem__(self, state):
+        x, y = state
+        if not (0 <= x < self.grid_size[0] and 0 <= y < self.grid_size[1]):
+            raise KeyError(state)
+        return QRow(self, x, y)
+
+    def __setitem__(self, state, row):
+        x, y = state
+        self.array[x, y] = [row[action] for action in self.actions]
+        self.version += 1
+
+    def __contains__(self, state):
+        x, y = state
+        return 0 <= x < self.grid_size[0] and 0 <= y < self.grid_size[1]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return self.grid_size[0] * self.grid_size[1]
+
+    def keys(self):
+        return [(x, y) for x in range(self.grid_size[0]) for y in range(self.grid_size[1])]
+
+    def values(self):
+        return [QRow(self, x, y) for x, y in self.keys()]
+
+    def items(self):
+        return [((x, y), QRow(self, x, y)) for x, y in self.keys()]
+
+    def get(self, state, default=None):
+        if state in self:
+            return self[state]
+        return default
+
+    # Index based access used by the training loops
+    def max_q(self, state):
+        return float(self.array[state[0], state[1]].max())
+
+    def greedy_action(self, state):
+        # First maximal action, same result as max(row, key=row.get) on a dict
+        return int(self.array[state[0], state[1]].argmax())
+
+    def best_action(self, state, rng=random):
+        # Maximal action with ties broken uniformly at random
+        row = self.array[state[0], state[1]]
+        ties = np.flatnonzero(row == row.max())
+        if len(ties) == 1:
+            return int(ties[0])
+        return int(ties[rng.randrange(len(ties))])
+
+    def update(self, state, action, target, alpha):
+        # Move Q(state, action) towards target and return the TD error
+        a = self.action_index.get(action, action)
+        x, y = state
+        td_error = target - self.array[x, y, a]
+        self.array[x, y, a] += alpha * td_error
+        self.version += 1
+        return float(td_error)
+
+    def lookup(self, xs, ys):
+        # Action values for many states at once, shape (n, n_actions)
+        return self.array[xs, ys]
+
+    def assign(self, xs, ys, action_indices, values):
+        # Duplicate (state, action) pairs resolve last-writer-wins
+        self.array[xs, ys, action_indices] = values
+        self.version += 1
+
+    def max_values(self):
+        return self.array.max(axis=-1)
+
+    def greedy_actions(self, rng=None):
+        # Greedy action for every cell. Without an rng the first maximal action
+        # wins, with a numpy Generator ties are broken uniformly at random.
+        if rng is None:
+            return self.array.argmax(axis=-1)
+        is_max = self.array == self.array.max(axis=-1, keepdims=True)
+        noise = rng.random(self.array.shape)
+        return np.where(is_max, noise, -1.0).argmax(axis=-1)
+
+
+class SparseQRow(QRow):
+    # QRow on a SparseQTable, reads of untouched states don't allocate
+    __slots__ = ()
+
+    def __getitem__(self, action):
+        return float(self._table._row(self._x, self._y)[self._table.action_index[action]])
+
+    def __setitem__(self, action, value):
+        t, lx, ly = self._table._slot(self._x, self._y)
+        self._table.pool[t, lx, ly, self._table.action_index[action]] = value
+        self._table.version += 1
+
+    def values(self):
+        return self._table._row(self._x, self._y).tolist()
+
+
+class SparseQTable:
+    # Q-table for grids too big to allocate up front. The grid is cut into
+    # tile_size x tile_size tiles and a tile's values are only allocated the
+    # first time one of its states is written. Untouched states read as
+    # default. Tiles live in one pool array of shape (n, tile, tile, n_actions)
+    # that grows by doubling. Slot 0 is a shared read-only tile of defaults,
+    # and tile_index maps every tile of the grid to its slot (0 until
+    # allocated), so batch lookups stay a single gather. Same interface as
+    # QTable apart from .array, use to_dense() for the code that needs one.
+    def __init__(self, grid_size, actions=default_actions, dtype=np.float64, tile_size=32, default=0.0):
+        self.grid_size = (int(grid_size[0]), int(grid_size[1]))
+        self.actions = list(actions)
+        self.action_index = {action: i for i, action in enumerate(self.actions)}
+        self.tile_size = int(tile_size)
+        self.default = default
+        self.dtype = np.dtype(dtype)
+        tiles_shape = (-(-self.grid_size[0] // self.tile_size), -(-self.grid_size[1] // self.tile_size))
+        self.tile_index = np.zeros(tiles_shape, dtype=np.int32)
+        self.tile_keys = np.zeros((1, 2), dtype=np.int64)
+        self.pool = np.full((1, self.tile_size, self.tile_size, len(self.actions)), default, dtype=self.dtype)
+        self.n_tiles = 1
+        self.version = 0
+
+    @classmethod
+    def from_dict(cls, q_dict, grid_size=None, actions=None, dtype=np.float64, tile_size=32):
+        if grid_size is None:
+            grid_size = (max(x for x, _ in q_dict) + 1, max(y for _, y in q_dict) + 1)
+        if actions is None:
+            actions = list(next(iter(q_dict.values())).keys())
+        table = cls(grid_size, actions, dtype=dtype, tile_size=tile_size)
+        for state, row in q_dict.items():
+            table[state] = row
+        return table
+
+    @classmethod
+    def from_dense(cls, q_table, tile_size=32, default=0.0):
+        # Sparse copy of a QTable keeping only the tiles that hold a non-default value
+        table = cls(q_table.grid_size, q_table.actions, q_table.array.dtype, tile_size, default)
+        xs, ys = np.nonzero((q_table.array != default).any(axis=-1))
+        table.assign(xs[:, None], ys[:, None], np.arange(len(table.actions)), q_table.array[xs, ys])
+        table.version = 0
+        return table
+
+    @classmethod
+    def from_tiles(cls, grid_size, actions, tile_keys, tiles, default=0.0):
+        table = cls(grid_size, actions, tiles.dtype, tiles.shape[1], default)
+        table._grow(len(tile_keys))
+        table.pool[1:len(tile_keys) + 1] = tiles
+        table.tile_keys[1:len(tile_keys) + 1] = tile_keys
+        table.tile_index[tile_keys[:, 0], tile_keys[:, 1]] = np.arange(1, len(tile_keys) + 1)
+        table.n_tiles = len(tile_keys) + 1
+        return table
+
+    def tiles(self):
+        # (tile_keys, tiles) of the allocated tiles, what gets serialized
+        return self.tile_keys[1:self.n_tiles], self.pool[1:self.n_tiles]
+
+    def to_dense(self):
+        return QTable(self.grid_size, self.actions, array=self._dense(self.pool))
+
+    def to_dict(self):
+        return {state: row.to_dict() for state, row in self.items()}
+
+    def copy(self):
+        keys, tiles = self.tiles()
+        return SparseQTable.from_tiles(self.grid_size, self.actions, keys.copy(), tiles.copy(), self.default)
+
+    def reset(self):
+        self.tile_index.fill(0)
+        self.pool = self.pool[:1].copy()
+        self.tile_keys = self.tile_keys[:1].copy()
+        self.n_tiles = 1
+        self.version += 1
+
+    def occupancy(self):
+        # How much of the grid is backed by memory
+        rows, cols = self.grid_size
+        allocated = self.n_tiles - 1
+        return {
+            'tiles': allocated,
+            'grid_tiles': int(self.tile_index.size),
+            'allocated_states': allocated * self.tile_size ** 2,
+            'grid_states': rows * cols,
+            'fraction': allocated / self.tile_index.size if self.tile_index.size else 0.0,
+            'bytes': int(self.pool[:self.n_tiles].nbytes + self.tile_index.nbytes + self.tile_keys.nbytes),
+            'reserved_bytes': int(self.pool.nbytes + self.tile_index.nbytes + self.tile_keys.nbytes),
+        }
+
+    def compact(self):
+        # Free tiles that only hold default values again and shrink the pool
+        # to what is in use. Returns the number of tiles freed.
+        keys, tiles = self.tiles()
+        keep = (tiles != self.default).reshape(len(tiles), -1).any(axis=1)
+        kept_keys = keys[keep].copy()
+        kept_tiles = tiles[keep].copy()
+        self.tile_index.fill(0)
+        self.pool = np.concatenate([self.pool[:1], kept_tiles])
+        self.tile_keys = np.concatenate([self.tile_keys[:1], kept_keys])
+        self.tile_index[kept_keys[:, 0], kept_keys[:, 1]] = np.arange(1, len(kept_keys) + 1)
+        self.n_tiles = len(kept_keys) + 1
+        return int((~keep).sum())
+
+    def _grow(self, n_new):
+        # Make room for n_new more tiles, doubling the pool when it's full
+        needed = self.n_tiles + n_new
+        if needed <= len(self.pool):
+            return
+        capacity = max(needed, 2 * len(self.pool))
+        pool = np.full((capacity,) + self.pool.shape[1:], self.default, dtype=self.dtype)
+        pool[:self.n_tiles] = self.pool[:self.n_tiles]
+        tile_keys = np.zeros((capacity, 2), dtype=np.int64)
+        tile_keys[:self.n_tiles] = self.tile_keys[:self.n_tiles]
+        self.pool = pool
+        self.tile_keys = tile_keys
+
+    def _allocate(self, txs, tys):
+        # Give every listed tile that is still unallocated a slot of its own
+        missing = self.tile_index[txs, tys] == 0
+        if not missing.any():
+            return
+        keys = np.unique(np.stack([txs[missing], tys[missing]], axis=1), axis=0)
+        self._grow(len(keys))
+        slots = np.arange(self.n_tiles, self.n_tiles + len(keys))
+        self.tile_index[keys[:, 0], keys[:, 1]] = slots
+        self.tile_keys[slots] = keys
+        self.n_tiles += len(keys)
+
+    def _slot(self, x, y):
+        # Pool slot and position inside the tile of a state, allocated for writing
+        tx, ty = x // self.tile_size, y // self.tile_size
+        t = self.tile_index[tx, ty]
+        if t == 0:
+            self._allocate(np.array([tx]), np.array([ty]))
+            t = self.tile_index[tx, ty]
+        return t, x % self.tile_size, y % self.tile_size
+
+    def _row(self, x, y):
+        t = self.tile_index[x // self.tile_size, y // self.tile_size]
+        return self.pool[t, x % self.tile_size, y % self.tile_size]
+
+    def _dense(self, per_tile):
+        # Scatter a per-slot array of shape (n, tile, tile, ...) onto the grid
+        rows, cols = self.grid_size
+        gathered = per_tile[self.tile_index]
+        gathered = np.swapaxes(gathered, 1, 2)
+        shape = (self.tile_index.shape[0] * self.tile_size, self.tile_index.shape[1] * self.tile_size)
+        return gathered.reshape(shape + per_tile.shape[3:])[:rows, :cols]
+
+    # Dict-compatible view, iterating over the states of allocated tiles only
+    def __getitem__(self, state):
+        x, y = state
+        if not (0 <= x < self.grid_size[0] and 0 <= y < self.grid_size[1]):
+            raise KeyError(state)
+        return SparseQRow(self, x, y)
+
+    def __setitem__(self, state, row):
+        t, lx, ly = self._slot(*state)
+        self.pool[t, lx, ly] = [row[action] for action in self.actions]
+        self.version += 1
+
+    def __contains__(self, state):
+        x, y = state
+        return 0 <= x < self.grid_size[0] and 0 <= y < self.grid_size[1]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def keys(self):
+        rows, cols = self.grid_size
+        size = self.tile_size
+        states = []
+        for tx, ty in self.tile_keys[1:self.n_tiles].tolist():
+            states.extend((x, y) for x in range(tx * size, min((tx + 1) * size, rows))
+                          for y in range(ty * size, min((ty + 1) * size, cols)))
+        return states
+
+    def values(self):
+        return [SparseQRow(self, x, y) for x, y in self.keys()]
+
+    def items(self):
+        return [((x, y), SparseQRow(self, x, y)) for x, y in self.keys()]
+
+    def get(self, state, default=None):
+        if state in self:
+            return self[state]
+        return default
+
+    # Index based access used by the training loops
+    def max_q(self, state):
+        return float(self._row(state[0], state[1]).max())
+
+    def greedy_action(self, state):
+        return int(self._row(state[0], state[1]).argmax())
+
+    def best_action(self, state, rng=random):
+        row = self._row(state[0], state[1])
+        ties = np.flatnonzero(row == row.max())
+        if len(ties) == 1:
+            return int(ties[0])
+        return int(ties[rng.randrange(len(ties))])
+
+    def update(self, state, action, target, alpha):
+        a = self.action_index.get(action, action)
+        t, lx, ly = self._slot(state[0], state[1])
+        td_error = target - self.pool[t, lx, ly, a]
+        self.pool[t, lx, ly, a] += alpha * td_error
+        self.version += 1
+        return float(td_error)
+
+    def lookup(self, xs, ys):
+        size = self.tile_size
+        return self.pool[self.tile_index[xs // size, ys // size], xs % size, ys % size]
+
+    def assign(self, xs, ys, action_indices, values):
+        size = self.tile_size
+        xs, ys = np.asarray(xs), np.asarray(ys)
+        txs, tys = xs // size, ys // size
+        self._allocate(txs.ravel(), tys.ravel())
+        self.pool[self.tile_index[txs, tys], xs % size, ys % size, action_indices] = values
+        self.version += 1
+
+    def max_values(self):
+        return self._dense(self.pool[:self.n_tiles].max(axis=-1))
+
+    def greedy_actions(self, rng=None):
+        if rng is None:
+            return self._dense(self.pool[:self.n_tiles].argmax(axis=-1))
+        return self.to_dense().greedy_actions(rng)
@@ -0,0 +1,317 @@
+import base64
+import html
+import json
+import struct
+import zlib
+
+import numpy as np
+
+from gridEnv import default_action_to_delta
+
+# HTML reports for Q-tables of any size. The grid is a single heatmap image
+# of max Q per cell (drawn on a canvas, with greedy-action arrows once zoomed
+# in far enough) and the numeric table is paged in the browser from the raw
+# float32 values embedded in the page, so the file holds one image and one
+# array instead of a DOM node per cell and per state. Everything is computed
+# and written in blocks of rows, memory stays small however big the grid is.
+
+block_rows = 96  # Multiple of 3, so every block's bytes base64-encode on their own
+obstacle_color = (0, 0, 0)
+start_color = (0, 128, 0)
+goal_color = (255, 215, 0)
+# Low to high max Q, dark blue to yellow
+colormap = np.array([[68, 1, 84], [59, 82, 139], [33, 145, 140], [94, 201, 98], [253, 231, 37]], dtype=np.float64)
+
+
+class Base64Writer:
+    # Base64-encodes bytes written in arbitrary pieces straight into a text file
+    def __init__(self, f):
+        self.f = f
+        self._pending = b''
+
+    def write(self, data):
+        data = self._pending + data
+        cut = len(data) - len(data) % 3
+        self.f.write(base64.b64encode(data[:cut]).decode('ascii'))
+        self._pending = data[cut:]
+
+    def close(self):
+        self.f.write(base64.b64encode(self._pending).decode('ascii'))
+        self._pending = b''
+
+
+def cell_masks(grid_size, obstacles):
+    blocked = np.zeros(grid_size, dtype=bool)
+    for x, y in obstacles:
+        blocked[x, y] = True
+    return blocked
+
+
+def value_range(q_table, blocked):
+    # Min and max of max Q over the free cells
+    low, high = np.inf, -np.inf
+    for x0 in range(0, q_table.grid_size[0], block_rows):
+        values = q_table.array[x0:x0 + block_rows].max(axis=2)[~blocked[x0:x0 + block_rows]]
+        if values.size:
+            low, high = min(low, float(values.min())), max(high, float(values.max()))
+    if low > high:
+        return 0.0, 0.0
+    return low, high
+
+
+def heatmap_blocks(q_table, start, goals, obstacles):
+    # RGB rows of the heatmap, one (block_rows, cols, 3) uint8 block at a time
+    blocked = cell_masks(q_table.grid_size, obstacles)
+    low, high = value_range(q_table, blocked)
+    stops = np.linspace(0.0, 1.0, len(colormap))
+    special = [(tuple(goal), goal_color) for goal in goals] + [(tuple(start), start_color)]
+    for x0 in range(0, q_table.grid_size[0], block_rows):
+        values = q_table.array[x0:x0 + block_rows].max(axis=2)
+        scaled = (values - low) / (high - low) if high > low else np.zeros_like(values)
+        rgb = np.stack([np.interp(scaled, stops, colormap[:, c]) for c in range(3)], axis=-1).astype(np.uint8)
+        rgb[blocked[x0:x0 + block_rows]] = obstacle_color
+        for (x, y), color in special:
+            if x0 <= x < x0 + block_rows:
+                rgb[x - x0, y] = color
+        yield rgb
+
+
+def _png_chunk(kind, data):
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+
+def png_chunks(width, height, rgb_blocks):
+    # PNG file in pieces, every block of rows compressed into its own IDAT chunk
+    yield b'\x89PNG\r\n\x1a\n'
+    yield _png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+    compressor = zlib.compressobj(6)
+    for rgb in rgb_blocks:
+        # Filter type 0 (none) in front of every scanline
+        scanlines = np.zeros((rgb.shape[0], 1 + width * 3), dtype=np.uint8)
+        scanlines[:, 1:] = rgb.reshape(rgb.shape[0], -1)
+        data = compressor.compress(scanlines.tobytes())
+        if data:
+            yield _png_chunk(b'IDAT', data)
+    yield _png_chunk(b'IDAT', compressor.flush())
+    yield _png_chunk(b'IEND', b'')
+
+
+def heatmap_png(q_table, start, goals, obstacles):
+    # The report heatmap as PNG bytes, one pixel per cell
+    rows, cols = q_table.grid_size
+    return b''.join(png_chunks(cols, rows, heatmap_blocks(q_table, start, goals, obstacles)))
+
+
+def _write_blocks(f, element_id, blocks, mime='application/octet-stream'):
+    f.write(f'<script type="{mime}" id="{element_id}">')
+    writer = Base64Writer(f)
+    for block in blocks:
+        writer.write(block)
+    writer.close()
+    f.write('</script>\n')
+
+
+def _greedy_blocks(q_table):
+    for x0 in range(0, q_table.grid_size[0], block_rows):
+        yield q_table.array[x0:x0 + block_rows].argmax(axis=2).astype(np.uint8).tobytes()
+
+
+def _q_blocks(q_table):
+    for x0 in range(0, q_table.grid_size[0], block_rows):
+        yield q_table.array[x0:x0 + block_rows].astype('<f4').tobytes()
+
+
+def write_report(filename, q_table, start, goals, obstacles, path=None, action_to_delta=None,
+                 page_size=100, title="Q-Learning Visualization"):
+    # Streams the report to filename: heatmap with greedy arrows and the best
+    # path, plus the Q-table paged page_size states at a time
+    action_to_delta = action_to_delta or default_action_to_delta
+    rows, cols = q_table.grid_size
+    meta = {
+        'rows': rows,
+        'cols': cols,
+        'actions': q_table.actions,
+        'deltas': [list(action_to_delta[action]) for action in q_table.actions],
+        'start': list(start),
+        'goals': [list(goal) for goal in goals],
+        'path': [list(state) for state in path] if path else [],
+        'page_size': page_size,
+    }
+    with open(filename, 'w') as f:
+        f.write(page_head.replace('$title', html.escape(title)))
+        f.write(f'<p>Best path ({max(len(meta["path"]) - 1, 0)} steps): '
+                f'{html.escape(str(path)) if path and len(path) <= 200 else "shown on the grid"}</p>\n')
+        f.write(page_body)
+        f.write(f'<script type="application/json" id="meta">{json.dumps(meta)}</script>\n')
+        _write_blocks(f, 'heatmap', png_chunks(cols, rows, heatmap_blocks(q_table, start, goals, obstacles)))
+        _write_blocks(f, 'greedy', _greedy_blocks(q_table))
+        _write_blocks(f, 'q', _q_blocks(q_table))
+        f.write(page_script)
+
+
+page_head = """<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="utf-8">
+    <title>$title</title>
+    <style>
+        body { font-family: sans-serif; }
+        table { border-collapse: collapse; margin: 20px; }
+        th, td { border: 1px solid black; padding: 4px 10px; text-align: center; }
+        tr.selected { background-color: gold; }
+        #view { width: 800px; height: 600px; max-width: 95vw; overflow: auto; border: 1px solid black; margin: 20px; }
+        #grid { position: sticky; top: 0; left: 0; image-rendering: pixelated; }
+        .controls { margin: 0 20px; }
+    </style>
+</head>
+<body>
+    <h1>$title</h1>
+    <h2>Grid</h2>
+    <div class="controls">
+        Cell size <select id="zoom"></select>
+        <span id="legend"></span>
+        <span id="cellInfo"></span>
+    </div>
+"""
+
+page_body = """    <div id="view"><div id="spacer"><canvas id="grid"></canvas></div></div>
+    <h2>Q-Table</h2>
+    <div class="controls">
+        <button id="prev">Previous</button>
+        Page <input id="page" type="number" min="1" value="1" style="width: 6em"> of <span id="pages"></span>
+        <button id="next">Next</button>
+    </div>
+    <table id="qTable"></table>
+"""
+
+page_script = """<script>
+const meta = JSON.parse(document.getElementById('meta').textContent);
+function decode(id) {
+    const text = atob(document.getElementById(id).textContent);
+    const bytes = new Uint8Array(text.length);
+    for (let i = 0; i < text.length; i++) bytes[i] = text.charCodeAt(i);
+    return bytes;
+}
+const greedy = decode('greedy');
+const q = new Float32Array(decode('q').buffer);
+const nActions = meta.actions.length;
+const view = document.getElementById('view');
+const spacer = document.getElementById('spacer');
+const canvas = document.getElementById('grid');
+const context = canvas.getContext('2d');
+const image = new Image();
+image.src = 'data:image/png;base64,' + document.getElementById('heatmap').textContent;
+
+// Zoom levels keep the whole grid under 16384 pixels a side, arrows from 8 pixels on
+const zoom = document.getElementById('zoom');
+const largest = Math.max(meta.rows, meta.cols);
+let cell = 1;
+for (const size of [1, 2, 4, 8, 16, 32, 48]) {
+    if (size > 1 && size * largest > 16384) break;
+    zoom.add(new Option(size + ' px', size));
+    if (size * largest <= 800) cell = size;
+}
+zoom.value = cell;
+
+function draw() {
+    const width = Math.min(view.clientWidth, meta.cols * cell);
+    const height = Math.min(view.clientHeight, meta.rows * cell);
+    if (canvas.width !== width || canvas.height !== height) {
+        canvas.width = width;
+        canvas.height = height;
+    }
+    // Only the visible part of the grid is drawn
+    const y0 = Math.floor(view.scrollLeft / cell), x0 = Math.floor(view.scrollTop / cell);
+    const y1 = Math.min(meta.cols, Math.ceil((view.scrollLeft + width) / cell));
+    const x1 = Math.min(meta.rows, Math.ceil((view.scrollTop + height) / cell));
+    const dx = y0 * cell - view.scrollLeft, dy = x0 * cell - view.scrollTop;
+    context.imageSmoothingEnabled = false;
+    context.clearRect(0, 0, width, height);
+    context.drawImage(image, y0, x0, y1 - y0, x1 - x0, dx, dy, (y1 - y0) * cell, (x1 - x0) * cell);
+    if (cell >= 8) {
+        context.strokeStyle = 'rgba(255, 255, 255, 0.8)';
+        context.beginPath();
+        for (let x = x0; x < x1; x++) {
+            for (let y = y0; y < y1; y++) {
+                // Canvas x runs along grid columns, so (row, col) deltas swap
+                const [uy, ux] = meta.deltas[greedy[x * meta.cols + y]];
+                const cx = dx + (y - y0 + 0.5) * cell, cy = dy + (x - x0 + 0.5) * cell, r = cell * 0.35;
+                context.moveTo(cx - ux * r, cy - uy * r);
+                context.lineTo(cx + ux * r, cy + uy * r);
+                context.lineTo(cx + (ux * 0.4 - uy * 0.4) * r, cy + (uy * 0.4 + ux * 0.4) * r);
+                context.moveTo(cx + ux * r, cy + uy * r);
+                context.lineTo(cx + (ux * 0.4 + uy * 0.4) * r, cy + (uy * 0.4 - ux * 0.4) * r);
+            }
+        }
+        context.stroke();
+    }
+    if (meta.path.length > 1) {
+        context.strokeStyle = 'red';
+        context.lineWidth = Math.max(1, cell / 6);
+        context.beginPath();
+        meta.path.forEach(([x, y], i) => {
+            const px = y * cell + cell / 2 - view.scrollLeft, py = x * cell + cell / 2 - view.scrollTop;
+            if (i === 0) context.moveTo(px, py); else context.lineTo(px, py);
+        });
+        context.stroke();
+        context.lineWidth = 1;
+    }
+}
+
+function resize() {
+    spacer.style.width = meta.cols * cell + 'px';
+    spacer.style.height = meta.rows * cell + 'px';
+    draw();
+}
+
+zoom.onchange = () => { cell = Number(zoom.value); resize(); };
+view.onscroll = () => requestAnimationFrame(draw);
+image.onload = resize;
+
+// Paged Q-table, states in row-major order
+const pageInput = document.getElementById('page');
+const pages = Math.max(1, Math.ceil(meta.rows * meta.cols / meta.page_size));
+document.getElementById('pages').textContent = pages;
+pageInput.max = pages;
+let selected = -1;
+
+function showPage(page) {
+    page = Math.min(Math.max(1, page), pages);
+    pageInput.value = page;
+    const header = meta.actions.map(a => '<th>' + a.toUpperCase() + ':Q-Value</th>').join('');
+    const rows = ['<tr><th>State</th>' + header + '</tr>'];
+    const first = (page - 1) * meta.page_size;
+    const last = Math.min(first + meta.page_size, meta.rows * meta.cols);
+    for (let s = first; s < last; s++) {
+        const cells = [];
+        for (let a = 0; a < nActions; a++) cells.push('<td>' + q[s * nActions + a].toFixed(2) + '</td>');
+        const state = '(' + Math.floor(s / meta.cols) + ', ' + (s % meta.cols) + ')';
+        const row = s === selected ? '<tr class="selected">' : '<tr>';
+        rows.push(row + '<td>' + state + '</td>' + cells.join('') + '</tr>');
+    }
+    document.getElementById('qTable').innerHTML = rows.join('');
+}
+
+document.getElementById('prev').onclick = () => showPage(Number(pageInput.value) - 1);
+document.getElementById('next').onclick = () => showPage(Number(pageInput.value) + 1);
+pageInput.onchange = () => showPage(Number(pageInput.value));
+
+// Clicking a cell shows its values and jumps to its page of the table
+canvas.onclick = event => {
+    const rect = canvas.getBoundingClientRect();
+    const y = Math.floor((event.clientX - rect.left + view.scrollLeft) / cell);
+    const x = Math.floor((event.clientY - rect.top + view.scrollTop) / cell);
+    if (x >= meta.rows || y >= meta.cols) return;
+    selected = x * meta.cols + y;
+    const values = meta.actions.map((a, i) => a + ': ' + q[selected * nActions + i].toFixed(2));
+    document.getElementById('cellInfo').textContent = '(' + x + ', ' + y + ') ' + values.join(', ');
+    showPage(Math.floor(selected / meta.page_size) + 1);
+};
+
+document.getElementById('legend').textContent =
+    'green: start, gold: goals, black: obstacles, blue to yellow: low to high max Q';
+showPage(1);
+</script>
+</body>
+</html>
+"""
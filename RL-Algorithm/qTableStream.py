@@ -0,0 +1,71 @@
+import json
+import time
+from contextlib import nullcontext
+
+import numpy as np
+
+min_fps = 0.2
+max_fps = 30
+
+
+def sse_event(event, data):
+    # One server-sent event frame
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class QTableDeltaStream:
+    # Tracks what a viewer has already been sent and produces only the cells
+    # whose values changed since the previous frame. The optional lock is only
+    # held while copying the table, the diff runs outside of it.
+    def __init__(self, q_table, lock=None):
+        self.q_table = q_table
+        self.lock = lock if lock is not None else nullcontext()
+        self._sent = None
+        self._sent_version = None
+
+    def _read(self):
+        with self.lock:
+            return self.q_table.array.copy(), self.q_table.version
+
+    def snapshot(self):
+        self._sent, self._sent_version = self._read()
+        return self._cells(np.ones(self._sent.shape[:2], dtype=bool))
+
+    def delta(self):
+        # Changed cells as {"(x, y)": {action: value}}, None when nothing changed
+        if self._sent is None:
+            return self.snapshot()
+        if self.q_table.version == self._sent_version:
+            return None
+        current, version = self._read()
+        changed = (current != self._sent).any(axis=-1)
+        self._sent = current
+        self._sent_version = version
+        if not changed.any():
+            return None
+        return self._cells(changed)
+
+    def _cells(self, mask):
+        actions = self.q_table.actions
+        xs, ys = np.nonzero(mask)
+        rows = self._sent[xs, ys].tolist()
+        return {str((int(x), int(y))): dict(zip(actions, row)) for x, y, row in zip(xs, ys, rows)}
+
+
+def stream_deltas(q_table, fps=5, heartbeat=15.0, lock=None):
+    # Generator of server-sent events: a full snapshot first, then at most
+    # fps frames per second holding only the changed cells
+    interval = 1.0 / min(max(fps, min_fps), max_fps)
+    stream = QTableDeltaStream(q_table, lock)
+    yield sse_event('snapshot', stream.snapshot())
+    last_sent = time.monotonic()
+    while True:
+        time.sleep(interval)
+        delta = stream.delta()
+        now = time.monotonic()
+        if delta:
+            yield sse_event('delta', delta)
+            last_sent = now
+        elif now - last_sent >= heartbeat:
+            yield ": heartbeat\n\n"  # Comment line, keeps proxies from closing the connection
+            last_sent = now
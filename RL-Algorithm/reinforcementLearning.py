@@ -1,7 +1,21 @@
-import random
+import ast
 import json
+import sys
 import webbrowser
 
+import checkpoint
+import eligibilityTraces
+import gridEnv
+import parallelTraining
+import planning
+import policyExport
+import qTableReport
+import replayBuffer
+from actionSelection import ActionSelector
+from convergence import ConvergenceMonitor
+from instrumentation import TrainingLog
+from qTable import QTable
+
 # Environment settings
 grid_size = (5, 5)
 start = (0, 0)
@@ -23,11 +37,22 @@ epsilon = 0.5  # Exploration rate
 num_episodes = 10000
 max_steps_per_episode = 100  # To prevent infinite loops
 
-# Initialize Q-table
-q_table = {}
-for x in range(grid_size[0]):
-    for y in range(grid_size[1]):
-        q_table[(x, y)] = {action: 0.0 for action in actions}
+action_selector = ActionSelector(len(actions))
+
+
+def get_q_table():
+    # The Q-table is allocated on first use, not when the script is imported
+    global q_table
+    if 'q_table' not in globals():
+        q_table = QTable(grid_size, actions)
+    return q_table
+
+
+def __getattr__(name):
+    # module.q_table from other modules goes through get_q_table too
+    if name == 'q_table':
+        return get_q_table()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def is_valid_state(state):
@@ -58,33 +83,41 @@ def get_reward(state):
 
 
 def choose_action(state):
-    if random.uniform(0, 1) < epsilon:
-        return random.choice(actions)  # Exploration
-    else:
-        max_q = max(q_table[state].values())
-        return random.choice([action for action in actions if q_table[state][action] == max_q])  # Exploitation
+    # Explores with probability epsilon, otherwise a maximal action with ties
+    # broken at random, all from numbers pre-drawn by action_selector
+    return actions[action_selector.select(get_q_table().lookup(state[0], state[1]), epsilon)]
 
 
 def save_q_table(filename):
+    q_table = get_q_table()
     with open(filename, 'w') as f:
         # Convert dictionary keys to strings for JSON compatibility
-        q_table_str_keys = {str(k): v for k, v in q_table.items()}
+        q_table_str_keys = {str(k): v for k, v in q_table.to_dict().items()}
         json.dump(q_table_str_keys, f)
 
 
 def load_q_table(filename):
+    if filename.endswith(checkpoint.extension):
+        return checkpoint.load_checkpoint(filename)[0]  # Memory-mapped binary checkpoint
+
     with open(filename, 'r') as f:
         q_table_str_keys = json.load(f)
     # Convert string keys back to tuples
-    q_table = {eval(k): v for k, v in q_table_str_keys.items()}
+    q_table = QTable.from_dict({ast.literal_eval(k): v for k, v in q_table_str_keys.items()})
     return q_table
 
 
-# Training loop
-def train_q_learning():
+# Training loop. With a convergence.ConvergenceMonitor it stops as soon as
+# the table has converged instead of running all num_episodes.
+def train_q_learning(log=None, monitor=None):
+    q_table = get_q_table()
+    if monitor is not None:
+        monitor.start(q_table)
     for episode in range(num_episodes):
         state = start
-        for _ in range(max_steps_per_episode):  # Limit steps per episode
+        if log is not None:
+            log.start_episode(episode)
+        for step in range(max_steps_per_episode):  # Limit steps per episode
             action = choose_action(state)
             next_state = get_next_state(state, action)
 
@@ -94,29 +127,72 @@ def train_q_learning():
             reward = get_reward(next_state)
 
             # Bellman equation update
-            max_future_q = max(q_table[next_state].values())
-            q_table[state][action] += alpha * (reward + gamma * max_future_q - q_table[state][action])
+            max_future_q = q_table.max_q(next_state)
+            td_error = q_table.update(state, action, reward + gamma * max_future_q, alpha)
 
-            print(f"\n{episode=}, {state=}, {next_state=}, {reward=}")
-            if episode == 0:
-                print(f"\nepisode 0 step {_} Q-Table:")
-                for state, actions in q_table.items():
-                    print(f"State {state}: {actions}")
+            if log is not None:
+                log.step(episode, step, state, next_state, reward, td_error, q_table)
+            if monitor is not None:
+                monitor.update(state, abs(alpha * td_error), q_table)
 
             state = next_state
 
             if state in goals:
                 break  # Exit if goal is reached
 
+        if log is not None:
+            log.end_episode(episode, step + 1, state in goals)
+        if monitor is not None and monitor.end_episode(step + 1, state in goals):
+            print(monitor.reason)
+            break
+
+
+# Batched training loop, runs n_envs episodes in lockstep on array states
+def train_q_learning_batch(n_envs=256, seed=None, monitor=None):
+    return gridEnv.train_module_batch(sys.modules[__name__], n_envs, seed, skip_bumps=True, monitor=monitor)
+
+
+# Training spread over a process pool, see parallelTraining.train_q_learning_parallel
+def train_q_learning_parallel(n_workers=None, merge='average', seed=None, deterministic=False):
+    return parallelTraining.train_module_parallel(sys.modules[__name__], n_workers, merge=merge, seed=seed,
+                                                  deterministic=deterministic, skip_bumps=True)
+
+
+# Q(lambda) alternative to the one-step update: eligibility traces carry the
+# goal reward back along the whole trajectory, see eligibilityTraces.py
+def train_q_lambda(lam=0.9, n_envs=256, seed=None):
+    return eligibilityTraces.train_module_q_lambda(sys.modules[__name__], lam, n_envs, seed, skip_bumps=True)
+
+
+# Experience replay alternative: every transition is also stored and replayed
+# in prioritized mini-batches, see replayBuffer.py. Reaches the same policy
+# with far fewer environment steps.
+def train_q_learning_replay(batch_size=32, replay_every=1, seed=None):
+    return replayBuffer.train_module_replay(sys.modules[__name__], batch_size=batch_size, replay_every=replay_every,
+                                            seed=seed, skip_bumps=True)
+
+
+# Same loop as train_q_learning compiled with Numba (plain Python without
+# it), bit-identical for a given seed either way, see trainingKernel.py
+def train_q_learning_compiled(seed=None):
+    import trainingKernel  # Numba, if installed, is only loaded when used
+    return trainingKernel.train_module_kernel(sys.modules[__name__], seed, skip_bumps=True)
+
+
+# Model-based alternative to training: value iteration on the known environment
+def plan_q_table(theta=1e-6):
+    return planning.plan_module(sys.modules[__name__], theta)
+
 
 # Extract the best path
 def extract_path(start, goals):
+    q_table = get_q_table()
     path = [start]
     state = start
     for _ in range(max_steps_per_episode):  # Limit steps to avoid infinite loops
         if state in goals:
             break
-        action = max(q_table[state], key=q_table[state].get)
+        action = actions[q_table.greedy_action(state)]
         next_state = get_next_state(state, action)
         if next_state == state:  # Prevent infinite loop
             break
@@ -125,110 +201,30 @@ def extract_path(start, goals):
     return path
 
 
-def save_q_table_html(q_table, filename):
-    q_table_str_keys = {str(k): v for k, v in q_table.items()}
-
-    html_content = f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <title>Q-Learning Visualization</title>
-        <style>
-            table {{
-                border-collapse: collapse;
-                margin: 20px;
-            }}
-            th, td {{
-                border: 1px solid black;
-                padding: 10px;
-                text-align: center;
-            }}
-            .grid {{
-                display: grid;
-                grid-template-columns: repeat({grid_size[1]}, 40px);
-                grid-template-rows: repeat({grid_size[0]}, 40px);
-                gap: 1px;
-                margin: 20px;
-            }}
-            .cell {{
-                width: 40px;
-                height: 40px;
-                display: flex;
-                align-items: center;
-                justify-content: center;
-                border: 1px solid black;
-                background-color: lightgrey;
-            }}
-            .start {{
-                background-color: green;
-            }}
-            .goal {{
-                background-color: gold;
-            }}
-            .obstacle {{
-                background-color: black;
-            }}
-        </style>
-    </head>
-    <body>
-        <h1>Q-Learning Visualization</h1>
-        <h2>Grid</h2>
-        <div class="grid">
-    """
-
-    for x in range(grid_size[0]):
-        for y in range(grid_size[1]):
-            cell_class = 'cell'
-            if (x, y) == start:
-                cell_class += ' start'
-            elif (x, y) in goals:
-                cell_class += ' goal'
-            elif (x, y) in obstacles:
-                cell_class += ' obstacle'
-            html_content += f'<div class="{cell_class}">({x},{y})</div>'
-
-    html_content += f"""
-        </div>
-        <p>Best path: {extract_path(start, goals)}</p>
-        <h2>Q-Table</h2>
-        <table>
-            <tr>
-                <th>State</th>
-                <th>UP:Q-Value</th>
-                <th>DOWN:Q-Value</th>
-                <th>LEFT:Q-Value</th>
-                <th>RIGHT:Q-Value</th>
-            </tr>
-    """
-
-    for state, actions in q_table_str_keys.items():
-        html_content += f"""
-                    <tr>
-                        <td>{state}</td>
-                    """
-        for action, value in actions.items():
-            html_content += f"""
-                <td>{value:.2f}</td>
-            """
-
-        html_content += f"""
-                    </tr>
-                    """
-
-    html_content += """
-        </table>
-    </body>
-    </html>
-    """
+# Compact read-only copy of the trained policy for inference: the greedy
+# action of every cell in 2 bits, values None, 'float16' or 'int8' also
+# keeps the Q-values. Returns the agreement with the table, see policyExport.py.
+def export_policy(filename, values=None):
+    module = sys.modules[__name__]
+    return policyExport.export_policy(gridEnv.GridEnv.from_module(module), get_q_table(), filename, values,
+                                      **checkpoint.module_hyperparameters(module))
 
-    with open(filename, 'w') as f:
-        f.write(html_content)
+
+def save_q_table_html(q_table, filename):
+    # Heatmap of the grid with greedy arrows and the best path, plus the
+    # Q-table paged in the browser, streamed to the file (see qTableReport.py)
+    qTableReport.write_report(filename, q_table, start, goals, obstacles, path=extract_path(start, goals),
+                              action_to_delta=action_to_delta)
 
 
 # Main logic
 if __name__ == "__main__":
-    # Train the model and save the Q-table
-    train_q_learning()
+    # Train the model and save the Q-table, with a summary every 1000 episodes
+    # (pass level=instrumentation.DEBUG, step_every=1 to trace every step)
+    # Training stops early once the greedy policy hasn't changed for 1000 episodes
+    training_log = TrainingLog(episode_every=1000)
+    train_q_learning(training_log, ConvergenceMonitor(stable_episodes=1000))
+    training_log.flush()
     save_q_table('QTableTest.json')
 
     # Load the Q-table
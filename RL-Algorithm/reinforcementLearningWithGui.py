@@ -1,6 +1,13 @@
-import random
+import ast
 import json
-from pyamaze import maze, agent, COLOR
+import sys
+
+import checkpoint
+import eligibilityTraces
+import trajectoryRenderer
+from actionSelection import ActionSelector
+from qTable import QTable
+from trajectories import SnapshotWriter, TrajectoryRecorder
 
 # Environment settings
 grid_size = (5, 5)
@@ -22,11 +29,22 @@ epsilon = 0.5  # Exploration rate
 num_episodes = 10000
 max_steps_per_episode = 100  # To prevent infinite loops
 
-# Initialize Q-table
-q_table = {}
-for x in range(grid_size[0]):
-    for y in range(grid_size[1]):
-        q_table[(x, y)] = {action: 0.0 for action in actions}
+action_selector = ActionSelector(len(actions))
+
+
+def get_q_table():
+    # The Q-table is allocated on first use, not when the script is imported
+    global q_table
+    if 'q_table' not in globals():
+        q_table = QTable(grid_size, actions)
+    return q_table
+
+
+def __getattr__(name):
+    # module.q_table from other modules goes through get_q_table too
+    if name == 'q_table':
+        return get_q_table()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def is_valid_state(state):
@@ -54,99 +72,107 @@ def get_reward(state):
 
 
 def choose_action(state):
-    if random.uniform(0, 1) < epsilon:
-        return random.choice(actions)  # Exploration
-    else:
-        max_q = max(q_table[state].values())
-        return random.choice([action for action in actions if q_table[state][action] == max_q])  # Exploitation
+    # Explores with probability epsilon, otherwise a maximal action with ties
+    # broken at random, all from numbers pre-drawn by action_selector
+    return actions[action_selector.select(get_q_table().lookup(state[0], state[1]), epsilon)]
 
 
 def save_q_table(filename):
+    q_table = get_q_table()
     with open(filename, 'w') as f:
         # Convert dictionary keys to strings for JSON compatibility
-        q_table_str_keys = {str(k): v for k, v in q_table.items()}
+        q_table_str_keys = {str(k): v for k, v in q_table.to_dict().items()}
         json.dump(q_table_str_keys, f)
 
 
 def load_q_table(filename):
+    if filename.endswith(checkpoint.extension):
+        return checkpoint.load_checkpoint(filename)[0]  # Memory-mapped binary checkpoint
+
     with open(filename, 'r') as f:
         q_table_str_keys = json.load(f)
     # Convert string keys back to tuples
-    q_table = {eval(k): v for k, v in q_table_str_keys.items()}
+    q_table = QTable.from_dict({ast.literal_eval(k): v for k, v in q_table_str_keys.items()})
     return q_table
 
 
-# Training loop
-episode0Path = [start]
-episode1Path = [start]
-episode5000Path = [start]
-episode9000Path = [start]
+# Training loop. The paths of the recorded episodes are kept for the replay
+# in the maze window (see trajectories.TrajectoryRecorder for other rules,
+# like every=1000 or best=5) and the Q-table is saved after each of them by
+# a background writer, as QTableEpisode<episode>.json. A
+# convergence.ConvergenceMonitor ends training early once it has converged.
+recorded_episodes = [0, 1, 5000, 9000]
+trajectory_recorder = None  # Set up by every train_q_learning run
 
 
-def train_q_learning():
+def train_q_learning(monitor=None):
+    global trajectory_recorder
+    q_table = get_q_table()
+    trajectory_recorder = TrajectoryRecorder(grid_size, episodes=recorded_episodes)
     success_count = 0
     steps_to_goal = []
-    for episode in range(num_episodes):
-        state = start
-        for _ in range(max_steps_per_episode):  # Limit steps per episode
-            action = choose_action(state)
-            next_state = get_next_state(state, action)
-
-            if state == next_state:
-                continue  # Skip if no valid next state
-
-            reward = get_reward(next_state)
-
-            # Bellman equation update
-            max_future_q = max(q_table[next_state].values())
-            q_table[state][action] += alpha * (reward + gamma * max_future_q - q_table[state][action])
-
-            state = next_state
-
-            if episode == 0:
-                episode0Path.append(state)
-
-            if episode == 1:
-                episode1Path.append(state)
-
-            if episode == 5000:
-                episode5000Path.append(state)
-
-            if episode == 9000:
-                episode9000Path.append(state)
-
-            if state == goal:
-                print(f"Goal reached in episode {episode} at step {_}")
-                success_count = success_count + 1
-                steps_to_goal.append(_ + 1)
-                break  # Exit if goal is reached
-
-        if episode == 0:
-            save_q_table('QTableEpisode0.json')
-
-        if episode == 1:
-            save_q_table('QTableEpisode1.json')
-
-        if episode == 5000:
-            save_q_table('QTableEpisode5000.json')
-
-        if episode == 9000:
-            save_q_table('QTableEpisode9000.json')
-
-    success_rate = success_count / num_episodes
+    episodes = 0
+    if monitor is not None:
+        monitor.start(q_table)
+    with SnapshotWriter() as snapshot_writer:
+        for episode in range(num_episodes):
+            state = start
+            trajectory_recorder.start_episode(episode)
+            for _ in range(max_steps_per_episode):  # Limit steps per episode
+                action = choose_action(state)
+                next_state = get_next_state(state, action)
+
+                if state == next_state:
+                    continue  # Skip if no valid next state
+
+                reward = get_reward(next_state)
+
+                # Bellman equation update
+                max_future_q = q_table.max_q(next_state)
+                td_error = q_table.update(state, action, reward + gamma * max_future_q, alpha)
+                if monitor is not None:
+                    monitor.update(state, abs(alpha * td_error), q_table)
+
+                trajectory_recorder.step(state, actions.index(action), reward)
+                state = next_state
+
+                if state == goal:
+                    print(f"Goal reached in episode {episode} at step {_}")
+                    success_count = success_count + 1
+                    steps_to_goal.append(_ + 1)
+                    break  # Exit if goal is reached
+
+            trajectory_recorder.end_episode(state, state == goal)
+            if episode in recorded_episodes:
+                snapshot_writer.submit(q_table, f'QTableEpisode{episode}.json')
+            episodes += 1
+            if monitor is not None and monitor.end_episode(_ + 1, state == goal):
+                print(monitor.reason)
+                break
+
+    success_rate = success_count / episodes
     avg_steps_to_goal = sum(steps_to_goal) / len(steps_to_goal)
     print(success_count, len(steps_to_goal))
     print(f"Success rate: {success_rate:.2f}, Average steps to goal: {avg_steps_to_goal:.2f}")
 
 
+# Q(lambda) alternative to train_q_learning: eligibility traces carry the goal
+# reward back along the whole trajectory, so far fewer episodes are needed
+def train_q_lambda(lam=0.9, n_envs=256, seed=None):
+    stats = eligibilityTraces.train_module_q_lambda(sys.modules[__name__], lam, n_envs, seed, skip_bumps=True)
+    print(f"Success rate: {stats['success_rate']:.2f}, Average steps to goal: {stats['avg_steps_to_goal']:.2f}")
+    return stats
+
+
 # Extract the best path
 def extract_path(start, goal):
+    q_table = get_q_table()
     path = [start]
     state = start
     for _ in range(max_steps_per_episode):  # Limit steps to avoid infinite loops
         if state == goal:
             break
-        action = max(q_table[state], key=q_table[state].get)
+        action = actions[q_table.greedy_action(state)]
         next_state = get_next_state(state, action)
         if next_state == state:  # Prevent infinite loop
             continue
@@ -155,7 +181,20 @@ def extract_path(start, goal):
     return path
 
 
+# Headless alternative to the maze window: every recorded episode becomes
+# <output_dir>/episode<episode>.gif, drawn over the Q-table snapshot of its
+# episode (see trajectoryRenderer.py)
+def render_episodes(output_dir='frames', every=1, n_workers=None):
+    snapshots = {episode: checkpoint.load_q_table(f'QTableEpisode{episode}.json')
+                 for episode in trajectory_recorder.episodes()}
+    return trajectoryRenderer.render_trajectories(get_q_table(), trajectory_recorder.paths(), start, [goal], obstacles,
+                                                  output_dir, every=every, snapshots=snapshots, n_workers=n_workers)
+
+
 def create_open_maze_with_boundaries(rows, cols):
+    # pyamaze (and Tk with it) is only imported once a maze is drawn
+    from pyamaze import maze
+
     m = maze(rows, cols)
 
     # Set all internal walls to be open
@@ -189,6 +228,17 @@ def create_open_maze_with_boundaries(rows, cols):
 
 # Main logic
 if __name__ == "__main__":
+    if '--headless' in sys.argv:
+        # No display needed: train, then render the recorded episodes to GIFs
+        train_q_learning()
+        save_q_table('QTable.json')
+        trajectory_recorder.save('trajectories.trj')
+        for episode, (filename, frames) in render_episodes().items():
+            print(f"Episode {episode}: {frames} frames -> {filename}")
+        sys.exit()
+
+    from pyamaze import agent, COLOR
+
     # set up the maze
     m = create_open_maze_with_boundaries(5, 5)
     m.CreateMaze()
@@ -221,17 +271,10 @@ if __name__ == "__main__":
     converted_path = [(x + 1, y + 1) for (x, y) in best_path]
     # print(m.maze_map)
 
-    converted_episode0Path = [(x + 1, y + 1) for (x, y) in episode0Path]
-    m.tracePath({a0: converted_episode0Path})
-
-    converted_episode1Path = [(x + 1, y + 1) for (x, y) in episode1Path]
-    m.tracePath({a1: converted_episode1Path})
-
-    converted_episode5000Path = [(x + 1, y + 1) for (x, y) in episode5000Path]
-    m.tracePath({a5000: converted_episode5000Path})
-
-    converted_episode9000Path = [(x + 1, y + 1) for (x, y) in episode9000Path]
-    m.tracePath({a9000: converted_episode9000Path})
+    episode_agents = dict(zip(recorded_episodes, [a0, a1, a5000, a9000]))
+    for episode, episode_path in trajectory_recorder.paths().items():
+        converted_episode_path = [(x + 1, y + 1) for (x, y) in episode_path]
+        m.tracePath({episode_agents[episode]: converted_episode_path})
 
     m.tracePath({a: converted_path})
 
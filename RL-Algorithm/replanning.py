@@ -0,0 +1,205 @@
+import numpy as np
+
+from gridEnv import BatchGridEnv, GridEnv, train_q_learning_batch
+from planning import GridModel, PrioritizedSweeping
+
+replan_modes = ['plan', 'learn']
+
+
+def edit_env(env, add_obstacles=(), remove_obstacles=(), rewards=None, terminals=None):
+    # Copy of env with obstacles added or removed, rewards set from a
+    # {cell: reward} dict and terminal flags from a {cell: bool} dict
+    reward_map = env.reward_map.copy()
+    terminal_map = env.terminal_map.copy()
+    blocked_map = env.blocked_map.copy()
+    for x, y in add_obstacles:
+        blocked_map[x, y] = True
+    for x, y in remove_obstacles:
+        blocked_map[x, y] = False
+    for (x, y), reward in (rewards or {}).items():
+        reward_map[x, y] = reward
+    for (x, y), terminal in (terminals or {}).items():
+        terminal_map[x, y] = terminal
+    return GridEnv(env.grid_size, env.actions, dict(zip(env.actions, env.deltas.tolist())),
+                   reward_map, terminal_map, blocked_map, env.goal_reward)
+
+
+def changed_cells(old_env, new_env):
+    # Cells whose reward, terminal flag or blocked flag differ between two envs
+    changed = ((old_env.reward_map != new_env.reward_map) | (old_env.terminal_map != new_env.terminal_map)
+               | (old_env.blocked_map != new_env.blocked_map))
+    return [tuple(cell) for cell in np.argwhere(changed).tolist()]
+
+
+def _predecessors_of(model, states):
+    # All predecessors of an array of flat states, with duplicates
+    starts = model.pred_indptr[states]
+    counts = model.pred_indptr[states + 1] - starts
+    offsets = np.repeat(starts - np.cumsum(counts) + counts, counts)
+    return model.pred_states[offsets + np.arange(counts.sum())]
+
+
+def upstream_states(models, states, radius=None):
+    # Reverse reachability: flat states that can reach any of states within
+    # radius moves (without limit when None) under any of the given models,
+    # with their distance in moves. Both the old and the new model are passed
+    # after an edit, so states that used to reach a changed cell count too.
+    n_states = models[0].n_states
+    distance = np.full(n_states, -1, dtype=np.int64)
+    frontier = np.unique(np.asarray(states, dtype=np.int64))
+    distance[frontier] = 0
+    hops = 0
+    while frontier.size and (radius is None or hops < radius):
+        hops += 1
+        predecessors = np.unique(np.concatenate([_predecessors_of(model, frontier) for model in models]))
+        frontier = predecessors[distance[predecessors] < 0]
+        distance[frontier] = hops
+    region = np.flatnonzero(distance >= 0)
+    return region, distance[region]
+
+
+class Replanner:
+    # Keeps a trained Q-table in step with an env that gets edited, without
+    # retraining from scratch. Every edit is diffed against the current env
+    # and only the states upstream of the changed cells are revisited:
+    #   'plan'   prioritized sweeping from the changed cells, exact and local.
+    #            Edits that ripple through most of the map (a goal cut off,
+    #            say) stop sweeping after sweep_budget backups and finish with
+    #            vectorized value iteration over the upstream states instead
+    #   'learn'  Q-learning episodes started inside the affected region only,
+    #            after zeroing the Q-values that pointed into changed cells
+    # radius limits the learn region to states at most that many moves from a
+    # changed cell, by default every state that can reach one. The value
+    # iteration stops after max_iterations sweeps like planning.value_iteration.
+    def __init__(self, env, q_table, gamma, theta=1e-6, goal=None, mode='plan', alpha=0.9, epsilon=0.5,
+                 max_steps_per_episode=100, radius=None, episodes_per_state=4, n_envs=64, skip_bumps=True,
+                 sweep_budget=None, rng=None, max_iterations=10000):
+        if mode not in replan_modes:
+            raise ValueError(f"mode should be one of {replan_modes}, got {mode!r}")
+        self.env = env
+        self.q_table = q_table
+        self.gamma = gamma
+        self.theta = theta
+        self.max_iterations = max_iterations
+        self.goal = goal
+        self.mode = mode
+        self.alpha = alpha
+        self.epsilon = epsilon
+        self.max_steps_per_episode = max_steps_per_episode
+        self.radius = radius
+        self.episodes_per_state = episodes_per_state
+        self.n_envs = n_envs
+        self.skip_bumps = skip_bumps
+        self.sweep_budget = sweep_budget if sweep_budget is not None else env.n_states
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.sweeper = PrioritizedSweeping(env, q_table, gamma, theta, goal) if mode == 'plan' else None
+
+    def add_obstacles(self, cells):
+        return self.apply(edit_env(self.env, add_obstacles=cells))
+
+    def remove_obstacles(self, cells):
+        return self.apply(edit_env(self.env, remove_obstacles=cells))
+
+    def set_rewards(self, rewards):
+        return self.apply(edit_env(self.env, rewards=rewards))
+
+    def move_goal(self, old_goal, new_goal, reward=None, step_reward=None):
+        # The old goal becomes an ordinary cell paying step_reward (by default
+        # the most common reward of the non-terminal cells), the new one pays
+        # the old goal's reward unless reward is given
+        env = self.env
+        if reward is None:
+            reward = env.reward_map[tuple(old_goal)]
+        if step_reward is None:
+            values, counts = np.unique(env.reward_map[~env.terminal_map], return_counts=True)
+            step_reward = values[counts.argmax()] if counts.size else 0.0
+        rewards = {tuple(old_goal): step_reward, tuple(new_goal): reward}
+        terminals = {tuple(old_goal): False, tuple(new_goal): True}
+        return self.apply(edit_env(env, rewards=rewards, terminals=terminals))
+
+    def apply(self, new_env, cells=None):
+        # Switch to new_env and repair the table around the cells that changed
+        # (found by diffing the envs when not given). Returns what was done.
+        cells = changed_cells(self.env, new_env) if cells is None else [tuple(cell) for cell in cells]
+        if not cells:
+            self.env = new_env
+            return {'changed': 0, 'affected': 0}
+        if self.mode == 'plan':
+            return self._plan(new_env, cells)
+        return self._learn(new_env, cells)
+
+    def _plan(self, new_env, cells):
+        old_model = self.sweeper.model
+        backups = self.sweeper.update_env(new_env, cells, self.sweep_budget)
+        self.env = new_env
+        if backups < self.sweep_budget:
+            return {'changed': len(cells), 'affected': backups, 'backups': backups, 'converged': True}
+
+        # Sweeping ran out of budget, value iteration restricted to the
+        # states that can reach a changed cell converges from where it stopped
+        model = self.sweeper.model
+        cols = new_env.grid_size[1]
+        changed = np.array([x * cols + y for x, y in cells], dtype=np.int64)
+        region, _ = upstream_states([old_model, model], changed)
+        q = self.q_table.array.reshape(model.n_states, model.n_actions)
+        values = q.max(axis=1)
+        delta = np.inf
+        iterations = 0
+        while iterations < self.max_iterations and delta > self.theta:
+            q[region] = model.backup(values, self.gamma, region)
+            new_values = q[region].max(axis=1)
+            delta = float(np.abs(new_values - values[region]).max())
+            values[region] = new_values
+            iterations += 1
+        self.q_table.version += 1
+        return {'changed': len(cells), 'affected': len(region), 'backups': backups + iterations * len(region),
+                'converged': delta <= self.theta}
+
+    def _learn(self, new_env, cells):
+        old_model = GridModel(self.env, self.goal)
+        new_model = GridModel(new_env, self.goal)
+        cols = new_env.grid_size[1]
+        changed = np.array([x * cols + y for x, y in cells], dtype=np.int64)
+        region, _ = upstream_states([old_model, new_model], changed, self.radius)
+
+        # Values learned through a changed cell are stale, forget them so the
+        # agent doesn't keep walking into a removed goal or a new wall
+        q = self.q_table.array.reshape(new_model.n_states, new_model.n_actions)
+        stale = np.isin(old_model.next_state, changed) | np.isin(new_model.next_state, changed)
+        q[stale] = 0.0
+        q[changed] = 0.0
+        self.q_table.version += 1
+
+        free = region[~new_env.blocked_map.ravel()[region] & ~new_model.terminal[region]]
+        self.env = new_env
+        if not free.size:
+            return {'changed': len(cells), 'affected': len(region), 'episodes': 0}
+        episodes = self.episodes_per_state * len(free)
+        starts = np.stack(np.divmod(free, cols), axis=1)
+        batch_env = BatchGridEnv(new_env, min(self.n_envs, episodes), starts,
+                                 None if self.goal is None else [self.goal], self.rng)
+        stats = train_q_learning_batch(batch_env, self.q_table, episodes, self.alpha, self.gamma, self.epsilon,
+                                       self.max_steps_per_episode, self.skip_bumps)
+        return dict(stats, changed=len(cells), affected=len(region))
+
+
+def edit_module(module, add_obstacles=(), remove_obstacles=(), goals=None, mode='plan', **options):
+    # Edit a script's obstacles (and goals) in place and repair its q_table
+    # locally instead of re-running train_q_learning from zero. The env is
+    # rebuilt from the script's own functions before and after the edit, so
+    # only edits that change what the script does touch the table.
+    old_env = GridEnv.from_module(module)
+    removed = set(map(tuple, remove_obstacles))
+    module.obstacles = [cell for cell in module.obstacles if tuple(cell) not in removed]
+    module.obstacles += [tuple(cell) for cell in add_obstacles if tuple(cell) not in module.obstacles]
+    if goals is not None:
+        if hasattr(module, 'goals'):
+            module.goals = [tuple(goal) for goal in goals]
+        if hasattr(module, 'goal'):
+            module.goal = tuple(goals[0])
+    new_env = GridEnv.from_module(module)
+    options.setdefault('alpha', module.alpha)
+    options.setdefault('epsilon', module.epsilon)
+    options.setdefault('max_steps_per_episode', module.max_steps_per_episode)
+    replanner = Replanner(old_env, module.q_table, module.gamma, mode=mode, **options)
+    return replanner.apply(new_env)
@@ -0,0 +1,207 @@
+import numpy as np
+
+from actionSelection import ActionSelector, TransitionTable
+from gridEnv import setup_from_module
+
+# Prioritized experience replay for the tabular learners. Transitions are
+# kept in preallocated arrays and sampled in proportion to priority ** exponent,
+# the priority being the size of their last TD error, so the transitions the
+# table is most wrong about get replayed most. Sampling and priority updates
+# walk a sum-tree, O(log capacity) per transition and vectorized over a batch.
+
+
+class SumTree:
+    # Binary tree over capacity leaves stored in one array: node i has the
+    # children 2i and 2i + 1, the root is node 1 and holds the total
+    def __init__(self, capacity):
+        self.size = 1 << max(0, (capacity - 1).bit_length())
+        self.tree = np.zeros(2 * self.size)
+
+    @property
+    def total(self):
+        return float(self.tree[1])
+
+    def update(self, indices, priorities):
+        # Set the priorities of leaves indices and fix the sums above them,
+        # one vectorized pass per level
+        nodes = np.asarray(indices, dtype=np.int64) + self.size
+        self.tree[nodes] = priorities
+        nodes = np.unique(nodes // 2)
+        while nodes.size:
+            self.tree[nodes] = self.tree[2 * nodes] + self.tree[2 * nodes + 1]
+            nodes = np.unique(nodes[nodes > 1] // 2)
+
+    def set(self, index, priority):
+        # Scalar update for single transitions, cheaper than update() for one leaf
+        tree = self.tree
+        node = index + self.size
+        tree[node] = priority
+        node //= 2
+        while node:
+            tree[node] = tree[2 * node] + tree[2 * node + 1]
+            node //= 2
+
+    def find(self, values):
+        # Leaf of every value in [0, total): the one whose prefix sum range contains it
+        tree = self.tree
+        nodes = np.ones(len(values), dtype=np.int64)
+        values = np.array(values, dtype=np.float64)
+        while nodes[0] < self.size:
+            left = 2 * nodes
+            # Rounding can leave a value just above the left sum with nothing
+            # on the right, stay left then
+            go_right = (values >= tree[left]) & (tree[left + 1] > 0.0)
+            values -= np.where(go_right, tree[left], 0.0)
+            nodes = left + go_right
+        return nodes - self.size
+
+
+class PrioritizedReplayBuffer:
+    # Ring of the last capacity transitions (state, action, reward, next
+    # state, done). New transitions get the highest priority seen so far, so
+    # each is replayed at least about once before its TD error is known.
+    def __init__(self, capacity, priority_exponent=0.6, priority_epsilon=1e-3):
+        self.capacity = capacity
+        self.priority_exponent = priority_exponent
+        self.priority_epsilon = priority_epsilon
+        self.xs = np.zeros(capacity, dtype=np.int32)
+        self.ys = np.zeros(capacity, dtype=np.int32)
+        self.actions = np.zeros(capacity, dtype=np.int64)
+        self.rewards = np.zeros(capacity)
+        self.next_xs = np.zeros(capacity, dtype=np.int32)
+        self.next_ys = np.zeros(capacity, dtype=np.int32)
+        self.dones = np.zeros(capacity, dtype=bool)
+        self.tree = SumTree(capacity)
+        self.max_priority = 1.0
+        self.count = 0
+        self._next = 0
+
+    def __len__(self):
+        return self.count
+
+    def add(self, state, action, reward, next_state, done):
+        i = self._next
+        self.xs[i], self.ys[i] = state
+        self.actions[i] = action
+        self.rewards[i] = reward
+        self.next_xs[i], self.next_ys[i] = next_state
+        self.dones[i] = done
+        self.tree.set(i, self.max_priority)
+        self._next = (i + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def add_batch(self, xs, ys, actions, rewards, next_xs, next_ys, dones):
+        # Arrays of transitions, for the batched trainers
+        n = len(xs)
+        if n > self.capacity:
+            xs, ys, actions, rewards, next_xs, next_ys, dones = (
+                array[n - self.capacity:] for array in (xs, ys, actions, rewards, next_xs, next_ys, dones))
+            n = self.capacity
+        slots = (self._next + np.arange(n)) % self.capacity
+        self.xs[slots] = xs
+        self.ys[slots] = ys
+        self.actions[slots] = actions
+        self.rewards[slots] = rewards
+        self.next_xs[slots] = next_xs
+        self.next_ys[slots] = next_ys
+        self.dones[slots] = dones
+        self.tree.update(slots, self.max_priority)
+        self._next = int(slots[-1] + 1) % self.capacity
+        self.count = min(self.count + n, self.capacity)
+
+    def sample(self, batch_size, rng, beta=0.4):
+        # Indices drawn one per equal slice of the total priority, and their
+        # importance-sampling weights (count * P(i)) ** -beta scaled to at most 1
+        total = self.tree.total
+        values = (np.arange(batch_size) + rng.random(batch_size)) * (total / batch_size)
+        indices = self.tree.find(values)
+        probabilities = self.tree.tree[indices + self.tree.size] / total
+        weights = (self.count * probabilities) ** -beta
+        return indices, weights / weights.max()
+
+    def update_priorities(self, indices, td_errors):
+        priorities = (np.abs(td_errors) + self.priority_epsilon) ** self.priority_exponent
+        self.tree.update(indices, priorities)
+        self.max_priority = max(self.max_priority, float(priorities.max()))
+
+
+def replay_update(buffer, q_table, batch_size, alpha, gamma, rng, beta=0.4):
+    # One mini-batch of Bellman updates on transitions sampled from buffer,
+    # returns their TD errors. Pairs sampled more than once in the batch get
+    # the mean of their weighted changes.
+    indices, weights = buffer.sample(batch_size, rng, beta)
+    xs, ys, actions = buffer.xs[indices], buffer.ys[indices], buffer.actions[indices]
+    rows = np.arange(len(indices))
+    current = q_table.lookup(xs, ys)[rows, actions]
+    max_future_q = q_table.lookup(buffer.next_xs[indices], buffer.next_ys[indices]).max(axis=1)
+    td_errors = buffer.rewards[indices] + gamma * np.where(buffer.dones[indices], 0.0, max_future_q) - current
+    changes = alpha * weights * td_errors
+
+    keys = (xs.astype(np.int64) * q_table.grid_size[1] + ys) * len(q_table.actions) + actions
+    keys, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    mean_changes = np.bincount(inverse, changes) / np.bincount(inverse)
+    q_table.assign(xs[first], ys[first], actions[first], current[first] + mean_changes)
+    buffer.update_priorities(indices, td_errors)
+    return td_errors
+
+
+def train_q_learning_replay(env, q_table, start, num_episodes, alpha, gamma, epsilon, max_steps_per_episode,
+                            buffer=None, batch_size=32, replay_every=1, beta=0.4, skip_bumps=True, rng=None):
+    # train_q_learning_single plus experience replay: every transition is
+    # learned from as usual and stored in buffer (a fresh 2 ** 16 buffer by
+    # default), and every replay_every steps a mini-batch of batch_size stored
+    # transitions is replayed. Same stats, plus the replayed batches.
+    if env.goal_conditioned:
+        raise ValueError("train_q_learning_replay needs an env with fixed goals")
+    rng = rng if rng is not None else np.random.default_rng()
+    buffer = buffer if buffer is not None else PrioritizedReplayBuffer(1 << 16)
+    selector = ActionSelector(len(env.actions), rng)
+    table = TransitionTable(env)
+    next_states, rewards, dones, states = table.next_state, table.reward, table.done, table.states
+    success_count = 0
+    total_steps_to_goal = 0
+    total_steps = 0
+    replays = 0
+
+    for episode in range(num_episodes):
+        s = table.index(start)
+        for step in range(max_steps_per_episode):
+            state = states[s]
+            action = selector.select(q_table.lookup(state[0], state[1]), epsilon)
+            next_s = next_states[s][action]
+            if skip_bumps and next_s == s:
+                continue
+
+            done = dones[s][action]
+            reward = rewards[s][action]
+            max_future_q = 0.0 if done else q_table.max_q(states[next_s])
+            q_table.update(state, action, reward + gamma * max_future_q, alpha)
+            buffer.add(state, action, reward, states[next_s], done)
+            if (total_steps + step) % replay_every == 0 and len(buffer) >= batch_size:
+                replay_update(buffer, q_table, batch_size, alpha, gamma, rng, beta)
+                replays += 1
+            s = next_s
+            if done:
+                success_count += 1
+                total_steps_to_goal += step + 1
+                break
+        total_steps += step + 1
+
+    return {
+        'episodes': num_episodes,
+        'steps': total_steps,
+        'success_count': success_count,
+        'success_rate': success_count / num_episodes if num_episodes else 0.0,
+        'avg_steps_to_goal': total_steps_to_goal / success_count if success_count else 0.0,
+        'replays': replays,
+    }
+
+
+def train_module_replay(module, capacity=1 << 16, batch_size=32, replay_every=1, seed=None, skip_bumps=True):
+    # Replay version of a script's train_q_learning, trains its q_table in
+    # place with the script's own environment and hyperparameters
+    env, start_positions, _ = setup_from_module(module)
+    buffer = PrioritizedReplayBuffer(capacity)
+    return train_q_learning_replay(env, module.q_table, start_positions[0], module.num_episodes, module.alpha,
+                                   module.gamma, module.epsilon, module.max_steps_per_episode, buffer, batch_size,
+                                   replay_every, skip_bumps=skip_bumps, rng=np.random.default_rng(seed))
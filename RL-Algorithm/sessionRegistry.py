@@ -0,0 +1,246 @@
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import checkpoint
+from actionSelection import ActionSelector
+from qTable import QTable, default_actions
+
+config_keys = ['grid_size', 'start', 'goal', 'obstacles', 'alpha', 'gamma', 'epsilon', 'max_steps_per_episode']
+max_cells = 1 << 20  # Default cap on grid_size, rows * columns
+
+
+class SessionBusy(Exception):
+    # Raised when a session that jobs or streams still use would be replaced
+    pass
+
+
+def _pair(name, value):
+    # Two ints as a tuple, JSON turns tuples into lists
+    value = tuple(value)
+    if len(value) != 2 or not all(isinstance(v, int) and not isinstance(v, bool) for v in value):
+        raise ValueError(f"{name} must be two integers, got {list(value)}")
+    return value
+
+
+def _cell(name, value, grid_size):
+    cell = _pair(name, value)
+    if not (0 <= cell[0] < grid_size[0] and 0 <= cell[1] < grid_size[1]):
+        raise ValueError(f"{name} {list(cell)} is outside the {grid_size[0]}x{grid_size[1]} grid")
+    return cell
+
+
+def normalize_config(config, max_cells=max_cells):
+    # Checks the cells against the grid, and the grid against max_cells, so
+    # a config can't index outside the table or allocate a huge one. Cells
+    # come back as tuples so states compare as tuples.
+    config = {key: config[key] for key in config_keys}
+    grid_size = _pair('grid_size', config['grid_size'])
+    if min(grid_size) < 1 or grid_size[0] * grid_size[1] > max_cells:
+        raise ValueError(f"grid_size must be positive with at most {max_cells} cells, got {list(grid_size)}")
+    config['grid_size'] = grid_size
+    config['start'] = _cell('start', config['start'], grid_size)
+    config['goal'] = _cell('goal', config['goal'], grid_size)
+    config['obstacles'] = [_cell('obstacle', obstacle, grid_size) for obstacle in config['obstacles']]
+    return config
+
+
+class AgentSession:
+    # One experimenter's environment config and Q-table. lock guards the
+    # table, pins counts running jobs and open streams that keep it live.
+    def __init__(self, session_id, config, q_table=None, actions=default_actions, max_cells=max_cells):
+        self.id = session_id
+        self.config = normalize_config(config, max_cells)
+        for key, value in self.config.items():
+            setattr(self, key, value)
+        self.obstacle_set = set(self.obstacles)
+        self.actions = list(actions)
+        self.q_table = q_table if q_table is not None else QTable(self.grid_size, self.actions)
+        self.action_selector = ActionSelector(len(self.actions))
+        self.path_query = None  # Built by app.path_query on first use
+        self.lock = threading.Lock()
+        self.last_used = time.monotonic()
+        self.pins = 0
+
+    def touch(self):
+        self.last_used = time.monotonic()
+
+
+class SessionRegistry:
+    # Sessions keyed by id. At most max_live sessions stay in memory (least
+    # recently used are evicted first) and sessions idle for longer than ttl
+    # seconds are evicted too. Evicted tables are spilled to spill_dir as
+    # checkpoints and reloaded on the next access. Pinned sessions stay live.
+    # The registry lock only picks the sessions to evict, their checkpoints
+    # are written after it's released so other requests aren't held up, and
+    # spilled checkpoints are read back the same way.
+    # Configs with more than max_cells cells are refused.
+    def __init__(self, default_config, max_live=256, ttl=1800.0, spill_dir=None, max_cells=max_cells):
+        self.max_cells = max_cells
+        self.default_config = normalize_config(default_config, max_cells)
+        self.max_live = max_live
+        self.ttl = ttl
+        self.spill_dir = spill_dir or tempfile.mkdtemp(prefix='rl-sessions-')
+        os.makedirs(self.spill_dir, exist_ok=True)
+        self._live = OrderedDict()
+        self._spilled = {}
+        self._spilling = {}  # Evicted, checkpoint being written: id -> (session, path)
+        self._reloading = {}  # Checkpoint being read back: id -> (path, Event set when done)
+        self._lock = threading.Lock()
+
+    def create(self, config=None):
+        session = AgentSession(uuid.uuid4().hex, config or self.default_config, max_cells=self.max_cells)
+        with self._lock:
+            self._live[session.id] = session
+            victims = self._evict()
+        self._spill(victims)
+        return session
+
+    def get(self, session_id):
+        # The live session, reloaded from disk if it was spilled, or None
+        while True:
+            with self._lock:
+                session = self._live.get(session_id)
+                if session is None and session_id in self._spilling:
+                    # Still in memory, its checkpoint is dropped once written
+                    session, _ = self._spilling.pop(session_id)
+                    self._live[session_id] = session
+                victims = []
+                waiting = reload = None
+                if session is not None:
+                    self._live.move_to_end(session_id)
+                    session.touch()
+                    victims = self._evict()
+                elif session_id in self._reloading:
+                    waiting = self._reloading[session_id][1]
+                elif session_id in self._spilled:
+                    reload = self._reloading[session_id] = (self._spilled.pop(session_id), threading.Event())
+                else:
+                    return None
+            if reload is not None:
+                self._reload(session_id, *reload)
+            elif waiting is not None:
+                waiting.wait()  # Another request is reading it back
+            else:
+                self._spill(victims)
+                return session
+
+    def get_or_create(self, session_id):
+        session = self.get(session_id) if session_id else None
+        return session if session is not None else self.create()
+
+    def replace(self, session_id, config):
+        # Start over with a new config (and a fresh table) under the same id.
+        # A pinned session isn't replaced, its jobs and streams would go on
+        # with a table nobody can see anymore.
+        session = AgentSession(session_id, config, max_cells=self.max_cells)
+        with self._lock:
+            current = self._live.get(session_id)
+            if current is not None and current.pins:
+                raise SessionBusy(f"session {session_id} has {current.pins} running jobs or open streams")
+            self._live[session_id] = session
+            self._live.move_to_end(session_id)
+            self._drop_spilled(session_id)
+            victims = self._evict()
+        self._spill(victims)
+        return session
+
+    def remove(self, session_id):
+        with self._lock:
+            self._live.pop(session_id, None)
+            self._drop_spilled(session_id)
+
+    def pin(self, session):
+        with self._lock:
+            session.pins += 1
+
+    def unpin(self, session):
+        with self._lock:
+            session.pins -= 1
+            session.touch()
+
+    @contextmanager
+    def pinned(self, session):
+        self.pin(session)
+        try:
+            yield session
+        finally:
+            self.unpin(session)
+
+    def stats(self):
+        with self._lock:
+            return {'live': len(self._live),
+                    'spilled': len(self._spilled) + len(self._spilling) + len(self._reloading)}
+
+    def evict_idle(self):
+        with self._lock:
+            victims = self._evict()
+        self._spill(victims)
+
+    def _evict(self):
+        # Called with the lock held: moves the sessions to evict from _live
+        # to _spilling and returns them for _spill
+        now = time.monotonic()
+        victims = []
+        for session_id, session in list(self._live.items()):
+            over_capacity = len(self._live) > self.max_live
+            expired = now - session.last_used > self.ttl
+            if (over_capacity or expired) and session.pins == 0:
+                # Each spill gets its own file, an older write of the same
+                # session may still be going on
+                path = os.path.join(self.spill_dir, f"{session_id}-{uuid.uuid4().hex[:8]}{checkpoint.extension}")
+                self._spilling[session_id] = (session, path)
+                del self._live[session_id]
+                victims.append((session, path))
+        return victims
+
+    def _spill(self, victims):
+        # Called without the lock: writes the checkpoints, then records them
+        # unless the session was revived, replaced or removed meanwhile
+        for session, path in victims:
+            with session.lock:
+                checkpoint.save_checkpoint(session.q_table, path, **session.config)
+            with self._lock:
+                current = self._spilling.get(session.id)
+                if current is not None and current[0] is session and current[1] == path:
+                    del self._spilling[session.id]
+                    self._spilled[session.id] = path
+                    path = None
+            if path is not None:
+                os.remove(path)
+
+    def _reload(self, session_id, path, done):
+        # Called without the lock: reads a spilled checkpoint back into
+        # _live, unless the session was replaced or removed meanwhile. A
+        # failed read leaves it spilled.
+        try:
+            q_table, header = checkpoint.load_checkpoint(path, mode=None)
+            session = AgentSession(session_id, header['hyperparameters'], q_table, header['actions'],
+                                   self.max_cells)
+        except BaseException:
+            with self._lock:
+                if self._reloading.get(session_id) == (path, done):
+                    del self._reloading[session_id]
+                    self._spilled[session_id] = path
+                    path = None
+            if path is not None:
+                os.remove(path)
+            done.set()
+            raise
+        os.remove(path)
+        with self._lock:
+            if self._reloading.get(session_id) == (path, done):
+                del self._reloading[session_id]
+                self._live[session_id] = session
+        done.set()
+
+    def _drop_spilled(self, session_id):
+        self._spilling.pop(session_id, None)  # _spill removes the file
+        self._reloading.pop(session_id, None)  # And _reload this one
+        path = self._spilled.pop(session_id, None)
+        if path is not None and os.path.exists(path):
+            os.remove(path)
@@ -0,0 +1,103 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+class TrainingJob:
+    # Progress and cancellation state of one background training run. The
+    # train function bumps episodes_done and checks cancelled between episodes.
+    def __init__(self, episodes, owner=None):
+        self.id = uuid.uuid4().hex
+        self.owner = owner
+        self.episodes = episodes
+        self.episodes_done = 0
+        self.status = 'queued'  # queued, running, done, cancelled or failed
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self._cancel = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    @property
+    def finished_running(self):
+        return self.status in ('done', 'cancelled', 'failed')
+
+    def cancel(self):
+        self._cancel.set()
+        if self.status == 'queued':
+            self.status = 'cancelled'
+
+    def to_dict(self):
+        end = self.finished or time.time()
+        elapsed = end - self.started if self.started else 0.0
+        return {
+            'id': self.id,
+            'status': self.status,
+            'episodes': self.episodes,
+            'episodes_done': self.episodes_done,
+            'episodes_per_sec': self.episodes_done / elapsed if elapsed else 0.0,
+            'elapsed': elapsed,
+            'error': self.error,
+        }
+
+
+class JobManager:
+    # Runs training jobs on a thread pool so request handlers return at once.
+    # Only the last keep_finished finished jobs are remembered.
+    def __init__(self, max_workers=4, keep_finished=100):
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix='training')
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self.keep_finished = keep_finished
+
+    def submit(self, episodes, train, owner=None, on_finish=None):
+        # train(job) does the work, it runs on a pool thread. on_finish(job)
+        # runs afterwards whatever the outcome, also for jobs cancelled while queued.
+        job = TrainingJob(episodes, owner)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        self._executor.submit(self._run, job, train, on_finish)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self, owner=None):
+        with self._lock:
+            return [job for job in self._jobs.values() if owner is None or job.owner == owner]
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        if job is not None:
+            job.cancel()
+        return job
+
+    def _run(self, job, train, on_finish=None):
+        try:
+            if job.cancelled:
+                job.status = 'cancelled'
+                return
+            job.status = 'running'
+            job.started = time.time()
+            train(job)
+            job.status = 'cancelled' if job.cancelled else 'done'
+        except Exception as e:
+            job.status = 'failed'
+            job.error = str(e)
+        finally:
+            job.finished = time.time()
+            if on_finish is not None:
+                on_finish(job)
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished_running]
+        for job_id in finished[:max(0, len(finished) - self.keep_finished)]:
+            del self._jobs[job_id]
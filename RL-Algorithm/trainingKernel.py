@@ -0,0 +1,183 @@
+import random
+
+import numpy as np
+
+from gridEnv import setup_from_module
+
+# The single-agent epsilon-greedy Q-learning loop as one function over
+# arrays, compiled with Numba when it is installed and run as plain Python
+# otherwise. Both give bit-identical tables for the same seed: random numbers
+# come from a generator written out here in integer arithmetic (xoshiro128**,
+# seeded through splitmix64) instead of numpy's, every value stays below 2 ** 43
+# so Python ints and int64 agree, and the float updates are the same IEEE
+# operations in the same order. Compiled code is cached next to this file
+# (numba's cache=True), so only the first run in a fresh checkout compiles.
+
+try:
+    from numba import njit
+    from numba.extending import register_jitable
+except ImportError:
+    njit = None
+
+    def register_jitable(function):
+        return function
+
+jit_available = njit is not None
+_mask32 = 0xFFFFFFFF
+_mask64 = 0xFFFFFFFFFFFFFFFF
+
+
+def seed_state(seed=None):
+    # Generator state for a seed: four 32 bit words from splitmix64, as the
+    # int64 array the kernel advances in place
+    if seed is None:
+        seed = random.getrandbits(64)
+    x = seed & _mask64
+    words = []
+    while len(words) < 4:
+        x = (x + 0x9E3779B97F4A7C15) & _mask64
+        z = x
+        z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & _mask64
+        z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & _mask64
+        z ^= z >> 31
+        words.extend([z & _mask32, z >> 32])
+    if not any(words):
+        words[0] = 1  # The all-zero state would only ever give zeros
+    return np.array(words, dtype=np.int64)
+
+
+@register_jitable
+def next_random(state):
+    # xoshiro128**: the next 32 bit output, state is advanced in place
+    s0, s1, s2, s3 = state[0], state[1], state[2], state[3]
+    x = (s1 * 5) & 0xFFFFFFFF
+    result = (((x << 7) | (x >> 25)) & 0xFFFFFFFF) * 9 & 0xFFFFFFFF
+    t = (s1 << 9) & 0xFFFFFFFF
+    s2 ^= s0
+    s3 ^= s1
+    s1 ^= s2
+    s0 ^= s3
+    s2 ^= t
+    s3 = ((s3 << 11) | (s3 >> 21)) & 0xFFFFFFFF
+    state[0], state[1], state[2], state[3] = s0, s1, s2, s3
+    return result
+
+
+def run_episodes(q, next_state, reward, done, start, num_episodes, alpha, gamma, epsilon, max_steps_per_episode,
+                 skip_bumps, rng_state):
+    # q, next_state, reward and done are (n_states, n_actions), as arrays for
+    # the compiled kernel and nested lists for plain Python, start a flat
+    # state. Two random numbers per step: one against epsilon, the other picks
+    # the random action or breaks a tie among the maximal ones. Returns
+    # (steps, success_count, steps to goal summed over the successes).
+    n_actions = len(q[0])
+    total_steps = 0
+    success_count = 0
+    total_steps_to_goal = 0
+    for episode in range(num_episodes):
+        s = start
+        step = 0
+        for step in range(max_steps_per_episode):
+            explore = next_random(rng_state) / 4294967296.0 < epsilon
+            r = next_random(rng_state)
+            row = q[s]
+            if explore:
+                action = (r * n_actions) >> 32
+            else:
+                best = row[0]
+                ties = 1
+                action = 0
+                for a in range(1, n_actions):
+                    if row[a] > best:
+                        best = row[a]
+                        ties = 1
+                        action = a
+                    elif row[a] == best:
+                        ties += 1
+                if ties > 1:
+                    k = (r * ties) >> 32
+                    for a in range(n_actions):
+                        if row[a] == best:
+                            if k == 0:
+                                action = a
+                                break
+                            k -= 1
+
+            s_next = next_state[s][action]
+            if skip_bumps and s_next == s:
+                continue
+            finished = done[s][action]
+            max_future_q = 0.0
+            if not finished:
+                next_row = q[s_next]
+                max_future_q = next_row[0]
+                for a in range(1, n_actions):
+                    if next_row[a] > max_future_q:
+                        max_future_q = next_row[a]
+            target = reward[s][action] + gamma * max_future_q
+            row[action] = row[action] + alpha * (target - row[action])
+            s = s_next
+            if finished:
+                success_count += 1
+                total_steps_to_goal += step + 1
+                break
+        total_steps += step + 1
+    return total_steps, success_count, total_steps_to_goal
+
+
+_compiled_run_episodes = njit(cache=True)(run_episodes) if jit_available else None
+
+
+def train_q_learning_kernel(env, q_table, start, num_episodes, alpha, gamma, epsilon, max_steps_per_episode,
+                            skip_bumps=True, rng_state=None, seed=None, use_jit=None):
+    # gridEnv.train_q_learning_single through run_episodes, same stats plus
+    # whether it ran compiled. rng_state (see seed_state, made from seed if
+    # not given) is advanced in place, so chunked runs continue one stream.
+    # use_jit None compiles when Numba is available, False forces plain Python.
+    if env.goal_conditioned:
+        raise ValueError("train_q_learning_kernel needs an env with fixed goals")
+    if use_jit and not jit_available:
+        raise ImportError("use_jit=True needs numba")
+    use_jit = jit_available if use_jit is None else use_jit
+    rng_state = rng_state if rng_state is not None else seed_state(seed)
+    next_state = env.transition_table()
+    reward = env.reward_map.ravel()[next_state]
+    done = env.terminal_map.ravel()[next_state]
+    q = np.ascontiguousarray(q_table.array, dtype=np.float64).reshape(env.n_states, len(q_table.actions))
+    start = int(start[0]) * env.grid_size[1] + int(start[1])
+    settings = (start, num_episodes, float(alpha), float(gamma), float(epsilon), max_steps_per_episode,
+                bool(skip_bumps))
+
+    if use_jit:
+        steps, success_count, total_steps_to_goal = _compiled_run_episodes(q, next_state, reward, done, *settings,
+                                                                           rng_state)
+    else:
+        # Nested lists are several times faster than numpy scalars in plain Python
+        state = rng_state.tolist()
+        q_rows = q.tolist()
+        steps, success_count, total_steps_to_goal = run_episodes(q_rows, next_state.tolist(), reward.tolist(),
+                                                                 done.tolist(), *settings, state)
+        q[...] = q_rows
+        rng_state[:] = state
+    if np.shares_memory(q, q_table.array):
+        q_table.version += 1
+    else:
+        q_table.copy_from(q.reshape(q_table.array.shape))
+
+    return {
+        'episodes': num_episodes,
+        'steps': steps,
+        'success_count': success_count,
+        'success_rate': success_count / num_episodes if num_episodes else 0.0,
+        'avg_steps_to_goal': total_steps_to_goal / success_count if success_count else 0.0,
+        'jit': use_jit,
+    }
+
+
+def train_module_kernel(module, seed=None, skip_bumps=True, use_jit=None):
+    # Kernel version of a script's train_q_learning, trains its q_table in
+    # place with the script's own environment and hyperparameters
+    env, start_positions, _ = setup_from_module(module)
+    return train_q_learning_kernel(env, module.q_table, start_positions[0], module.num_episodes, module.alpha,
+                                   module.gamma, module.epsilon, module.max_steps_per_episode, skip_bumps,
+                                   seed=seed, use_jit=use_jit)
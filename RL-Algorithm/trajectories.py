@@ -0,0 +1,257 @@
+import queue
+import threading
+
+import numpy as np
+
+import checkpoint
+
+# Recording of training episodes for visualization and replay. Steps go into
+# one preallocated ring of packed arrays (flat state, action index, reward),
+# so recording many episodes costs a fixed amount of memory and no per-step
+# allocations. Which episodes are kept is decided by rules:
+#   episodes  explicit episode numbers, like [0, 1, 5000, 9000]
+#   every     every k-th episode
+#   first     the first n episodes
+#   last      the n most recent episodes
+#   best      the n episodes with the highest return
+#   worst     the n episodes with the lowest return
+# An episode no rule keeps gives its space back as soon as it ends. When the
+# ring wraps, kept episodes whose steps get overwritten are dropped, oldest
+# first.
+
+
+class TrajectoryRecorder:
+    def __init__(self, grid_size, capacity=1 << 16, episodes=(), every=0, first=0, last=0, best=0, worst=0):
+        self.grid_size = tuple(grid_size)
+        self.capacity = capacity
+        self.states = np.zeros(capacity, dtype=np.int32)
+        self.actions = np.zeros(capacity, dtype=np.int8)
+        self.rewards = np.zeros(capacity, dtype=np.float32)
+
+        self.episode_numbers = set(episodes)
+        self.every = every
+        self.first = first
+        self.last = last
+        self.best = best
+        self.worst = worst
+
+        self._head = 0  # Steps written so far, the ring position is _head % capacity
+        self._seen = 0
+        self._episode = None
+        self._start = 0
+        self._return = 0.0
+        # Kept episodes in the order they ended: episode -> [start, length,
+        # final state, return, success, truncated], plus the rules keeping each one
+        self._kept = {}
+        self._reasons = {}
+        self._last = []
+        self._best = []
+        self._worst = []
+
+    def wants(self, episode):
+        # Whether the steps of episode need recording at all, known up front
+        # unless a rule depends on how the episode goes
+        return bool(self.last or self.best or self.worst or episode in self.episode_numbers
+                    or (self.every and episode % self.every == 0) or self._seen < self.first)
+
+    def start_episode(self, episode):
+        # Returns whether the episode is recorded, step() ignores the others
+        self._episode = episode if self.wants(episode) else None
+        self._start = self._head
+        self._return = 0.0
+        return self._episode is not None
+
+    def step(self, state, action, reward):
+        # state is where action was taken, reward what the move paid
+        if self._episode is None:
+            return
+        i = self._head % self.capacity
+        self.states[i] = state[0] * self.grid_size[1] + state[1]
+        self.actions[i] = action
+        self.rewards[i] = reward
+        self._head += 1
+        self._return += reward
+
+    def end_episode(self, final_state, success):
+        episode = self._episode
+        self._seen += 1
+        if episode is None:
+            return
+        self._episode = None
+        # Kept episodes whose first step has been overwritten are gone
+        oldest = self._head - self.capacity
+        while self._kept:
+            kept = next(iter(self._kept))
+            if self._kept[kept][0] >= oldest:
+                break
+            self._drop(kept)
+
+        reasons = set()
+        if episode in self.episode_numbers:
+            reasons.add('episodes')
+        if self.every and episode % self.every == 0:
+            reasons.add('every')
+        if self._seen <= self.first:
+            reasons.add('first')
+        if self.last:
+            reasons.add('last')
+            self._last.append(episode)
+            if len(self._last) > self.last:
+                self._release(self._last.pop(0), 'last')
+        if self.best and self._rank(self._best, self.best, self._return, episode):
+            reasons.add('best')
+        if self.worst and self._rank(self._worst, self.worst, -self._return, episode):
+            reasons.add('worst')
+        if not reasons:
+            self._head = self._start  # Nobody wants it, reuse its space
+            return
+
+        # An episode longer than the ring only keeps its last capacity steps
+        start = max(self._start, self._head - self.capacity)
+        final = final_state[0] * self.grid_size[1] + final_state[1]
+        self._kept[episode] = [start, self._head - start, final, self._return, bool(success), start > self._start]
+        self._reasons[episode] = reasons
+
+    def _rank(self, ranking, n, score, episode):
+        # Keeps the n highest scores in ranking, releasing whichever falls out
+        if len(ranking) == n and score <= ranking[0][0]:
+            return False
+        ranking.append((score, episode))
+        ranking.sort()
+        if len(ranking) > n:
+            reason = 'best' if ranking is self._best else 'worst'
+            self._release(ranking.pop(0)[1], reason)
+        return True
+
+    def _release(self, episode, reason):
+        reasons = self._reasons.get(episode)
+        if reasons is not None:
+            reasons.discard(reason)
+            if not reasons:
+                self._drop(episode)
+
+    def _drop(self, episode):
+        del self._kept[episode]
+        del self._reasons[episode]
+        self._last[:] = [kept for kept in self._last if kept != episode]
+        for ranking in (self._best, self._worst):
+            ranking[:] = [item for item in ranking if item[1] != episode]
+
+    def episodes(self):
+        return list(self._kept)
+
+    def _positions(self, episode):
+        start, length = self._kept[episode][:2]
+        return np.arange(start, start + length) % self.capacity
+
+    def trajectory(self, episode):
+        # The steps of a kept episode as arrays: states (n, 2), actions and
+        # rewards, plus the final state, return and whether it reached a goal
+        positions = self._positions(episode)
+        _, _, final, episode_return, success, truncated = self._kept[episode]
+        cols = self.grid_size[1]
+        return {
+            'states': np.stack(np.divmod(self.states[positions].astype(np.int64), cols), axis=1),
+            'actions': self.actions[positions].copy(),
+            'rewards': self.rewards[positions].copy(),
+            'final_state': divmod(final, cols),
+            'return': episode_return,
+            'success': success,
+            'truncated': truncated,
+        }
+
+    def path(self, episode):
+        # Visited cells as (x, y) tuples, from the start to the final state
+        positions = self._positions(episode)
+        cols = self.grid_size[1]
+        return [divmod(s, cols) for s in self.states[positions].tolist()] + [divmod(self._kept[episode][2], cols)]
+
+    def paths(self):
+        return {episode: self.path(episode) for episode in self._kept}
+
+    def save(self, filename):
+        # Kept episodes in the checkpoint container layout, read back with load_trajectories
+        positions = [self._positions(episode) for episode in self._kept]
+        index = np.concatenate(positions) if positions else np.zeros(0, dtype=np.int64)
+        meta = {'kind': 'trajectories', 'grid_size': list(self.grid_size)}
+        kept = list(self._kept.items())
+        checkpoint.write_container(filename, meta, {
+            'episodes': np.array([episode for episode, _ in kept], dtype=np.int64),
+            'lengths': np.array([len(p) for p in positions], dtype=np.int64),
+            'final_states': np.array([record[2] for _, record in kept], dtype=np.int32),
+            'returns': np.array([record[3] for _, record in kept], dtype=np.float64),
+            'successes': np.array([record[4] for _, record in kept], dtype=bool),
+            'truncated': np.array([record[5] for _, record in kept], dtype=bool),
+            'states': self.states[index],
+            'actions': self.actions[index],
+            'rewards': self.rewards[index],
+        })
+
+
+def load_trajectories(filename):
+    # {episode: trajectory} as returned by TrajectoryRecorder.trajectory
+    header, arrays = checkpoint.read_container(filename, None)
+    if header.get('kind') != 'trajectories':
+        raise ValueError(f"{filename} holds no trajectories")
+    cols = header['grid_size'][1]
+    trajectories = {}
+    ends = np.cumsum(arrays['lengths'])
+    for i, episode in enumerate(arrays['episodes'].tolist()):
+        steps = slice(ends[i] - arrays['lengths'][i], ends[i])
+        trajectories[episode] = {
+            'states': np.stack(np.divmod(arrays['states'][steps].astype(np.int64), cols), axis=1),
+            'actions': arrays['actions'][steps],
+            'rewards': arrays['rewards'][steps],
+            'final_state': divmod(int(arrays['final_states'][i]), cols),
+            'return': float(arrays['returns'][i]),
+            'success': bool(arrays['successes'][i]),
+            'truncated': bool(arrays['truncated'][i]),
+        }
+    return trajectories
+
+
+class SnapshotWriter:
+    # Writes Q-table snapshots on a background thread, so training only pays
+    # for copying the table. At most max_pending copies wait to be written,
+    # submit blocks beyond that. A write error is raised by the next submit
+    # or by close.
+    def __init__(self, max_pending=4):
+        self._queue = queue.Queue(max_pending)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name='snapshot-writer', daemon=True)
+        self._thread.start()
+
+    def submit(self, q_table, filename):
+        # filename ending in checkpoint.extension writes a binary checkpoint, anything else JSON
+        if self._error is not None:
+            raise self._error
+        self._queue.put((q_table.copy(), filename))
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            q_table, filename = item
+            try:
+                if filename.endswith(checkpoint.extension):
+                    checkpoint.save_checkpoint(q_table, filename)
+                else:
+                    checkpoint.save_json_q_table(q_table, filename)
+            except Exception as error:
+                if self._error is None:
+                    self._error = error
+
+    def close(self):
+        # Waits for every pending snapshot
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
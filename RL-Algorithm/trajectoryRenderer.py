@@ -0,0 +1,327 @@
+import argparse
+import importlib
+import os
+import shutil
+import subprocess
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import checkpoint
+import qTableReport
+from trajectories import load_trajectories
+
+# Headless replay of recorded training episodes. Every frame is a whole grid
+# rasterized from arrays: the max-Q heatmap of the Q-table as background, the
+# cells the agent has visited so far and the agent itself. Frames are palette
+# indices, one byte per pixel, and are written as
+#   .gif   animated GIF, written here without any imaging library. After the
+#          first frame only the rectangle that changed is stored.
+#   .mp4   H.264 video, needs the ffmpeg executable
+#   other  a directory of PNG frames, frame<step>.png
+# Episodes are rendered in parallel on a process pool, one file each, so no
+# display and no real-time replay are involved.
+
+ramp_levels = 248  # Palette entries 0 .. ramp_levels - 1 are the heatmap colormap
+obstacle_index = 248
+start_index = 249
+goal_index = 250
+trail_index = 251
+agent_index = 252
+trail_color = (255, 255, 255)
+agent_color = (220, 20, 60)
+
+
+def palette():
+    # (256, 3) uint8 colors of the palette indices
+    colors = np.zeros((256, 3), dtype=np.uint8)
+    stops = np.linspace(0.0, 1.0, len(qTableReport.colormap))
+    levels = np.linspace(0.0, 1.0, ramp_levels)
+    for c in range(3):
+        colors[:ramp_levels, c] = np.interp(levels, stops, qTableReport.colormap[:, c])
+    colors[obstacle_index] = qTableReport.obstacle_color
+    colors[start_index] = qTableReport.start_color
+    colors[goal_index] = qTableReport.goal_color
+    colors[trail_index] = trail_color
+    colors[agent_index] = agent_color
+    return colors
+
+
+def background(q_table, start, goals, obstacles):
+    # (rows, cols) palette indices of the heatmap, colored like qTableReport's
+    blocked = qTableReport.cell_masks(q_table.grid_size, obstacles)
+    low, high = qTableReport.value_range(q_table, blocked)
+    cells = np.zeros(q_table.grid_size, dtype=np.uint8)
+    block_rows = qTableReport.block_rows
+    for x0 in range(0, q_table.grid_size[0], block_rows):
+        values = q_table.array[x0:x0 + block_rows].max(axis=2)
+        scaled = (values - low) / (high - low) if high > low else np.zeros_like(values)
+        cells[x0:x0 + block_rows] = np.rint(np.clip(scaled, 0.0, 1.0) * (ramp_levels - 1))
+    cells[blocked] = obstacle_index
+    for x, y in goals:
+        cells[x, y] = goal_index
+    cells[start[0], start[1]] = start_index
+    return cells
+
+
+def trajectory_cells(trajectory):
+    # (n, 2) visited cells of a path: a list of (x, y) like
+    # TrajectoryRecorder.paths() gives, or a trajectory dict of load_trajectories
+    if isinstance(trajectory, dict):
+        return np.vstack([trajectory['states'], [trajectory['final_state']]]).astype(np.int64)
+    return np.asarray(trajectory, dtype=np.int64).reshape(-1, 2)
+
+
+def frame_steps(length, every=1):
+    # Steps shown with frame skipping: every every-th step plus the last one
+    steps = list(range(0, length, max(1, every)))
+    if steps[-1] != length - 1:
+        steps.append(length - 1)
+    return steps
+
+
+def frames(base, cells, every=1):
+    # Yields (step, canvas, box) per shown step. canvas is one (rows, cols)
+    # index array updated in place, the agent at cells[step] and the cells it
+    # left behind painted as trail (start, goals and obstacles keep their
+    # colors). box = (x0, x1, y0, y1) bounds the cells changed since the
+    # previous frame, the whole grid for the first one.
+    canvas = base.copy()
+    paintable = base < ramp_levels
+    rows, cols = base.shape
+    previous = 0
+    box = (0, rows, 0, cols)
+    for step in frame_steps(len(cells), every):
+        if step:
+            changed = cells[previous:step + 1]
+            trail = changed[:-1][paintable[changed[:-1, 0], changed[:-1, 1]]]
+            canvas[trail[:, 0], trail[:, 1]] = trail_index
+            (x0, y0), (x1, y1) = changed.min(axis=0), changed.max(axis=0) + 1
+            box = (int(x0), int(x1), int(y0), int(y1))
+        x, y = cells[step]
+        canvas[x, y] = agent_index
+        yield step, canvas, box
+        canvas[x, y] = trail_index if paintable[x, y] else base[x, y]
+        previous = step
+
+
+def upscale(cells, scale):
+    if scale == 1:
+        return cells
+    return np.repeat(np.repeat(cells, scale, axis=0), scale, axis=1)
+
+
+def _lzw(pixels):
+    # GIF flavored LZW of a bytes object of 8 bit palette indices: variable
+    # code width from 9 to 12 bits, least significant bit first, the table
+    # cleared whenever it fills up
+    clear, stop = 256, 257
+    out = bytearray()
+    table = {}
+    next_code = 258
+    code_size = 9
+    buffer, bits = clear, 9
+    code = pixels[0]
+    for pixel in pixels[1:]:
+        key = code << 8 | pixel
+        found = table.get(key)
+        if found is not None:
+            code = found
+            continue
+        buffer |= code << bits
+        bits += code_size
+        if next_code == 4096:
+            buffer |= clear << bits
+            bits += code_size
+            table = {}
+            next_code = 258
+            code_size = 9
+        else:
+            if next_code >= 1 << code_size:
+                code_size += 1
+            table[key] = next_code
+            next_code += 1
+        while bits >= 8:
+            out.append(buffer & 0xFF)
+            buffer >>= 8
+            bits -= 8
+        code = pixel
+    buffer |= code << bits
+    bits += code_size
+    # The decoder adds its entry for the last code before reading the stop
+    # code, which can widen the codes by one bit
+    if next_code == 1 << code_size and code_size < 12:
+        code_size += 1
+    buffer |= stop << bits
+    bits += code_size
+    while bits > 0:
+        out.append(buffer & 0xFF)
+        buffer >>= 8
+        bits -= 8
+    return bytes(out)
+
+
+def _sub_blocks(data):
+    return b''.join(bytes([len(data[i:i + 255])]) + data[i:i + 255] for i in range(0, len(data), 255)) + b'\0'
+
+
+def gif_chunks(width, height, images, delay=10):
+    # Animated GIF in pieces. images yields (left, top, indices) rectangles
+    # drawn over the previous frame, delay is in hundredths of a second.
+    yield b'GIF89a' + width.to_bytes(2, 'little') + height.to_bytes(2, 'little') + b'\xf7\0\0'
+    yield palette().tobytes()
+    yield b'!\xff\x0bNETSCAPE2.0\x03\x01\0\0\0'  # Loop forever
+    for left, top, indices in images:
+        h, w = indices.shape
+        # Graphic control: keep the previous frame under the next one, no transparency
+        yield b'!\xf9\x04\x04' + delay.to_bytes(2, 'little') + b'\0\0'
+        yield (b',' + left.to_bytes(2, 'little') + top.to_bytes(2, 'little') + w.to_bytes(2, 'little')
+               + h.to_bytes(2, 'little') + b'\0')
+        yield b'\x08' + _sub_blocks(_lzw(np.ascontiguousarray(indices).tobytes()))
+    yield b';'
+
+
+def _gif_images(base, cells, every, scale):
+    for step, canvas, (x0, x1, y0, y1) in frames(base, cells, every):
+        yield y0 * scale, x0 * scale, upscale(canvas[x0:x1, y0:y1], scale)
+
+
+def _png_blocks(rgb):
+    for x0 in range(0, rgb.shape[0], qTableReport.block_rows):
+        yield rgb[x0:x0 + qTableReport.block_rows]
+
+
+def write_gif(filename, base, cells, every=1, scale=1, fps=10):
+    rows, cols = base.shape
+    if max(rows, cols) * scale > 0xFFFF:
+        raise ValueError(f"a {rows}x{cols} grid at scale {scale} is too large for a GIF")
+    delay = max(1, round(100 / fps))
+    with open(filename, 'wb') as f:
+        for chunk in gif_chunks(cols * scale, rows * scale, _gif_images(base, cells, every, scale), delay):
+            f.write(chunk)
+
+
+def write_mp4(filename, base, cells, every=1, scale=1, fps=10):
+    # Raw RGB frames piped into ffmpeg, padded to even sizes for yuv420p
+    if shutil.which('ffmpeg') is None:
+        raise RuntimeError("writing .mp4 needs the ffmpeg executable on the PATH, write .gif or PNG frames instead")
+    rows, cols = base.shape
+    colors = palette()
+    command = ['ffmpeg', '-y', '-loglevel', 'error', '-f', 'rawvideo', '-pix_fmt', 'rgb24',
+               '-s', f'{cols * scale}x{rows * scale}', '-r', str(fps), '-i', '-',
+               '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2', '-pix_fmt', 'yuv420p', filename]
+    process = subprocess.Popen(command, stdin=subprocess.PIPE)
+    try:
+        for _, canvas, _ in frames(base, cells, every):
+            process.stdin.write(colors[upscale(canvas, scale)].tobytes())
+    finally:
+        process.stdin.close()
+        if process.wait():
+            raise RuntimeError(f"ffmpeg failed writing {filename}")
+
+
+def write_png_frames(directory, base, cells, every=1, scale=1):
+    os.makedirs(directory, exist_ok=True)
+    rows, cols = base.shape
+    colors = palette()
+    for step, canvas, _ in frames(base, cells, every):
+        rgb = colors[upscale(canvas, scale)]
+        with open(os.path.join(directory, f'frame{step:05d}.png'), 'wb') as f:
+            for chunk in qTableReport.png_chunks(cols * scale, rows * scale, _png_blocks(rgb)):
+                f.write(chunk)
+
+
+def render_trajectory(filename, base, cells, every=1, scale=1, fps=10):
+    # One episode to filename, the format picked by its extension. Returns
+    # the number of frames.
+    cells = trajectory_cells(cells)
+    extension = os.path.splitext(filename)[1].lower()
+    if extension == '.gif':
+        write_gif(filename, base, cells, every, scale, fps)
+    elif extension == '.mp4':
+        write_mp4(filename, base, cells, every, scale, fps)
+    else:
+        write_png_frames(filename, base, cells, every, scale)
+    return len(frame_steps(len(cells), every))
+
+
+def _render_task(task):
+    return render_trajectory(*task)
+
+
+def default_scale(grid_size, size=400):
+    # Pixels per cell for an image about size pixels across, like QTableGui's window
+    return max(1, size // max(grid_size))
+
+
+def render_trajectories(q_table, paths, start, goals, obstacles, output_dir='.', format='gif', every=1, scale=None,
+                        fps=10, snapshots=None, n_workers=None):
+    # Renders every path of paths ({episode: path}, see trajectory_cells)
+    # into output_dir as episode<episode>.gif / .mp4, or a directory
+    # episode<episode> of PNG frames for format 'png'. The background is the
+    # heatmap of snapshots[episode] when given ({episode: Q-table}, like the
+    # QTableEpisode<episode>.json files of the GUI script), else of q_table.
+    # Returns {episode: (filename, frames)}.
+    os.makedirs(output_dir, exist_ok=True)
+    snapshots = snapshots or {}
+    scale = scale or default_scale(q_table.grid_size)
+    final_base = background(q_table, start, goals, obstacles)
+    tasks = {}
+    for episode, path in paths.items():
+        cells = trajectory_cells(path)
+        if cells.size and ((cells < 0).any() or (cells >= q_table.grid_size).any()):
+            raise ValueError(f"episode {episode} leaves the {q_table.grid_size[0]}x{q_table.grid_size[1]} grid")
+        base = background(snapshots[episode], start, goals, obstacles) if episode in snapshots else final_base
+        name = f'episode{episode}' if format == 'png' else f'episode{episode}.{format}'
+        tasks[episode] = (os.path.join(output_dir, name), base, cells, every, scale, fps)
+
+    if n_workers == 1 or len(tasks) < 2:
+        counts = [_render_task(task) for task in tasks.values()]
+    else:
+        with ProcessPoolExecutor(n_workers) as executor:
+            counts = list(executor.map(_render_task, tasks.values()))
+    return {episode: (task[0], count) for (episode, task), count in zip(tasks.items(), counts)}
+
+
+def module_layout(module):
+    # Start, goals and obstacles of a training script, for the backgrounds
+    start = module.start_positions[0] if hasattr(module, 'start_positions') else module.start
+    goals = module.goals if hasattr(module, 'goals') else [module.goal]
+    return start, goals, getattr(module, 'obstacles', [])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render recorded training episodes without a display")
+    parser.add_argument('trajectories', help="file written by TrajectoryRecorder.save")
+    parser.add_argument('q_table', help="final Q-table, JSON or binary checkpoint")
+    parser.add_argument('--module', default='reinforcementLearningWithGui',
+                        help="training script whose start, goals and obstacles are drawn")
+    parser.add_argument('--snapshots', default=None,
+                        help="per episode Q-tables as a pattern like QTableEpisode{episode}.json, "
+                             "missing ones are skipped")
+    parser.add_argument('--output-dir', default='frames')
+    parser.add_argument('--format', default='gif', choices=['gif', 'mp4', 'png'])
+    parser.add_argument('--every', type=int, default=1, help="render every n-th step")
+    parser.add_argument('--scale', type=int, default=None, help="pixels per cell")
+    parser.add_argument('--fps', type=int, default=10)
+    parser.add_argument('--workers', type=int, default=None, help="process pool size, defaults to the CPU count")
+    args = parser.parse_args(argv)
+
+    start, goals, obstacles = module_layout(importlib.import_module(args.module))
+    trajectories = load_trajectories(args.trajectories)
+    snapshots = {}
+    if args.snapshots:
+        for episode in trajectories:
+            filename = args.snapshots.format(episode=episode)
+            if os.path.exists(filename):
+                snapshots[episode] = checkpoint.load_q_table(filename)
+    rendered = render_trajectories(checkpoint.load_q_table(args.q_table), trajectories, start, goals, obstacles,
+                                   args.output_dir, args.format, args.every, args.scale, args.fps, snapshots,
+                                   args.workers)
+    for episode, (filename, count) in rendered.items():
+        print(f"episode {episode}: {count} frames -> {filename}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())